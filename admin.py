@@ -5,12 +5,20 @@ This module contains the routes and functionality for the admin dashboard.
 """
 import os
 import time
+import telebot
 from functools import wraps
 from datetime import datetime
-from flask import render_template, request, redirect, url_for, session, flash, jsonify
+from flask import render_template, request, redirect, url_for, session, flash, jsonify, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import app, db
-from models import User, Buff, ShopItem, Stats, Admin, AdminLoginAttempt
+from models import User, Buff, ShopItem, Stats, Admin, AdminLoginAttempt, BroadcastJob
+from stats_buffer import stats_buffer
+from leaderboard import load_top_users
+from shop_catalog import shop_catalog
+from cooldown import cooldown_cache
+from admin_queries import USER_SORT_KEYS, user_filters, user_order
+from export_engine import EXPORT_TABLES, EXPORT_FORMATS, export_stream, export_filename
+from broadcast import create_broadcast, start_broadcast, start_resumer, cancel_broadcast, broadcast_status
 
 # Secret key for session
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'development_key')
@@ -112,7 +120,7 @@ def admin_dashboard():
     latest_users = User.query.order_by(User.created_at.desc()).limit(5).all()
     
     # Get top users
-    top_users = User.query.order_by(User.deliveries.desc()).limit(10).all()
+    top_users = load_top_users(10)
     
     # System information
     import psutil
@@ -161,32 +169,9 @@ def admin_users():
     sort = request.args.get('sort', 'newest')
     
     # Build query
-    query = User.query
-    
-    # Apply search filter
-    if search:
-        query = query.filter(
-            (User.username.ilike(f'%{search}%')) | 
-            (User.telegram_id.ilike(f'%{search}%'))
-        )
-    
-    # Apply status filter
-    if status == 'active':
-        query = query.filter_by(blocked=False, is_admin=False)
-    elif status == 'blocked':
-        query = query.filter_by(blocked=True)
-    elif status == 'admin':
-        query = query.filter_by(is_admin=True)
-    
-    # Apply sorting
-    if sort == 'newest':
-        query = query.order_by(User.created_at.desc())
-    elif sort == 'oldest':
-        query = query.order_by(User.created_at.asc())
-    elif sort == 'deliveries':
-        query = query.order_by(User.deliveries.desc())
-    elif sort == 'money':
-        query = query.order_by(User.money.desc())
+    if sort not in USER_SORT_KEYS:
+        sort = 'newest'
+    query = User.query.filter(*user_filters(search, status)).order_by(*user_order(sort))
     
     # Count total users for pagination
     total_users = query.count()
@@ -210,14 +195,28 @@ def admin_edit_user(user_id):
     user = User.query.get_or_404(user_id)
     
     if request.method == 'POST':
+        # Counters must be non-negative integers (the leaderboard buckets users by deliveries)
+        try:
+            money = int(request.form.get('money', user.money))
+            deliveries = int(request.form.get('deliveries', user.deliveries))
+            experience = int(request.form.get('experience', user.experience))
+        except ValueError:
+            money = deliveries = experience = -1
+        if min(money, deliveries, experience) < 0:
+            flash('Деньги, доставки и опыт должны быть неотрицательными целыми числами', 'danger')
+            return redirect(url_for('admin_edit_user', user_id=user_id))
+        
         user.username = request.form.get('username', user.username)
-        user.money = int(request.form.get('money', user.money))
-        user.deliveries = int(request.form.get('deliveries', user.deliveries))
-        user.experience = int(request.form.get('experience', user.experience))
+        user.money = money
+        user.deliveries = deliveries
+        user.experience = experience
+        blocked_changed = user.blocked != ('blocked' in request.form)
         user.blocked = 'blocked' in request.form
         user.is_admin = 'is_admin' in request.form
         
         db.session.commit()
+        if blocked_changed:
+            cooldown_cache.invalidate()
         flash('Пользователь успешно обновлен', 'success')
         return redirect(url_for('admin_users'))
     
@@ -234,6 +233,7 @@ def admin_delete_user(user_id):
     user = User.query.get_or_404(user_id)
     db.session.delete(user)
     db.session.commit()
+    cooldown_cache.invalidate()
     flash('Пользователь успешно удален', 'success')
     return redirect(url_for('admin_users'))
 
@@ -244,6 +244,7 @@ def admin_block_user(user_id):
     user = User.query.get_or_404(user_id)
     user.blocked = True
     db.session.commit()
+    cooldown_cache.invalidate()
     flash('Пользователь заблокирован', 'success')
     return redirect(url_for('admin_users'))
 
@@ -254,6 +255,7 @@ def admin_unblock_user(user_id):
     user = User.query.get_or_404(user_id)
     user.blocked = False
     db.session.commit()
+    cooldown_cache.invalidate()
     flash('Пользователь разблокирован', 'success')
     return redirect(url_for('admin_users'))
 
@@ -284,6 +286,9 @@ def admin_shop_add():
         )
         db.session.add(item)
         db.session.commit()
+        
+        # Make the bots reload the shop
+        shop_catalog.invalidate()
         flash('Предмет успешно добавлен', 'success')
         return redirect(url_for('admin_shop'))
     
@@ -304,6 +309,13 @@ def admin_stats():
         db.session.add(stats)
         db.session.commit()
     
+    # Add the increments still buffered in memory
+    pending = stats_buffer.pending()
+    totals = stats.to_dict()
+    totals["total_users"] += pending["new_users"]
+    totals["total_deliveries"] += pending["deliveries"]
+    totals["total_money"] += pending["earnings"]
+    
     # Get daily stats
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     today_timestamp = today.timestamp()
@@ -316,8 +328,9 @@ def admin_stats():
     
     return render_template(
         'admin/stats.html',
-        stats=stats,
+        stats=totals,
         daily_stats=daily_stats,
+        flush_metrics=stats_buffer.metrics(),
         admin_name=session.get('admin_name', 'Админ')
     )
 
@@ -335,32 +348,106 @@ def admin_settings():
 def admin_broadcast():
     """Admin broadcast message page."""
     if request.method == 'POST':
-        message = request.form.get('message')
-        send_to_all = 'send_to_all' in request.form
+        message = request.form.get('message', '')
         send_to_active = 'send_to_active' in request.form
         
-        # In a real implementation, this would send messages via the Telegram bot
-        # For now, we'll just show a success message
+        bot = _broadcast_bot()
+        if bot is None:
+            flash('Не задан токен бота, рассылка невозможна', 'danger')
+            return redirect(url_for('admin_broadcast'))
+        
+        try:
+            job = create_broadcast(
+                message,
+                target='active' if send_to_active else 'all',
+                created_by=session.get('admin_name')
+            )
+        except ValueError:
+            flash('Введите текст сообщения', 'danger')
+            return redirect(url_for('admin_broadcast'))
+        
+        # Messages are sent in the background at Telegram's rate limit
+        start_broadcast(app, bot, job.id)
         
-        target = "всем пользователям" if send_to_all else "активным пользователям"
-        flash(f'Сообщение успешно отправлено {target}', 'success')
-        return redirect(url_for('admin_dashboard'))
+        target = "активным пользователям" if send_to_active else "всем пользователям"
+        flash(f'Рассылка #{job.id} {target} запущена', 'success')
+        return redirect(url_for('admin_broadcast'))
     
+    jobs = BroadcastJob.query.order_by(BroadcastJob.id.desc()).limit(20).all()
     return render_template(
         'admin/broadcast.html',
+        jobs=jobs,
         admin_name=session.get('admin_name', 'Админ')
     )
 
+@app.route('/admin/broadcast/<int:job_id>')
+@admin_required
+def admin_broadcast_status(job_id):
+    """Broadcast progress with recipient counts by status."""
+    status = broadcast_status(job_id)
+    if status is None:
+        return jsonify({'error': 'Broadcast not found'}), 404
+    return jsonify(status)
+
+@app.route('/admin/broadcast/<int:job_id>/cancel', methods=['POST'])
+@admin_required
+def admin_broadcast_cancel(job_id):
+    """Cancel a broadcast."""
+    if cancel_broadcast(job_id):
+        flash(f'Рассылка #{job_id} отменена', 'success')
+    else:
+        flash(f'Рассылка #{job_id} уже завершена', 'warning')
+    return redirect(url_for('admin_broadcast'))
+
+_bot = None
+
+def _broadcast_bot():
+    """Bot used for sending broadcasts, or None without a token."""
+    global _bot
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if _bot is None and token:
+        _bot = telebot.TeleBot(token, threaded=False)
+    return _bot
+
 @app.route('/admin/export_data')
 @admin_required
 def admin_export_data():
-    """Export data as JSON."""
+    """
+    Export data.
+
+    Users, buffs and login attempts are streamed (see export_engine.py) in
+    the format given by ?format= (json, ndjson or csv), starting after
+    ?after_id= and limited by ?limit=. ?gzip=1 downloads a .gz file.
+    """
     data_type = request.args.get('type', 'users')
     
-    if data_type == 'users':
-        users = User.query.all()
-        data = [user.to_dict() for user in users]
-    elif data_type == 'shop':
+    if data_type in EXPORT_TABLES:
+        fmt = request.args.get('format', 'json')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'Invalid format'}), 400
+        try:
+            after_id = int(request.args.get('after_id', 0))
+            limit = request.args.get('limit', type=int)
+        except ValueError:
+            return jsonify({'error': 'Invalid after_id'}), 400
+        
+        # Either a .gz file or transparent compression for clients that accept it
+        gzip_file = request.args.get('gzip') == '1'
+        gzip_encoding = not gzip_file and 'gzip' in request.accept_encodings
+        
+        response = Response(
+            export_stream(db.engine, data_type, fmt, after_id=after_id, limit=limit,
+                          compress=gzip_file or gzip_encoding),
+            mimetype='application/gzip' if gzip_file else EXPORT_FORMATS[fmt]
+        )
+        filename = export_filename(data_type, fmt, after_id, compress=gzip_file)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if gzip_encoding:
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers['Vary'] = 'Accept-Encoding'
+        return response
+    
+    if data_type == 'shop':
         items = ShopItem.query.all()
         data = [item.to_dict() for item in items]
     elif data_type == 'stats':
@@ -374,5 +461,7 @@ def admin_export_data():
 # Add the admin routes to the main app
 def init_admin():
     """Initialize admin module."""
-    # This function can be used to perform any one-time setup
-    pass
\ No newline at end of file
+    # Resume broadcasts interrupted by a restart or left behind by a crashed process
+    bot = _broadcast_bot()
+    if bot is not None:
+        start_resumer(app, bot)
\ No newline at end of file
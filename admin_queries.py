@@ -0,0 +1,170 @@
+"""
+Admin Queries Module
+
+This module holds the read queries of the admin panel and the dashboard.
+Users are listed together with their buff counts in a single statement:
+the page of users is selected first (filtered, sorted and limited), then
+LEFT JOINed with buffs and grouped, so a page costs one query no matter
+how many users it has.
+
+Pages are addressed with keyset cursors (the sort value and id of the last
+row) instead of offsets, so deep pages are as cheap as the first one.
+"""
+import json
+import time
+import base64
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import and_, or_, select, func
+from models import User, Buff
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sort keys: column and whether it is sorted descending (ties are broken by id)
+USER_SORT_KEYS = {
+    'deliveries': (User.deliveries, True),
+    'money': (User.money, True),
+    'last_delivery': (User.last_delivery, True),
+    'newest': (User.created_at, True),
+    'oldest': (User.created_at, False),
+}
+
+# Maximum page size of the user listing
+MAX_PAGE_SIZE = 500
+
+
+def user_filters(search: str = '', status: str = '') -> List[Any]:
+    """Build the WHERE conditions of the admin user search."""
+    conditions = []
+    if search:
+        conditions.append(
+            (User.username.ilike(f'%{search}%')) |
+            (User.telegram_id.ilike(f'%{search}%'))
+        )
+
+    if status == 'active':
+        conditions.extend([User.blocked == False, User.is_admin == False])  # noqa: E712
+    elif status == 'blocked':
+        conditions.append(User.blocked == True)  # noqa: E712
+    elif status == 'admin':
+        conditions.append(User.is_admin == True)  # noqa: E712
+    return conditions
+
+
+def user_order(sort: str, table=None) -> List[Any]:
+    """ORDER BY clause for a sort key, on the users table or a subquery of it."""
+    column, descending = USER_SORT_KEYS[sort]
+    columns = table.c if table is not None else User.__table__.c
+    keys = [columns[column.key], columns.id]
+    return [key.desc() if descending else key.asc() for key in keys]
+
+
+def encode_cursor(row: Dict[str, Any], sort: str) -> str:
+    """Cursor pointing after the given row."""
+    column, _ = USER_SORT_KEYS[sort]
+    data = json.dumps([row[column.key], row['id']]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """
+    Decode a cursor made by encode_cursor.
+
+    Raises:
+        ValueError: Malformed cursor
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, last_id = json.loads(data)
+        return value, int(last_id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _after(sort: str, cursor: str):
+    """Keyset condition selecting the rows after the cursor."""
+    column, descending = USER_SORT_KEYS[sort]
+    value, last_id = decode_cursor(cursor)
+
+    # The bound on the sort column alone lets the database seek its index
+    if descending:
+        return and_(column <= value, or_(column < value, User.id < last_id))
+    return and_(column >= value, or_(column > value, User.id > last_id))
+
+
+def users_with_buffs_query(sort: str = 'deliveries', limit: int = 100, after: Optional[str] = None,
+                           search: str = '', status: str = '', now: Optional[float] = None):
+    """
+    Build the statement listing a page of users with their buff counts.
+
+    Raises:
+        ValueError: Unknown sort key or malformed cursor
+    """
+    if sort not in USER_SORT_KEYS:
+        raise ValueError(f"Unknown sort key: {sort}")
+    now = time.time() if now is None else now
+
+    conditions = user_filters(search, status)
+    if after:
+        conditions.append(_after(sort, after))
+
+    # Page of users first, so only its buffs get joined and counted
+    page = (
+        select(User.__table__)
+        .where(*conditions)
+        .order_by(*user_order(sort))
+        .limit(limit)
+        .subquery('page')
+    )
+
+    active = Buff.expires_at > now
+    return (
+        select(
+            page,
+            func.count(Buff.id).filter(active).label('active_buffs_count'),
+            func.coalesce(func.sum(Buff.bonus).filter(active), 0).label('active_bonus'),
+            func.count(Buff.id).label('buffs_total')
+        )
+        .select_from(page.outerjoin(Buff.__table__, Buff.user_id == page.c.id))
+        .group_by(*page.c)
+        .order_by(*user_order(sort, page))
+    )
+
+
+def list_users_with_buffs(conn, sort: str = 'deliveries', limit: int = 100,
+                          after: Optional[str] = None, search: str = '', status: str = '',
+                          now: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    List users with their buff counts in one query.
+
+    Each user dict has the User.to_dict() fields plus active_buffs_count,
+    active_bonus (sum of active buff bonuses), buffs_total and
+    last_delivery_time.
+
+    Args:
+        conn: Session or connection to run the query on
+        sort: Key of USER_SORT_KEYS
+        after: Cursor returned with the previous page
+
+    Returns:
+        Tuple of (users, cursor of the next page or None)
+
+    Raises:
+        ValueError: Unknown sort key or malformed cursor
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    query = users_with_buffs_query(sort, limit, after, search, status, now)
+
+    users = []
+    for row in conn.execute(query).mappings():
+        user = dict(row)
+        user['last_delivery_time'] = (
+            datetime.fromtimestamp(user['last_delivery']).strftime("%d.%m.%Y %H:%M:%S")
+            if user['last_delivery'] else "-"
+        )
+        users.append(user)
+
+    next_cursor = encode_cursor(users[-1], sort) if len(users) == limit else None
+    return users, next_cursor
@@ -2,6 +2,9 @@ import os
 from flask import Flask, render_template
 from dotenv import load_dotenv
 from models import db
+import database
+import tracing
+from migrations import run_migrations
 
 # Load environment variables from .env file
 load_dotenv()
@@ -10,20 +13,16 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "delivery_bot_secret_key")
 
-# Configure the database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///delivery_bot.db")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Configure the database (one engine for the bot and the web app)
+database.init_app(app)
 
-# Initialize the database
-db.init_app(app)
+# Trace requests and serve the metrics on /metrics
+tracing.init_app(app)
 
 # Create the database tables
 with app.app_context():
     db.create_all()
+    run_migrations(db.engine)
 
 # Import and register blueprints
 from dashboard import dashboard_bp
@@ -0,0 +1,523 @@
+"""
+Async Bot Module
+
+This module runs the bot on asyncio (BOT_RUNTIME=async) instead of worker
+threads. The handlers of handlers.py are ported to coroutines on
+AsyncTeleBot and async_user_data, and share its messages and keyboards. A
+handler waiting for the Bot API or the database yields the event loop, so
+one process handles thousands of concurrent updates without a thread per
+request.
+
+Like the threaded dispatcher (see dispatcher.py), updates of one user run
+in order while updates of different users run concurrently, at most
+ASYNC_MAX_CONCURRENT_UPDATES at a time. Updates arrive by long polling or,
+with BOT_MODE=webhook, on an aiohttp endpoint that answers 503 when the
+bot is at its limit.
+"""
+import hmac
+import time
+import random
+import signal
+import asyncio
+import secrets
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiohttp import web
+from telebot import types, asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from config import (
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    UPDATE_DRAIN_TIMEOUT,
+    ASYNC_MAX_CONCURRENT_UPDATES,
+    ASYNC_BOT_API_CONNECTIONS
+)
+from dispatcher import Histogram, WAIT_BUCKETS_MS, update_user_id
+from webhook import SECRET_HEADER, RETRY_AFTER
+from handlers import (
+    NAME_PROMPT, NAME_INVALID, BLOCKED_MESSAGE,
+    name_changed_message, welcome_message, cooldown_message, delivery_message,
+    top_message, rank_message, profile_message, profile_keyboard,
+    parse_shop_callback, shop_keyboard, shop_caption
+)
+from async_user_data import (
+    init_engine, dispose_engine,
+    get_user_data, deliver, get_top_users, get_user_rank,
+    get_shop_item, get_shop_items_count, purchase_buff, get_active_buffs_info
+)
+from delivery_image import get_delivery_photo
+from media_registry import send_photo_async, edit_message_photo_async
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+BOT_COMMANDS = [
+    ("start", "Начать использование бота"),
+    ("raznos", "Разносить посылки"),
+    ("top", "Список лучших курьеров"),
+    ("rank", "Ваше место в рейтинге"),
+    ("profile", "Ваш профиль"),
+    ("magaz", "Магазин улучшений")
+]
+
+
+class AsyncUpdateDispatcher:
+    """Per-user ordered processing of updates as asyncio tasks."""
+
+    def __init__(self, process: Callable[[Any], Awaitable[None]],
+                 max_concurrent: int = ASYNC_MAX_CONCURRENT_UPDATES,
+                 key: Callable[[Any], Any] = update_user_id, name: str = "async"):
+        """
+        Args:
+            process: Coroutine function called with each update
+            max_concurrent: Maximum number of updates accepted and not yet processed
+            key: Function mapping an update to its lane
+        """
+        self.process = process
+        self.key = key
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self._slots = asyncio.Semaphore(self.max_concurrent)
+        self._lanes: Dict[Any, list] = {}  # key -> [lock, updates holding it or waiting]
+        self._tasks = set()
+        self._accepting = True
+
+        # Metrics
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._wait_ms = Histogram(WAIT_BUCKETS_MS)
+        self._process_ms = Histogram(WAIT_BUCKETS_MS)
+
+    @property
+    def accepting(self) -> bool:
+        return self._accepting
+
+    @property
+    def full(self) -> bool:
+        return self._slots.locked()
+
+    async def submit(self, update, block: bool = True) -> bool:
+        """
+        Start processing an update behind the earlier updates of its user.
+
+        Args:
+            block: Wait for a free slot instead of rejecting when the dispatcher is full
+
+        Returns:
+            False if the update was rejected (full or draining)
+        """
+        if not self._accepting or (not block and self.full):
+            self.rejected += 1
+            return False
+        await self._slots.acquire()
+        if not self._accepting:
+            self._slots.release()
+            return False
+
+        key = self.key(update)
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = [asyncio.Lock(), 0]
+        lane[1] += 1
+
+        self.accepted += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+        # asyncio.Lock wakes its waiters in FIFO order, which keeps the lane ordered
+        task = asyncio.create_task(self._run(key, lane, update, time.monotonic()))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, key, lane, update, queued_at: float) -> None:
+        try:
+            async with lane[0]:
+                started = time.monotonic()
+                try:
+                    await self.process(update)
+                    failed = False
+                except Exception as e:
+                    logger.error(f"Error processing update {getattr(update, 'update_id', '?')}: {e}")
+                    failed = True
+                finished = time.monotonic()
+        finally:
+            lane[1] -= 1
+            # Lanes exist only while they have updates
+            if not lane[1]:
+                del self._lanes[key]
+            self.in_flight -= 1
+            self._slots.release()
+
+        self.processed += 1
+        self.failed += failed
+        self._wait_ms.observe((started - queued_at) * 1000)
+        self._process_ms.observe((finished - started) * 1000)
+
+    async def drain(self, timeout: float = 30) -> bool:
+        """
+        Stop accepting updates and wait for the started ones to finish.
+
+        Returns:
+            True if everything was processed within the timeout
+        """
+        self._accepting = False
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                logger.warning(f"{self.name}: drain timed out with {len(pending)} updates unprocessed")
+                return False
+        logger.info(f"{self.name}: stopped after processing {self.processed} updates")
+        return True
+
+    def metrics(self) -> Dict[str, Any]:
+        """Concurrency counters and wait / processing time histograms."""
+        return {
+            "runtime": "async",
+            "accepting": self._accepting,
+            "capacity": self.max_concurrent,
+            "lanes": len(self._lanes),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "processed": self.processed,
+            "failed": self.failed,
+            "wait_ms": self._wait_ms.snapshot(),
+            "process_ms": self._process_ms.snapshot()
+        }
+
+
+def create_async_dispatcher(bot: AsyncTeleBot,
+                            max_concurrent: int = ASYNC_MAX_CONCURRENT_UPDATES) -> AsyncUpdateDispatcher:
+    """Create a dispatcher handling updates of the bot."""
+    async def process(update):
+        await bot.process_new_updates([update])
+
+    return AsyncUpdateDispatcher(process, max_concurrent=max_concurrent)
+
+
+def register_handlers(bot: AsyncTeleBot) -> None:
+    """Registers the handlers of handlers.py as coroutines."""
+    bot.register_message_handler(start_command, commands=['start'], pass_bot=True)
+    bot.register_message_handler(raznos_command, commands=['raznos'], pass_bot=True)
+    bot.register_message_handler(top_command, commands=['top'], pass_bot=True)
+    bot.register_message_handler(rank_command, commands=['rank'], pass_bot=True)
+    bot.register_message_handler(profile_command, commands=['profile'], pass_bot=True)
+    bot.register_message_handler(shop_command, commands=['magaz'], pass_bot=True)
+
+    # AsyncTeleBot has no next step handlers, the new name is recognized as the reply to the prompt
+    bot.register_message_handler(
+        process_name_change,
+        func=lambda message: message.reply_to_message is not None
+        and message.reply_to_message.text == NAME_PROMPT,
+        pass_bot=True
+    )
+
+    bot.register_callback_query_handler(
+        change_name_callback, func=lambda call: call.data == "change_name", pass_bot=True
+    )
+    bot.register_callback_query_handler(
+        shop_callback, func=lambda call: call.data.startswith("shop_"), pass_bot=True
+    )
+
+
+async def change_name_callback(call, bot):
+    # Answer the callback query to stop the loading animation
+    await bot.answer_callback_query(call.id)
+
+    # Ask for a new name
+    await bot.send_message(
+        call.message.chat.id,
+        NAME_PROMPT,
+        reply_markup=types.ForceReply(selective=True)
+    )
+
+
+async def shop_callback(call, bot):
+    user_id = call.from_user.id
+    chat_id = call.message.chat.id
+    message_id = call.message.message_id
+
+    # Answer the callback query to stop the loading animation
+    await bot.answer_callback_query(call.id)
+
+    action, current_pos = parse_shop_callback(call.data)
+
+    if action == "prev":
+        # Move to previous item
+        current_pos = (current_pos - 1) % await get_shop_items_count()
+    elif action == "next":
+        # Move to next item
+        current_pos = (current_pos + 1) % await get_shop_items_count()
+    elif action == "buy":
+        # Attempt to buy the item
+        success, message = await purchase_buff(user_id, current_pos)
+        await bot.send_message(chat_id, message)
+
+    # Display the item (with the updated balance after a purchase)
+    await show_shop_item(bot, chat_id, user_id, current_pos, message_id)
+
+
+async def process_name_change(message, bot):
+    """Process the name change request."""
+    user_id = message.from_user.id
+    new_name = (message.text or "").strip()
+
+    # Validate name
+    if not new_name or len(new_name) > 20:
+        await bot.send_message(message.chat.id, NAME_INVALID)
+        return
+
+    # Update user data with new name
+    user_data = await get_user_data(user_id)
+    user_data["username"] = new_name
+
+    # Confirm the change
+    await bot.send_message(message.chat.id, name_changed_message(new_name), parse_mode="Markdown")
+
+
+async def start_command(message, bot):
+    """Handle the /start command."""
+    user_id = message.from_user.id
+    first_name = message.from_user.first_name
+
+    # Store username in user data
+    data = await get_user_data(user_id)
+    data["username"] = first_name
+
+    await bot.send_message(message.chat.id, welcome_message(first_name), parse_mode="Markdown")
+
+
+async def raznos_command(message, bot):
+    """Handle the /raznos command."""
+    user_id = message.from_user.id
+
+    # Generate random delivery data
+    deliveries = random.randint(1, 3)
+    base_earnings = random.randint(35, 200)
+
+    # Check cooldown, apply buffs and update user data in one transaction
+    result = await deliver(user_id, deliveries, base_earnings)
+
+    if not result["delivered"]:
+        if not result["time_remaining"]:
+            # Blocked users can't make deliveries
+            await bot.send_message(message.chat.id, BLOCKED_MESSAGE)
+            return
+
+        # User is in cooldown, inform them of the remaining time
+        await bot.send_message(
+            message.chat.id,
+            cooldown_message(result["time_remaining"]),
+            parse_mode="Markdown"
+        )
+        return
+
+    # Send the image with caption
+    await send_photo_async(
+        bot,
+        message.chat.id,
+        get_delivery_photo(),
+        caption=delivery_message(result, deliveries)
+    )
+
+
+async def top_command(message, bot):
+    """Handle the /top command."""
+    top_users = await get_top_users(5)
+    await bot.send_message(message.chat.id, top_message(top_users), parse_mode="Markdown")
+
+
+async def rank_command(message, bot):
+    """Handle the /rank command."""
+    rank = await get_user_rank(message.from_user.id)
+    await bot.send_message(message.chat.id, rank_message(rank), parse_mode="Markdown")
+
+
+async def profile_command(message, bot):
+    """Handle the /profile command."""
+    user_id = message.from_user.id
+    user_data = await get_user_data(user_id)
+
+    # Get username or default to the one from Telegram
+    username = user_data.get("username", message.from_user.first_name)
+
+    # Get active buffs info
+    active_buffs = await get_active_buffs_info(user_id)
+
+    await bot.send_message(
+        message.chat.id,
+        profile_message(username, user_data, active_buffs),
+        parse_mode="Markdown",
+        reply_markup=profile_keyboard()
+    )
+
+
+async def shop_command(message, bot):
+    """Handle the /magaz command to open the shop."""
+    await show_shop_item(bot, message.chat.id, message.from_user.id, 0)
+
+
+async def show_shop_item(bot, chat_id, user_id, item_index, message_id=None):
+    """Display a shop item with navigation buttons."""
+    items_count = await get_shop_items_count()
+    if items_count:
+        item_index %= items_count
+    item = await get_shop_item(item_index)
+    user_data = await get_user_data(user_id)
+
+    keyboard = shop_keyboard(item_index)
+    caption = shop_caption(item, item_index, items_count, user_data.get('money', 0))
+    photo = get_delivery_photo()
+
+    # Edit the existing message or send a new one
+    try:
+        if message_id:
+            await edit_message_photo_async(
+                bot, chat_id, message_id, photo,
+                caption=caption, parse_mode="Markdown", reply_markup=keyboard
+            )
+        else:
+            await send_photo_async(
+                bot, chat_id, photo,
+                caption=caption, parse_mode="Markdown", reply_markup=keyboard
+            )
+    except Exception as e:
+        logger.error(f"Error showing shop item: {e}")
+
+
+async def run_polling(bot: AsyncTeleBot, dispatcher: AsyncUpdateDispatcher, long_polling_timeout: int = 20,
+                      stop_event: Optional[asyncio.Event] = None) -> None:
+    """Fetch updates with getUpdates and hand them to the dispatcher (see dispatcher.run_polling)."""
+    offset = None
+    while not (stop_event and stop_event.is_set()):
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=long_polling_timeout,
+                request_timeout=long_polling_timeout + 5
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error getting updates: {e}")
+            await asyncio.sleep(3)
+            continue
+
+        for update in updates:
+            # Waits while the dispatcher is full, Telegram keeps the rest
+            if not await dispatcher.submit(update):
+                return
+            offset = update.update_id + 1
+
+
+def create_webhook_app(dispatcher: AsyncUpdateDispatcher, secret: str, path: str = WEBHOOK_PATH) -> web.Application:
+    """Create the aiohttp app with the webhook endpoint and its metrics."""
+    def check_secret(request):
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            raise web.HTTPForbidden()
+
+    async def receive_update(request):
+        """Start processing an update sent by Telegram."""
+        check_secret(request)
+
+        try:
+            update = types.Update.de_json(await request.text())
+        except Exception as e:
+            logger.error(f"Invalid update received: {e}")
+            raise web.HTTPBadRequest()
+
+        if not await dispatcher.submit(update, block=False):
+            # Telegram retries updates that are not answered with 2xx
+            return web.Response(text="busy", status=503, headers={"Retry-After": str(RETRY_AFTER)})
+        return web.Response()
+
+    async def webhook_metrics(request):
+        """Dispatcher metrics (requires the secret token header)."""
+        check_secret(request)
+        return web.json_response(dispatcher.metrics())
+
+    app = web.Application()
+    app.router.add_post(path, receive_update)
+    app.router.add_get(path + '/metrics', webhook_metrics)
+    return app
+
+
+async def run_webhook(bot: AsyncTeleBot, dispatcher: AsyncUpdateDispatcher, stop_event: asyncio.Event,
+                      url: str = WEBHOOK_URL, secret: Optional[str] = None) -> None:
+    """Serve updates from a webhook until the stop event is set."""
+    if not url:
+        raise ValueError("WEBHOOK_URL is not set")
+    secret = secret or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    runner = web.AppRunner(create_webhook_app(dispatcher, secret))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    await bot.remove_webhook()
+    await bot.set_webhook(
+        url=url.rstrip('/') + WEBHOOK_PATH,
+        secret_token=secret,
+        max_connections=100
+    )
+    logger.info(f"Webhook set, up to {dispatcher.max_concurrent} concurrent updates")
+
+    try:
+        await stop_event.wait()
+    finally:
+        await runner.cleanup()
+
+
+def create_async_bot(token: str) -> AsyncTeleBot:
+    """Create the AsyncTeleBot with the handlers registered."""
+    # Concurrent requests to the Bot API (the session is created on the first request)
+    asyncio_helper.REQUEST_LIMIT = ASYNC_BOT_API_CONNECTIONS
+    bot = AsyncTeleBot(token)
+    register_handlers(bot)
+    return bot
+
+
+async def run_async_bot(token: str) -> None:
+    """Run the bot on asyncio until SIGINT/SIGTERM (the database must be initialized)."""
+    init_engine()
+    bot = create_async_bot(token)
+    dispatcher = create_async_dispatcher(bot)
+
+    # Stop on SIGINT/SIGTERM
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+    try:
+        await bot.set_my_commands([
+            types.BotCommand(command=command, description=description)
+            for command, description in BOT_COMMANDS
+        ])
+
+        if BOT_MODE == "webhook":
+            logger.info("Starting async webhook server...")
+            await run_webhook(bot, dispatcher, stop_event)
+        else:
+            logger.info("Starting async bot polling...")
+            polling = asyncio.create_task(run_polling(bot, dispatcher, 5, stop_event))
+            await stop_event.wait()
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+    finally:
+        # Finish started updates before closing the connections
+        await dispatcher.drain(UPDATE_DRAIN_TIMEOUT)
+        await bot.close_session()
+        await dispose_engine()
@@ -0,0 +1,425 @@
+"""
+Async User Data Module
+
+Async versions of the user_data functions the bot handlers use, for the
+asyncio runtime (async_bot.py). They run on SQLAlchemy's asyncio engine
+(asyncpg for PostgreSQL, aiosqlite for SQLite), so a handler waiting for
+the database yields the event loop instead of blocking a thread.
+
+The in-memory registries (buffs, leaderboard, shop catalog, cooldowns),
+the stats buffer, the event bus and the snapshot file are the same ones
+user_data uses; they are loaded through the sync engine once, off the
+event loop, and after that answer without touching the database.
+"""
+import time
+import random
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, update, insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from models import db, User, Buff
+from config import (
+    SQLALCHEMY_ENGINE_OPTIONS,
+    ASYNC_DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    LEADERBOARD_TOP_SIZE
+)
+from database import unit_of_work
+from user_data import (
+    DELIVERY_COOLDOWN,
+    load_registries,
+    update_stats,
+    _record_user_snapshot
+)
+from buff_registry import buff_registry, format_buff
+from leaderboard import leaderboard
+from shop_catalog import shop_catalog
+from cooldown import cooldown_cache
+from event_bus import publish
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+_engine: Optional[AsyncEngine] = None
+_session = None
+
+
+def async_database_url(url: str) -> str:
+    """Switch a database URL to the asyncio driver of its backend."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend == "postgresql":
+        # asyncpg takes ssl= instead of libpq's sslmode=
+        query = dict(url.query)
+        if "sslmode" in query:
+            query["ssl"] = query.pop("sslmode")
+        url = url.set(drivername="postgresql+asyncpg", query=query)
+    elif backend == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url.render_as_string(hide_password=False)
+
+
+def init_engine(url: Optional[str] = None) -> AsyncEngine:
+    """Create the async engine (for the database of the shared engine by default)."""
+    global _engine, _session
+    if _engine is None:
+        if url is None:
+            # The URL as resolved by Flask-SQLAlchemy (relative SQLite paths are in the instance folder)
+            with unit_of_work():
+                url = db.engine.url.render_as_string(hide_password=False)
+        _engine = create_async_engine(
+            async_database_url(url),
+            pool_size=ASYNC_DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            **SQLALCHEMY_ENGINE_OPTIONS
+        )
+        _session = async_sessionmaker(_engine, expire_on_commit=False)
+    return _engine
+
+
+async def dispose_engine() -> None:
+    """Close the pooled connections of the async engine."""
+    global _engine, _session
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _session = None
+
+
+def _new_session():
+    if _session is None:
+        init_engine()
+    return _session()
+
+
+async def _ensure_registries() -> None:
+    """Load the registries off the event loop if they aren't (up to date) yet."""
+    if (not buff_registry.loaded or not leaderboard.loaded
+            or shop_catalog.is_stale() or cooldown_cache.is_stale()):
+        await asyncio.to_thread(load_registries)
+
+
+def _new_user(telegram_id: str, now: float) -> Dict[str, Any]:
+    return {
+        "telegram_id": telegram_id,
+        "username": f"Курьер {telegram_id[-4:]}",
+        "deliveries": 0,
+        "money": 0,
+        "experience": 0,
+        "last_delivery": 0,
+        "blocked": False,
+        "created_at": now
+    }
+
+
+def _user_created(user: User) -> None:
+    """Stats, leaderboard, live dashboards and snapshot for a new user."""
+    update_stats(new_user=True)
+    top_changed = leaderboard.add_user(user.id, user.telegram_id, user.username)
+
+    # Notify live dashboards
+    publish("new_user", {"telegram_id": user.telegram_id, "username": user.username})
+    if top_changed:
+        publish("leaderboard", {"top": leaderboard.top(LEADERBOARD_TOP_SIZE)})
+
+    # Save to file for Beget hosting
+    _record_user_snapshot(user, active_buffs=[])
+
+
+async def get_user_data(telegram_id: int) -> Dict[str, Any]:
+    """Get user data or initialize if it doesn't exist."""
+    await _ensure_registries()
+    str_telegram_id = str(telegram_id)
+
+    async with _new_session() as session:
+        user = await session.scalar(select(User).where(User.telegram_id == str_telegram_id))
+
+        # Create new user if not found
+        if user is None:
+            user = User(**_new_user(str_telegram_id, time.time()))
+            session.add(user)
+            try:
+                await session.commit()
+                _user_created(user)
+            except IntegrityError:
+                # Created concurrently by another process
+                await session.rollback()
+                user = await session.scalar(select(User).where(User.telegram_id == str_telegram_id))
+
+        user_data = user.to_dict()
+
+    user_data["active_buffs"] = [format_buff(buff) for buff in buff_registry.active_buffs(str_telegram_id)]
+    return user_data
+
+
+async def can_deliver(telegram_id: int) -> Tuple[bool, Optional[timedelta]]:
+    """Check if a user can make a delivery (answered from the cooldown cache)."""
+    await _ensure_registries()
+    blocked, remaining = cooldown_cache.check(str(telegram_id))
+    if blocked:
+        return False, None
+    if remaining:
+        return False, timedelta(seconds=remaining)
+    return True, None
+
+
+async def deliver(telegram_id: int, deliveries: int, earnings: int) -> Dict[str, Any]:
+    """
+    Perform a delivery in a single transaction (see user_data.deliver).
+
+    Returns:
+        The same dict as user_data.deliver
+    """
+    await _ensure_registries()
+    str_telegram_id = str(telegram_id)
+    now = time.time()
+
+    result = {
+        "delivered": False,
+        "blocked": False,
+        "time_remaining": None,
+        "original_earnings": earnings,
+        "buffed_earnings": 0,
+        "experience_gained": 0
+    }
+
+    # Reject blocked users and running cooldowns without touching the database
+    blocked, remaining = cooldown_cache.check(str_telegram_id, now)
+    if blocked or remaining:
+        result["blocked"] = blocked
+        result["time_remaining"] = timedelta(seconds=remaining) if remaining else None
+        return result
+
+    async with _new_session() as session, session.begin():
+        # Lock the user row
+        row = (await session.execute(
+            select(User.id, User.last_delivery, User.blocked)
+            .where(User.telegram_id == str_telegram_id)
+            .with_for_update(of=User)
+        )).first()
+
+        new_user = row is None
+        if new_user:
+            user_id = await session.scalar(
+                insert(User).values(**_new_user(str_telegram_id, now)).returning(User.id)
+            )
+            last_delivery, blocked = 0, False
+        else:
+            user_id, last_delivery, blocked = row
+
+        # Check if user is blocked
+        if blocked:
+            cooldown_cache.record(str_telegram_id, last_delivery, blocked)
+            result["blocked"] = True
+            return result
+
+        # Check cooldown (the cache may not have seen a delivery made by another process)
+        if last_delivery:
+            time_passed = timedelta(seconds=now - last_delivery)
+            if time_passed < DELIVERY_COOLDOWN:
+                cooldown_cache.record(str_telegram_id, last_delivery)
+                result["time_remaining"] = DELIVERY_COOLDOWN - time_passed
+                return result
+
+        # Calculate earnings with active buffs
+        buffed_earnings = int(earnings * (1 + buff_registry.multiplier(str_telegram_id)))
+        experience_gained = random.randint(1, 3)  # Random experience gain
+
+        # Update the user and read back the new values
+        user_row = (await session.execute(
+            update(User)
+            .where(User.id == user_id)
+            .values(
+                deliveries=User.deliveries + deliveries,
+                money=User.money + buffed_earnings,
+                experience=User.experience + experience_gained,
+                last_delivery=now
+            )
+            .returning(
+                User.telegram_id, User.username, User.deliveries, User.money,
+                User.experience, User.last_delivery, User.blocked, User.created_at
+            )
+            .execution_options(synchronize_session=False)
+        )).first()
+
+    cooldown_cache.record(str_telegram_id, now)
+
+    # Update stats and the leaderboard
+    update_stats(new_user=new_user, deliveries=deliveries, earnings=buffed_earnings)
+    top_changed = leaderboard.record_delivery(
+        user_id,
+        str_telegram_id,
+        user_row.username,
+        None if new_user else user_row.deliveries - deliveries,
+        user_row.deliveries
+    )
+
+    # Notify live dashboards
+    if new_user:
+        publish("new_user", {"telegram_id": str_telegram_id, "username": user_row.username})
+    publish("delivery", {
+        "telegram_id": str_telegram_id,
+        "username": user_row.username,
+        "deliveries": deliveries,
+        "earnings": buffed_earnings,
+        "total_deliveries": user_row.deliveries,
+        "money": user_row.money
+    })
+    if top_changed:
+        publish("leaderboard", {"top": leaderboard.top(LEADERBOARD_TOP_SIZE)})
+
+    # Save to file for Beget hosting
+    _record_user_snapshot(user_row, active_buffs=[] if new_user else None)
+
+    result.update({
+        "delivered": True,
+        "buffed_earnings": buffed_earnings,
+        "experience_gained": experience_gained,
+        "username": user_row.username,
+        "deliveries": user_row.deliveries,
+        "money": user_row.money,
+        "experience": user_row.experience
+    })
+    return result
+
+
+async def get_top_users(limit: int = 5) -> List[Tuple[int, str, int]]:
+    """Get the top users by number of deliveries."""
+    await _ensure_registries()
+    return [
+        (i + 1, user["username"], user["deliveries"])
+        for i, user in enumerate(leaderboard.top(limit))
+    ]
+
+
+async def get_user_rank(telegram_id: int) -> Optional[Dict[str, int]]:
+    """
+    Get the user's position on the leaderboard.
+
+    Returns:
+        Dict with "rank", "total" and "deliveries", or None if the user doesn't exist
+    """
+    await _ensure_registries()
+    async with _new_session() as session:
+        deliveries = await session.scalar(
+            select(User.deliveries).where(User.telegram_id == str(telegram_id))
+        )
+
+    if deliveries is None:
+        return None
+
+    rank, total = leaderboard.rank(deliveries)
+    return {"rank": rank, "total": total, "deliveries": deliveries}
+
+
+async def get_shop_item(index: int) -> Dict[str, Any]:
+    """Get shop item by index."""
+    await _ensure_registries()
+    return shop_catalog.get(index)
+
+
+async def get_all_shop_items() -> List[Dict[str, Any]]:
+    """Get all shop items."""
+    await _ensure_registries()
+    return shop_catalog.items()
+
+
+async def get_shop_items_count() -> int:
+    """Get the number of shop items."""
+    await _ensure_registries()
+    return shop_catalog.count()
+
+
+async def purchase_buff(telegram_id: int, item_index: int) -> Tuple[bool, str]:
+    """
+    Attempt to purchase a buff for the user.
+
+    Returns:
+        Tuple of (success, message)
+    """
+    await _ensure_registries()
+    str_telegram_id = str(telegram_id)
+
+    # Get shop item
+    item_data = shop_catalog.get(item_index)
+    if not item_data:
+        return False, "❌ Предмет не найден."
+
+    async with _new_session() as session, session.begin():
+        # Subtract the cost only if the balance covers it
+        user_row = (await session.execute(
+            update(User)
+            .where(User.telegram_id == str_telegram_id, User.money >= item_data["price"])
+            .values(money=User.money - item_data["price"])
+            .returning(
+                User.id, User.telegram_id, User.username, User.deliveries, User.money,
+                User.experience, User.last_delivery, User.blocked, User.created_at
+            )
+            .execution_options(synchronize_session=False)
+        )).first()
+
+        if user_row is None:
+            exists = await session.scalar(select(User.id).where(User.telegram_id == str_telegram_id))
+            if exists is None:
+                return False, "❌ Пользователь не найден."
+            return False, f"❌ Недостаточно денег! Нужно: {item_data['price']} руб."
+
+        # Add buff
+        expires_at = time.time() + (item_data["duration"] * 60)
+        buff = Buff(
+            user_id=user_row.id,
+            buff_type=item_data["item_id"],
+            name=item_data["name"],
+            bonus=item_data["bonus"],
+            expires_at=expires_at
+        )
+        session.add(buff)
+
+    # Register the buff in memory
+    buff_registry.add(str_telegram_id, buff)
+
+    # Update stats
+    update_stats(buffs_purchased=1)
+
+    # Notify live dashboards
+    publish("purchase", {
+        "telegram_id": str_telegram_id,
+        "username": user_row.username,
+        "item_id": item_data["item_id"],
+        "name": item_data["name"],
+        "price": item_data["price"],
+        "expires_at": expires_at
+    })
+
+    # Save to file for Beget hosting
+    active_buffs = [format_buff(b) for b in buff_registry.active_buffs(str_telegram_id)]
+    _record_user_snapshot(user_row, active_buffs=active_buffs)
+
+    return True, f"✅ Вы приобрели {item_data['name']} на {item_data['duration']} минут!"
+
+
+async def get_active_buffs_info(telegram_id: int) -> List[Dict[str, Any]]:
+    """
+    Get information about active buffs for display purposes.
+
+    Returns:
+        List of active buffs with name and remaining time
+    """
+    await _ensure_registries()
+    now = time.time()
+
+    buff_info = []
+    for buff in buff_registry.active_buffs(telegram_id):
+        remaining_seconds = max(0, int(buff["expires_at"] - now))
+        minutes, seconds = divmod(remaining_seconds, 60)
+        buff_info.append({
+            "name": buff["name"],
+            "bonus": int(buff["bonus"] * 100),
+            "remaining_time": f"{minutes}м {seconds}с"
+        })
+    return buff_info
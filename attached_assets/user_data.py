@@ -1,15 +1,36 @@
 """
 Module for managing user data.
+
+Changes are appended to a journal as compact JSON lines (one line per
+changed record) instead of rewriting the whole data file. A background
+thread fsyncs the journal in batches and periodically compacts it into
+the data file, which is replaced atomically. On load the data file is
+read and the journal is replayed on top of it.
 """
 import os
 import json
 import time
+import atexit
+import threading
 from datetime import datetime, timedelta
 from typing import Dict, List, Tuple, Optional, Any
 
 # Path to save user data
 DATA_FILE = "data/user_data.json"
 
+# Journal of changes since the data file was last written
+JOURNAL_FILE = "data/user_data.journal"
+JOURNAL_COMPACTING_FILE = JOURNAL_FILE + ".compacting"
+
+# Seconds between fsyncs of the journal (all changes in between share one fsync)
+JOURNAL_FSYNC_INTERVAL = 0.2
+
+# Seconds between compactions of the journal into the data file
+JOURNAL_COMPACT_INTERVAL = 60
+
+# Compact earlier once the journal has this many entries
+JOURNAL_COMPACT_THRESHOLD = 10000
+
 # Shop items with their details
 SHOP_ITEMS = [
     {
@@ -41,6 +62,15 @@ SHOP_ITEMS = [
 # Global variable to store all user data
 USER_DATA = {}
 
+# Journal state
+_journal_lock = threading.Lock()
+_journal_file = None
+_journal_entries = 0
+_journal_unsynced = False
+_journal_thread = None
+_journal_stop = threading.Event()
+_last_compaction = time.time()
+
 # Admin roles
 ROLE_OWNER = "owner"
 ROLE_ADMIN = "admin"
@@ -63,7 +93,7 @@ DEFAULT_ADMINS = {
 }
 
 def _load_data() -> None:
-    """Load user data from file if it exists."""
+    """Load user data from the data file and replay the journal on top of it."""
     global USER_DATA
     
     # Create data directory if it doesn't exist
@@ -73,28 +103,149 @@ def _load_data() -> None:
         if os.path.exists(DATA_FILE):
             with open(DATA_FILE, 'r', encoding='utf-8') as f:
                 USER_DATA = json.load(f)
-                
-                # Make sure to check for admin key
-                if "_admins" not in USER_DATA:
-                    USER_DATA["_admins"] = DEFAULT_ADMINS
         else:
-            # If no existing data, initialize with default admins
-            USER_DATA = {"_admins": DEFAULT_ADMINS}
+            USER_DATA = {}
+        
+        # A leftover .compacting file means a compaction was interrupted
+        for path in (JOURNAL_COMPACTING_FILE, JOURNAL_FILE):
+            _replay_journal(path)
+        
+        # Make sure to check for admin key
+        if "_admins" not in USER_DATA:
+            USER_DATA["_admins"] = DEFAULT_ADMINS
     except Exception as e:
         print(f"Error loading user data: {e}")
         USER_DATA = {"_admins": DEFAULT_ADMINS}
 
-def _save_data() -> None:
-    """Save user data to file."""
+def _replay_journal(path: str) -> None:
+    """Apply the entries of a journal file to USER_DATA."""
+    if not os.path.exists(path):
+        return
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Torn last line after a crash
+                continue
+            
+            # Every entry holds the whole record, so the last one wins
+            if entry["value"] is None:
+                USER_DATA.pop(entry["key"], None)
+            else:
+                USER_DATA[entry["key"]] = entry["value"]
+
+def _save_data(*keys: str) -> None:
+    """Append the current state of the changed records to the journal."""
+    global _journal_file, _journal_entries, _journal_unsynced
+    
     try:
-        # Create data directory if it doesn't exist
-        os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
+        lines = "".join(
+            json.dumps({"key": key, "value": USER_DATA.get(key)},
+                       ensure_ascii=False, separators=(",", ":")) + "\n"
+            for key in keys
+        )
         
-        with open(DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(USER_DATA, f, ensure_ascii=False, indent=2)
+        with _journal_lock:
+            if _journal_file is None:
+                # Create data directory if it doesn't exist
+                os.makedirs(os.path.dirname(JOURNAL_FILE), exist_ok=True)
+                _journal_file = open(JOURNAL_FILE, 'a', encoding='utf-8')
+            
+            # Hand the lines to the OS right away, the fsync is batched
+            _journal_file.write(lines)
+            _journal_file.flush()
+            _journal_entries += len(keys)
+            _journal_unsynced = True
+        
+        _start_journal_thread()
     except Exception as e:
         print(f"Error saving user data: {e}")
 
+def _sync_journal() -> None:
+    """Fsync the journal if there are unsynced changes."""
+    global _journal_unsynced
+    
+    with _journal_lock:
+        if _journal_file is None or not _journal_unsynced:
+            return
+        os.fsync(_journal_file.fileno())
+        _journal_unsynced = False
+
+def _compact_journal() -> None:
+    """Write all user data to the data file and drop the journal."""
+    global _journal_file, _journal_entries, _journal_unsynced, _last_compaction
+    
+    # Rotate the journal so new changes keep flowing during compaction
+    with _journal_lock:
+        _last_compaction = time.time()
+        if _journal_file is None and not os.path.exists(JOURNAL_COMPACTING_FILE):
+            return
+        if _journal_file is not None:
+            _journal_file.flush()
+            os.fsync(_journal_file.fileno())
+            _journal_file.close()
+            _journal_file = None
+        if os.path.exists(JOURNAL_FILE) and not os.path.exists(JOURNAL_COMPACTING_FILE):
+            os.replace(JOURNAL_FILE, JOURNAL_COMPACTING_FILE)
+        _journal_entries = 0
+        _journal_unsynced = False
+    
+    # The data already contains every change of the rotated journal; changes
+    # made meanwhile are also in the new journal and get replayed again
+    for _ in range(3):
+        try:
+            data = json.dumps(USER_DATA, ensure_ascii=False, separators=(",", ":"))
+            break
+        except RuntimeError:
+            # A record changed while it was being serialized
+            continue
+    else:
+        return
+    
+    # Write to a temporary file and atomically swap it in
+    tmp_path = DATA_FILE + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, DATA_FILE)
+    if os.path.exists(JOURNAL_COMPACTING_FILE):
+        os.remove(JOURNAL_COMPACTING_FILE)
+
+def _start_journal_thread() -> None:
+    """Start the background thread that syncs and compacts the journal."""
+    global _journal_thread
+    
+    if _journal_thread is not None:
+        return
+    
+    with _journal_lock:
+        if _journal_thread is not None:
+            return
+        _journal_thread = threading.Thread(target=_journal_loop, daemon=True)
+        _journal_thread.start()
+        atexit.register(_close_journal)
+
+def _journal_loop() -> None:
+    while not _journal_stop.wait(JOURNAL_FSYNC_INTERVAL):
+        try:
+            _sync_journal()
+            if (_journal_entries >= JOURNAL_COMPACT_THRESHOLD or
+                    (_journal_entries and time.time() - _last_compaction >= JOURNAL_COMPACT_INTERVAL)):
+                _compact_journal()
+        except Exception as e:
+            print(f"Error writing user data journal: {e}")
+
+def _close_journal() -> None:
+    """Stop the background thread and compact pending changes."""
+    _journal_stop.set()
+    try:
+        _compact_journal()
+    except Exception as e:
+        print(f"Error compacting user data: {e}")
+
 def get_user_data(user_id: int) -> Dict[str, Any]:
     """Get user data or initialize if it doesn't exist."""
     global USER_DATA
@@ -115,7 +266,7 @@ def get_user_data(user_id: int) -> Dict[str, Any]:
             "last_delivery": 0,    # Timestamp of last delivery
             "buffs": []            # Active buffs
         }
-        _save_data()
+        _save_data(user_id_str)
     
     # Prune expired buffs
     _prune_expired_buffs(user_id_str)
@@ -143,7 +294,7 @@ def update_user_data(user_id: int, deliveries: int, earnings: int) -> Tuple[int,
     user_data['last_delivery'] = time.time()
     
     # Save data
-    _save_data()
+    _save_data(str(user_id))
     
     return original_earnings, buffed_earnings
 
@@ -391,17 +542,9 @@ def purchase_buff(user_id: int, item_index: int) -> Tuple[bool, str]:
     user_data['buffs'].append(buff)
     
     # Save data
-    _save_data()
+    _save_data(str(user_id))
     
-    buff_info = {
-            'name': item.name,
-            'multiplier': item.bonus, 
-            'remaining_minutes': item.duration,
-            'remaining_seconds': 0
-        }
-        buff_info['buff_id'] = item.item_id
-        
-        return True, f"Вы приобрели {item.name} на {item.duration} минут!" {item['name']}! Теперь вы будете получать +{int(item['bonus']*100)}% к доходу от доставок в течение {item['duration']} минут."
+    return True, f"Вы приобрели {item['name']}! Теперь вы будете получать +{int(item['bonus']*100)}% к доходу от доставок в течение {item['duration']} минут."
 
 def get_active_earnings_multiplier(user_id: int) -> float:
     """
@@ -456,13 +599,13 @@ def _prune_expired_buffs(user_id_str: str) -> None:
         return
     
     current_time = time.time()
-    USER_DATA[user_id_str]['buffs'] = [
-        buff for buff in USER_DATA[user_id_str]['buffs']
-        if buff['expires_at'] > current_time
-    ]
+    buffs = USER_DATA[user_id_str]['buffs']
+    active_buffs = [buff for buff in buffs if buff['expires_at'] > current_time]
     
     # Save data if buffs were removed
-    _save_data()
+    if len(active_buffs) != len(buffs):
+        USER_DATA[user_id_str]['buffs'] = active_buffs
+        _save_data(user_id_str)
 
 def get_system_stats() -> Dict[str, Any]:
     """
@@ -562,7 +705,7 @@ def add_admin(added_by_id: int, new_admin_id: int, admin_name: str, role: str =
         "added_at": time.time()
     }
     
-    _save_data()
+    _save_data("_admins")
     return True, f"Администратор {admin_name} успешно добавлен."
 
 def remove_admin(removed_by_id: int, admin_id: int) -> Tuple[bool, str]:
@@ -585,7 +728,7 @@ def remove_admin(removed_by_id: int, admin_id: int) -> Tuple[bool, str]:
     
     # Remove the admin
     del USER_DATA["_admins"][admin_id_str]
-    _save_data()
+    _save_data("_admins")
     
     return True, "Администратор успешно удален."
 
@@ -609,7 +752,7 @@ def update_admin_permissions(updated_by_id: int, admin_id: int, permissions: Dic
     
     # Update permissions
     USER_DATA["_admins"][admin_id_str]["permissions"].update(permissions)
-    _save_data()
+    _save_data("_admins")
     
     return True, "Права администратора успешно обновлены."
 
@@ -631,7 +774,7 @@ def block_user(admin_id: int, user_id: int) -> Tuple[bool, str]:
     
     # Block the user
     USER_DATA[user_id_str]["blocked"] = True
-    _save_data()
+    _save_data(user_id_str)
     
     return True, f"Пользователь {USER_DATA[user_id_str]['username']} заблокирован."
 
@@ -649,7 +792,7 @@ def unblock_user(admin_id: int, user_id: int) -> Tuple[bool, str]:
     
     # Unblock the user
     USER_DATA[user_id_str]["blocked"] = False
-    _save_data()
+    _save_data(user_id_str)
     
     return True, f"Пользователь {USER_DATA[user_id_str]['username']} разблокирован."
 
@@ -670,7 +813,7 @@ def add_money(admin_id: int, user_id: int, amount: int) -> Tuple[bool, str]:
     
     # Add money
     USER_DATA[user_id_str]["money"] += amount
-    _save_data()
+    _save_data(user_id_str)
     
     return True, f"Добавлено {amount} рублей пользователю {USER_DATA[user_id_str]['username']}."
 
@@ -692,12 +835,12 @@ def remove_money(admin_id: int, user_id: int, amount: int) -> Tuple[bool, str]:
     # Check if user has enough money
     if USER_DATA[user_id_str]["money"] < amount:
         USER_DATA[user_id_str]["money"] = 0
-        _save_data()
+        _save_data(user_id_str)
         return True, f"Счет пользователя {USER_DATA[user_id_str]['username']} обнулен."
     
     # Remove money
     USER_DATA[user_id_str]["money"] -= amount
-    _save_data()
+    _save_data(user_id_str)
     
     return True, f"Удалено {amount} рублей у пользователя {USER_DATA[user_id_str]['username']}."
 
@@ -727,7 +870,7 @@ def give_buff(admin_id: int, user_id: int, buff_id: int) -> Tuple[bool, str]:
     }
     
     USER_DATA[user_id_str]["buffs"].append(buff)
-    _save_data()
+    _save_data(user_id_str)
     
     return True, f"Бафф {item['name']} выдан пользователю {USER_DATA[user_id_str]['username']}."
 
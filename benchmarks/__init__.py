@@ -0,0 +1,6 @@
+"""
+Benchmarks and load checks for the Delivery Bot.
+
+Run the scripts from the repository root, e.g.:
+    python -m benchmarks.check_query_plans --database-url sqlite:///bench.db
+"""
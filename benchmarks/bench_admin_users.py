@@ -0,0 +1,104 @@
+"""
+Benchmark the dashboard user listing: per-user buff counting vs one query.
+
+Seeds the database with each requested number of users (10k and 100k by
+default, two buffs per user), then lists the top 100 users by deliveries
+the old way (one COUNT query per user) and with
+admin_queries.list_users_with_buffs, and prints the number of queries and
+the latency of each. Also walks a few keyset pages deep into the table.
+
+Usage:
+    python -m benchmarks.bench_admin_users --database-url sqlite:///bench.db
+    python -m benchmarks.bench_admin_users --database-url postgresql://localhost/bench --users 10000 100000
+"""
+import time
+import argparse
+import statistics
+from sqlalchemy import create_engine, event, select, func
+from models import User, Buff
+from admin_queries import list_users_with_buffs
+from benchmarks.seed import seed
+
+
+class QueryCounter:
+    """Counts statements executed on an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+
+def n_plus_one(conn, limit: int = 100):
+    """Old dashboard.api_users: the users, then one COUNT per user."""
+    now = time.time()
+    users = conn.execute(select(User.__table__).order_by(User.deliveries.desc()).limit(limit)).all()
+    result = []
+    for user in users:
+        count = conn.execute(
+            select(func.count()).select_from(Buff).where(Buff.user_id == user.id, Buff.expires_at > now)
+        ).scalar()
+        result.append((user.id, count))
+    return result
+
+
+def single_query(conn, limit: int = 100):
+    users, _ = list_users_with_buffs(conn, sort='deliveries', limit=limit)
+    return [(user['id'], user['active_buffs_count']) for user in users]
+
+
+def measure(engine, counter: QueryCounter, fn, repeats: int):
+    """Run fn repeatedly; returns (queries per call, median ms, result)."""
+    timings = []
+    with engine.connect() as conn:
+        for _ in range(repeats):
+            before = counter.count
+            started = time.perf_counter()
+            result = fn(conn)
+            timings.append((time.perf_counter() - started) * 1000)
+            queries = counter.count - before
+    return queries, statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard user listing")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--buffs-per-user", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=50)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    counter = QueryCounter(engine)
+
+    for users in sorted(args.users):
+        seed(engine, users, users * args.buffs_per_user)
+        print(f"== {users} users, {engine.dialect.name}")
+
+        old_queries, old_ms, old_result = measure(engine, counter, n_plus_one, args.repeats)
+        new_queries, new_ms, new_result = measure(engine, counter, single_query, args.repeats)
+        # Users tied on deliveries may differ at the page boundary, compare the common ones
+        old_counts, new_counts = dict(old_result), dict(new_result)
+        if any(old_counts[i] != new_counts[i] for i in old_counts.keys() & new_counts.keys()):
+            print("!! active buff counts differ between the two versions")
+
+        print(f"per-user COUNT:  {old_queries:4d} queries, {old_ms:8.2f} ms")
+        print(f"grouped join:    {new_queries:4d} queries, {new_ms:8.2f} ms")
+
+        # Keyset pages stay flat however deep they are
+        with engine.connect() as conn:
+            cursor, timings = None, []
+            for _ in range(args.pages):
+                started = time.perf_counter()
+                _, cursor = list_users_with_buffs(conn, sort='deliveries', limit=100, after=cursor)
+                timings.append((time.perf_counter() - started) * 1000)
+                if cursor is None:
+                    break
+        print(f"keyset pages:    first {timings[0]:.2f} ms, page {len(timings)} {timings[-1]:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
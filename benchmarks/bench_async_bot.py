@@ -0,0 +1,183 @@
+"""
+Throughput of the threaded and the asyncio bot runtimes.
+
+Queues a burst of updates from many users on the local fake Bot API (each
+user sends /raznos twice, /top and /profile) and lets the bot fetch them
+by long polling, once with the threaded runtime (TeleBot on the update
+dispatcher's worker threads) and once with the asyncio runtime (AsyncTeleBot
+on async_user_data). Every Bot API call takes --latency seconds, like a
+round trip to Telegram, so the threaded runtime is bound by its number of
+workers while the asyncio one overlaps the waits. Prints updates/sec and
+the peak number of updates in progress, and exits with status 1 if an
+update was lost.
+
+Each run uses its own users, so the first /raznos of everyone delivers.
+The script points config at the given database and a temporary data
+directory before importing the bot modules, so it never touches the bot's
+own database or data files.
+
+Usage:
+    python -m benchmarks.bench_async_bot --database-url sqlite:///bench.db
+    python -m benchmarks.bench_async_bot --database-url postgresql://localhost/bench --users 2000
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import config
+from benchmarks.fake_bot_api import FakeBotAPI
+
+COMMANDS = ("/raznos", "/raznos", "/top", "/profile")
+
+
+def push_updates(server: FakeBotAPI, users: int, base_id: int) -> int:
+    """Queue the commands of every user, interleaved like real traffic; returns the count."""
+    update_id = 0
+    for command in COMMANDS:
+        for n in range(users):
+            update_id += 1
+            user = {"id": base_id + n, "is_bot": False, "first_name": f"Курьер {n}"}
+            server.push_update({
+                "update_id": update_id,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": base_id + n, "type": "private"},
+                    "from": user,
+                    "text": command,
+                    "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]
+                }
+            })
+    return update_id
+
+
+def report(name: str, server: FakeBotAPI, total: int, elapsed: float, processed: int,
+           failed: int, max_in_flight: int) -> bool:
+    # Every update answers with exactly one message or photo
+    replies = sum(server.delivered.values())
+    print(f"{name:18s} {processed:6d} updates in {elapsed:6.2f}s, {processed / elapsed:8.1f} updates/s, "
+          f"peak in progress {max_in_flight:5d}, failed {failed}, replies {replies}")
+    ok = processed == total and failed == 0 and replies == total
+    if not ok:
+        print("  FAILED: updates were lost or failed")
+    return ok
+
+
+def wait_processed(get_processed, total: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while get_processed() < total and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def run_threaded(args, workers: int, base_id: int) -> bool:
+    import telebot
+    from handlers import register_handlers
+    from dispatcher import create_dispatcher, run_polling
+
+    server = FakeBotAPI(latency=args.latency).start()
+    telebot.apihelper.API_URL = server.api_url
+    total = push_updates(server, args.users, base_id)
+
+    bot = telebot.TeleBot("123:fake", threaded=False)
+    register_handlers(bot)
+    dispatcher = create_dispatcher(bot, workers, max_pending=1000, name=f"bench-{workers}")
+
+    stop_event = threading.Event()
+    started = time.monotonic()
+    poller = threading.Thread(target=run_polling, args=(bot, dispatcher, 1, stop_event), daemon=True)
+    poller.start()
+    wait_processed(lambda: dispatcher.processed, total, args.timeout)
+    elapsed = time.monotonic() - started
+
+    stop_event.set()
+    poller.join()
+    dispatcher.drain(5)
+    metrics = dispatcher.metrics()
+    server.stop()
+    return report(f"threaded x{workers}", server, total, elapsed, metrics["processed"],
+                  metrics["failed"], metrics["workers"])
+
+
+async def _run_async(args, base_id: int):
+    from telebot import asyncio_helper
+    from async_bot import create_async_bot, create_async_dispatcher, run_polling
+    from async_user_data import init_engine, dispose_engine
+
+    server = FakeBotAPI(latency=args.latency).start()
+    asyncio_helper.API_URL = server.api_url
+    total = push_updates(server, args.users, base_id)
+
+    init_engine()
+    bot = create_async_bot("123:fake")
+    dispatcher = create_async_dispatcher(bot, max_concurrent=args.concurrency)
+
+    stop_event = asyncio.Event()
+    started = time.monotonic()
+    poller = asyncio.create_task(run_polling(bot, dispatcher, 1, stop_event))
+    deadline = started + args.timeout
+    while dispatcher.processed < total and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    elapsed = time.monotonic() - started
+
+    # The poller returns once its current getUpdates call does
+    stop_event.set()
+    await poller
+    await dispatcher.drain(5)
+    await bot.close_session()
+    await dispose_engine()
+    server.stop()
+    return server, total, elapsed, dispatcher
+
+
+def run_async(args, base_id: int) -> bool:
+    server, total, elapsed, dispatcher = asyncio.run(_run_async(args, base_id))
+    return report(f"async x{args.concurrency}", server, total, elapsed, dispatcher.processed,
+                  dispatcher.failed, dispatcher.max_in_flight)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the threaded and the asyncio bot runtimes")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per Bot API call")
+    parser.add_argument("--workers", type=int, nargs="*", default=[8, 64],
+                        help="threaded worker counts (none to run the asyncio runtime only)")
+    parser.add_argument("--concurrency", type=int, default=config.ASYNC_MAX_CONCURRENT_UPDATES)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+
+    # Keep the bot's own database and data files out of the benchmark
+    data_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = args.database_url
+    for name in dir(config):
+        value = getattr(config, name)
+        # Empty paths mean "disabled" (e.g. TRACE_EXPORT_FILE), keep them empty
+        if name.endswith("_FILE") and isinstance(value, str) and value:
+            setattr(config, name, os.path.join(data_dir, os.path.basename(value)))
+    # One connection per worker of the largest threaded run
+    config.DB_POOL_SIZE = max(args.workers, default=0) + 4
+
+    import user_data
+    with user_data.app.app_context():
+        user_data.db.create_all()
+        dialect = user_data.db.engine.dialect.name
+    user_data.initialize_database()
+
+    total = len(COMMANDS) * args.users
+    print(f"== {args.users} users, {total} updates, {args.latency * 1000:.0f} ms per Bot API call, "
+          f"{dialect}")
+
+    base_id = 7_000_000_000 + int(time.time()) % 1_000_000 * 1000
+    ok = True
+    for run, workers in enumerate(args.workers):
+        ok &= run_threaded(args, workers, base_id + run * args.users)
+    ok &= run_async(args, base_id + len(args.workers) * args.users)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
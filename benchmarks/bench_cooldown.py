@@ -0,0 +1,141 @@
+"""
+Load test of the /raznos cooldown check.
+
+Every user makes one delivery through user_data.deliver, then presses
+/raznos again and again during the cooldown (spread over several threads,
+like spam clicks handled by the update workers). Prints the database
+queries and latency per accepted and per rejected delivery, next to the
+old check that read the locked user row for every press.
+
+The script points config at the given database and a temporary data
+directory before importing user_data, so it never touches the bot's own
+database or data files.
+
+Usage:
+    python -m benchmarks.bench_cooldown --database-url sqlite:///bench.db
+    python -m benchmarks.bench_cooldown --database-url postgresql://localhost/bench --users 10000
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import event, select
+import config
+
+
+class QueryCounter:
+    """Counts statements executed on an engine by the benchmark's threads."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        # Leave out background work such as the stats buffer flushes
+        if threading.current_thread().name.startswith("bench"):
+            with self._lock:
+                self.count += 1
+
+
+def old_check(user_data, telegram_id: int) -> bool:
+    """Old deliver() rejection path: lock the user row and compare the cooldown."""
+    User, db = user_data.User, user_data.db
+    with user_data.app.app_context():
+        row = db.session.execute(
+            select(User.id, User.last_delivery, User.blocked)
+            .where(User.telegram_id == str(telegram_id))
+            .with_for_update(of=User)
+        ).first()
+        db.session.rollback()
+    return row.blocked or time.time() - row.last_delivery < user_data.DELIVERY_COOLDOWN.total_seconds()
+
+
+def run(fn, ids, threads: int):
+    """Call fn for every id on a thread pool; returns (results, per-call ms)."""
+    def timed(telegram_id):
+        started = time.perf_counter()
+        result = fn(telegram_id)
+        return result, (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(threads, thread_name_prefix="bench") as pool:
+        results = list(pool.map(timed, ids))
+    return [r for r, _ in results], [ms for _, ms in results]
+
+
+def report(name: str, calls: int, queries: int, timings):
+    timings = sorted(timings)
+    p99 = timings[int(len(timings) * 0.99) - 1] if len(timings) >= 100 else timings[-1]
+    print(f"{name:22s} {calls:7d} calls, {queries / calls:6.2f} queries/call, "
+          f"p50 {statistics.median(timings):7.3f} ms, p99 {p99:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /raznos cooldown check")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--presses", type=int, default=10, help="rejected presses per user")
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    # Keep the bot's own database and data files out of the benchmark
+    data_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = args.database_url
+    for name in dir(config):
+        value = getattr(config, name)
+        # Empty paths mean "disabled" (e.g. TRACE_EXPORT_FILE), keep them empty
+        if name.endswith("_FILE") and isinstance(value, str) and value:
+            setattr(config, name, os.path.join(data_dir, os.path.basename(value)))
+
+    import user_data
+    from cooldown import cooldown_cache
+
+    with user_data.app.app_context():
+        user_data.db.create_all()
+        engine = user_data.db.engine
+    counter = QueryCounter(engine)
+
+    base_id = 7_000_000_000 + int(time.time()) % 1_000_000 * 1000
+    ids = [base_id + n for n in range(args.users)]
+    presses = ids * args.presses
+
+    print(f"== {args.users} users, {args.presses} presses each, {args.threads} threads, {engine.dialect.name}")
+
+    # First delivery of every user goes through
+    before = counter.count
+    results, timings = run(lambda tid: user_data.deliver(tid, 1, 100), ids, args.threads)
+    if not all(r["delivered"] for r in results):
+        print("!! some first deliveries were rejected")
+    report("accepted deliver()", len(ids), counter.count - before, timings)
+
+    # Spam clicks during the cooldown
+    before = counter.count
+    results, timings = run(lambda tid: user_data.deliver(tid, 1, 100), presses, args.threads)
+    rejected_queries = counter.count - before
+    if any(r["delivered"] for r in results) or not all(r["time_remaining"] for r in results):
+        print("!! a press during the cooldown was not rejected")
+    report("rejected deliver()", len(presses), rejected_queries, timings)
+
+    before = counter.count
+    results, timings = run(user_data.can_deliver, presses, args.threads)
+    can_deliver_queries = counter.count - before
+    if any(allowed for allowed, _ in results):
+        print("!! can_deliver allowed a press during the cooldown")
+    report("rejected can_deliver()", len(presses), can_deliver_queries, timings)
+
+    before = counter.count
+    results, timings = run(lambda tid: old_check(user_data, tid), presses, args.threads)
+    report("old row-lock check", len(presses), counter.count - before, timings)
+
+    print(f"cooldown cache: {cooldown_cache.metrics()}")
+    ok = rejected_queries == 0 and can_deliver_queries == 0
+    print("ok: rejected presses ran no queries" if ok else "FAILED: rejected presses hit the database")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
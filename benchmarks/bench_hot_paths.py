@@ -0,0 +1,322 @@
+"""
+Benchmark of the bot's hot paths against a seeded database.
+
+Seeds the database with --users users and --buffs buffs (see seed.py) and
+drives the handlers through a local fake Bot API (fake_bot_api.py), the way
+the update dispatcher runs them: one unit of work per update, handled by
+bot.process_new_updates on a pool of workers. Scenarios:
+
+    raznos    /raznos            handlers.raznos_command (delivery and photo)
+    profile   /profile           handlers.profile_command
+    shop      /magaz             handlers.show_shop_item (sends the photo)
+    purchase  "Купить" button    purchase_buff and show_shop_item (edits the photo)
+    top       /top               handlers.top_command
+
+Each scenario runs --updates updates from different users at every
+--concurrency level. The script prints and saves (--json) the
+p50/p95/p99 latency, throughput, SQL queries per update and uploaded bytes
+per update. With --baseline it compares the run with a stored result and
+exits with status 1 on a regression beyond --tolerance; --save-baseline
+stores the run as the new baseline. Baselines are machine specific, record
+one on the machine the comparison runs on.
+
+The users of a run get their cooldown reset and enough money for a buff
+before the run, so reruns on the same database measure the same paths.
+The script points config at the given database and a temporary data
+directory before importing the bot modules, so it never touches the bot's
+own database or data files.
+
+Usage:
+    python -m benchmarks.bench_hot_paths --database-url sqlite:///bench.db --json run.json
+    python -m benchmarks.bench_hot_paths --database-url postgresql://localhost/bench --users 1000000
+    python -m benchmarks.bench_hot_paths --baseline benchmarks/baseline_hot_paths.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import config
+from benchmarks.fake_bot_api import FakeBotAPI, BOT_USER
+
+# First telegram id of the seeded users (see seed.py)
+FIRST_TELEGRAM_ID = 1_000_000
+
+# Update builders per scenario: (telegram_id, update_id) -> update dict
+SCENARIOS = {
+    "raznos": lambda user_id, update_id: _command(user_id, update_id, "/raznos"),
+    "profile": lambda user_id, update_id: _command(user_id, update_id, "/profile"),
+    "shop": lambda user_id, update_id: _command(user_id, update_id, "/magaz"),
+    "purchase": lambda user_id, update_id: _callback(user_id, update_id, "shop_buy_0"),
+    "top": lambda user_id, update_id: _command(user_id, update_id, "/top"),
+}
+
+# Metrics compared with the baseline and whether higher values are better
+COMPARED = {
+    "p95_ms": False,
+    "throughput": True,
+    "queries_per_update": False,
+    "bytes_per_update": False,
+}
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"Курьер {user_id}"}
+
+
+def _command(user_id, update_id, command):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        }
+    }
+
+
+def _callback(user_id, update_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": BOT_USER,
+                "text": ""
+            }
+        }
+    }
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, min(len(values) - 1, int(round(q * len(values))) - 1))]
+
+
+class QueryCounter:
+    """Count SQL statements per thread with a before_cursor_execute listener."""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self._local = threading.local()
+        event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, "count", 0) + 1
+
+    def reset(self) -> None:
+        self._local.count = 0
+
+    @property
+    def count(self) -> int:
+        return getattr(self._local, "count", 0)
+
+
+def run_scenario(bot, server, queries, build, ids, concurrency: int, first_update_id: int):
+    """Handle one update per id on concurrency workers; returns the metrics."""
+    import telebot
+    from database import unit_of_work
+
+    updates = [telebot.types.Update.de_json(build(user_id, first_update_id + n))
+               for n, user_id in enumerate(ids)]
+    errors = []
+
+    def process(update):
+        queries.reset()
+        started = time.perf_counter()
+        try:
+            with unit_of_work():
+                bot.process_new_updates([update])
+        except Exception as e:
+            errors.append(e)
+        return time.perf_counter() - started, queries.count
+
+    server.reset()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency, thread_name_prefix="bench") as pool:
+        results = list(pool.map(process, updates))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    if errors:
+        print(f"  !! {len(errors)} updates failed, first error: {errors[0]!r}")
+    return {
+        "updates": len(updates),
+        "errors": len(errors),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "throughput": round(len(updates) / elapsed, 1),
+        "queries_per_update": round(sum(count for _, count in results) / len(updates), 2),
+        "max_queries": max(count for _, count in results),
+        "bytes_uploaded": server.bytes_uploaded,
+        "bytes_per_update": round(server.bytes_uploaded / len(updates), 1),
+        "api_calls": sum(server.counts.values()),
+    }
+
+
+def prepare_users(ids) -> None:
+    """Reset the cooldown and top up the money of the users of a run."""
+    from sqlalchemy import update
+    from database import unit_of_work
+    from models import db, User
+    from cooldown import cooldown_cache
+
+    with unit_of_work():
+        for start in range(0, len(ids), 500):
+            telegram_ids = [str(user_id) for user_id in ids[start:start + 500]]
+            db.session.execute(
+                update(User).where(User.telegram_id.in_(telegram_ids))
+                .values(last_delivery=0, blocked=False, money=1_000_000)
+            )
+        db.session.commit()
+
+    # Like an admin edit: make every process reload its cooldown cache
+    cooldown_cache.invalidate()
+
+
+def compare(result, baseline, tolerance: float) -> bool:
+    """Print the differences to the baseline; returns False on a regression."""
+    for name in ("database", "users", "buffs", "updates", "latency", "storage"):
+        if baseline.get("meta", {}).get(name) != result["meta"][name]:
+            print(f"  note: the baseline was recorded with {name}={baseline.get('meta', {}).get(name)}, "
+                  f"this run uses {result['meta'][name]}")
+
+    ok = True
+    for scenario, levels in result["results"].items():
+        for level, metrics in levels.items():
+            base = baseline.get("results", {}).get(scenario, {}).get(level)
+            if base is None:
+                continue
+            for name, higher_is_better in COMPARED.items():
+                old, new = base.get(name), metrics.get(name)
+                if old is None or new is None:
+                    continue
+                if higher_is_better:
+                    regressed = new < old * (1 - tolerance)
+                else:
+                    # Small absolute changes of tiny values are noise
+                    regressed = new > old * (1 + tolerance) and new - old > 0.5
+                if regressed:
+                    ok = False
+                    print(f"  REGRESSION {scenario} x{level} {name}: {old} -> {new}")
+    print("No regressions against the baseline" if ok else "Regressions against the baseline")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's hot paths")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=10_000, help="seeded users")
+    parser.add_argument("--buffs", type=int, default=2_000, help="seeded buffs")
+    parser.add_argument("--updates", type=int, default=200, help="updates per scenario and level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 64])
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per Bot API call")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="compare with the results stored in this file")
+    parser.add_argument("--save-baseline", help="store the results as the baseline in this file")
+    parser.add_argument("--tolerance", type=float, default=0.35,
+                        help="allowed relative regression (tail latencies under load are noisy)")
+    args = parser.parse_args()
+
+    if args.users < args.updates * len(args.concurrency):
+        parser.error("--users must be at least --updates times the number of concurrency levels")
+
+    # Keep the bot's own database and data files out of the benchmark
+    data_dir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = args.database_url
+    for name in dir(config):
+        value = getattr(config, name)
+        # Empty paths mean "disabled" (e.g. TRACE_EXPORT_FILE), keep them empty
+        if name.endswith("_FILE") and isinstance(value, str) and value:
+            setattr(config, name, os.path.join(data_dir, os.path.basename(value)))
+    # One connection per worker of the largest level
+    config.DB_POOL_SIZE = max(args.concurrency) + 4
+
+    import telebot
+    import user_data
+    from handlers import register_handlers
+    from benchmarks.seed import seed
+
+    with user_data.app.app_context():
+        engine = user_data.db.engine
+        dialect = engine.dialect.name
+        started = time.perf_counter()
+        seed(engine, args.users, args.buffs)
+        print(f"Seeded {args.users} users and {args.buffs} buffs in {time.perf_counter() - started:.1f}s")
+    user_data.initialize_database()
+    queries = QueryCounter(engine)
+
+    server = FakeBotAPI(latency=args.latency).start()
+    telebot.apihelper.API_URL = server.api_url
+    bot = telebot.TeleBot("123:fake", threaded=False)
+    register_handlers(bot)
+
+    result = {
+        "meta": {
+            "database": dialect,
+            "users": args.users,
+            "buffs": args.buffs,
+            "updates": args.updates,
+            "latency": args.latency,
+            "storage": config.STORAGE_BACKEND,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "timestamp": int(time.time()),
+        },
+        "results": {},
+    }
+
+    print(f"== {dialect}, {args.updates} updates per run, {args.latency * 1000:.0f} ms per Bot API call")
+    print(f"  {'scenario':10s} {'workers':>7s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} "
+          f"{'upd/s':>8s} {'queries':>8s} {'bytes/upd':>10s}")
+    # Every level has its own users, so the first /raznos of each delivers
+    ids = list(range(FIRST_TELEGRAM_ID, FIRST_TELEGRAM_ID + args.updates * len(args.concurrency)))
+    prepare_users(ids)
+
+    update_id = 0
+    ok = True
+    for level_index, concurrency in enumerate(args.concurrency):
+        level_ids = ids[level_index * args.updates:(level_index + 1) * args.updates]
+        for scenario in args.scenarios:
+            metrics = run_scenario(bot, server, queries, SCENARIOS[scenario], level_ids, concurrency,
+                                   update_id + 1)
+            update_id += len(level_ids)
+            result["results"].setdefault(scenario, {})[str(concurrency)] = metrics
+            ok &= metrics["errors"] == 0
+            print(f"  {scenario:10s} {concurrency:7d} {metrics['p50_ms']:8.2f} {metrics['p95_ms']:8.2f} "
+                  f"{metrics['p99_ms']:8.2f} {metrics['throughput']:8.1f} "
+                  f"{metrics['queries_per_update']:8.2f} {metrics['bytes_per_update']:10.0f}")
+    server.stop()
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+            print(f"Results written to {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            ok &= compare(result, json.load(f), args.tolerance)
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark import_data.py on a generated users.json.
+
+Writes a JSON array of synthetic users (1M by default), then imports it
+with the streaming importer and with the old one-INSERT-per-row loop (on a
+sample, extrapolated) and prints rows per second for each. Pass
+--database-url several times to compare databases.
+
+Usage:
+    python -m benchmarks.bench_import --database-url sqlite:///bench_import.db
+    python -m benchmarks.bench_import --database-url sqlite:///bench_import.db \
+        --database-url postgresql://localhost/bench
+"""
+import os
+import json
+import time
+import random
+import argparse
+from sqlalchemy import create_engine, text
+from models import db
+from import_data import import_table_data
+
+
+def write_users_file(path: str, users: int, seed_value: int = 42) -> None:
+    """Write a users.json export with the given number of rows."""
+    rng = random.Random(seed_value)
+    now = time.time()
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for n in range(users):
+            deliveries = int(rng.paretovariate(1.5)) * 3
+            row = {
+                "id": n + 1,
+                "telegram_id": str(1_000_000 + n),
+                "username": f"Курьер {n}",
+                "deliveries": deliveries,
+                "money": deliveries * rng.randint(35, 200),
+                "experience": deliveries * 2,
+                "last_delivery": now - rng.uniform(0, 86400) if deliveries else 0,
+                "blocked": rng.random() < 0.01,
+                "created_at": now - rng.uniform(0, 365 * 86400),
+                "is_admin": False,
+            }
+            if n:
+                f.write(',')
+            f.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+        f.write(']')
+
+
+def _reset(engine) -> None:
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+
+
+def bench_row_by_row(engine, path: str, rows: int) -> float:
+    """Old importer: one INSERT per row. Returns rows per second."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)[:rows]
+
+    columns = list(data[0].keys())
+    query = text(
+        f"INSERT INTO users ({', '.join(columns)}) "
+        f"VALUES ({', '.join(':' + col for col in columns)})"
+    )
+
+    started = time.time()
+    with engine.connect() as conn:
+        for row in data:
+            conn.execute(query, row)
+        conn.commit()
+    return len(data) / (time.time() - started)
+
+
+def bench_streaming(engine, path: str, batch_size: int, use_copy: bool) -> float:
+    """Streaming importer. Returns rows per second."""
+    started = time.time()
+    imported = import_table_data(engine, 'users', path, batch_size=batch_size, use_copy=use_copy, resume=False)
+    return imported / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the JSON importer")
+    parser.add_argument("--database-url", action="append")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--baseline-rows", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--file", default="bench_users.json")
+    args = parser.parse_args()
+    urls = args.database_url or ["sqlite:///bench_import.db"]
+
+    if not os.path.exists(args.file):
+        started = time.time()
+        write_users_file(args.file, args.users)
+        print(f"Wrote {args.users} users to {args.file} in {time.time() - started:.1f}s")
+
+    for url in urls:
+        engine = create_engine(url)
+        print(f"== {engine.dialect.name}")
+
+        _reset(engine)
+        rate = bench_row_by_row(engine, args.file, args.baseline_rows)
+        print(f"row-by-row INSERT ({args.baseline_rows} rows): {rate:.0f} rows/s")
+
+        _reset(engine)
+        rate = bench_streaming(engine, args.file, args.batch_size, use_copy=False)
+        print(f"streaming, executemany upsert: {rate:.0f} rows/s")
+
+        if engine.dialect.name == 'postgresql':
+            _reset(engine)
+            rate = bench_streaming(engine, args.file, args.batch_size, use_copy=True)
+            print(f"streaming, COPY + upsert: {rate:.0f} rows/s")
+
+        # Re-import over existing rows exercises the ON CONFLICT path
+        rate = bench_streaming(engine, args.file, args.batch_size, use_copy=True)
+        print(f"streaming, upsert over existing rows: {rate:.0f} rows/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Write cost and crash safety of the journal in attached_assets/user_data.py.
+
+Creates --users users in the JSON-file store, makes a delivery for each of
+them and reads every profile (which prunes expired buffs), and prints the
+time per operation next to what one full rewrite of the data file (the
+previous behaviour of _save_data, on every change) costs at that size.
+
+Then it checks crash safety: a child process makes more deliveries and
+exits without running atexit handlers (no final compaction), and the
+store is reloaded from the data file and the journal; the reloaded data
+must match what the child had in memory. Exits with status 1 if not.
+
+Everything runs in a temporary directory, the module's relative
+data/ paths are resolved there.
+
+Usage:
+    python -m benchmarks.bench_json_journal
+    python -m benchmarks.bench_json_journal --users 50000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import importlib.util
+import subprocess
+
+MODULE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           "attached_assets", "user_data.py")
+
+
+def load_store():
+    """Import a fresh copy of attached_assets/user_data.py (loads data/ in the cwd)."""
+    spec = importlib.util.spec_from_file_location("json_user_data", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed(name: str, fn, ids) -> float:
+    started = time.perf_counter()
+    for user_id in ids:
+        fn(user_id)
+    elapsed = time.perf_counter() - started
+    print(f"  {name:28s} {len(ids):7d} calls, {len(ids) / elapsed:9.0f} ops/s, "
+          f"{elapsed / len(ids) * 1_000_000:8.1f} µs/op")
+    return elapsed
+
+
+def child(count: int) -> None:
+    """Make deliveries, print the data and exit without compacting."""
+    store = load_store()
+    user_ids = sorted(int(key) for key in store.USER_DATA if not key.startswith("_"))
+    for user_id in user_ids[:count]:
+        store.update_user_data(user_id, 1, 500)
+    store._sync_journal()
+    sys.stdout.write(json.dumps(store.USER_DATA))
+    sys.stdout.flush()
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the journal of the JSON-file store")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child)
+
+    os.chdir(tempfile.mkdtemp())
+    store = load_store()
+    # No background compaction during the run, it is measured separately
+    store.JOURNAL_COMPACT_THRESHOLD = store.JOURNAL_COMPACT_INTERVAL = float("inf")
+    ids = list(range(1_000_000, 1_000_000 + args.users))
+
+    print(f"== {args.users} users")
+    timed("get_user_data (new user)", store.get_user_data, ids)
+    timed("update_user_data", lambda user_id: store.update_user_data(user_id, 1, 500), ids)
+    timed("get_user_data", store.get_user_data, ids)
+
+    # What every change cost before: rewriting the whole data file
+    rewrites = max(1, min(20, args.users // 500))
+    started = time.perf_counter()
+    for _ in range(rewrites):
+        with open("rewrite.json", "w", encoding="utf-8") as f:
+            json.dump(store.USER_DATA, f, ensure_ascii=False, indent=2)
+    rewrite_ms = (time.perf_counter() - started) / rewrites * 1000
+    print(f"  full rewrite per change     {rewrite_ms:8.1f} ms/op")
+
+    journal_bytes = os.path.getsize(store.JOURNAL_FILE)
+    started = time.perf_counter()
+    store._compact_journal()
+    compact_ms = (time.perf_counter() - started) * 1000
+    print(f"  journal {journal_bytes / 1024:.0f} KiB, compaction {compact_ms:.0f} ms, "
+          f"data file {os.path.getsize(store.DATA_FILE) / 1024:.0f} KiB")
+
+    # Crash after more changes: they only exist in the journal
+    count = min(1000, args.users)
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_json_journal", "--child", str(count)],
+        cwd=os.getcwd(), env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(MODULE_PATH))),
+        capture_output=True, text=True, check=True
+    ).stdout
+    expected = json.loads(output)
+
+    started = time.perf_counter()
+    reloaded = load_store()
+    load_ms = (time.perf_counter() - started) * 1000
+    ok = reloaded.USER_DATA == expected
+    print(f"  reload after crash {load_ms:.0f} ms: " + ("data matches" if ok else "!! data differs"))
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Check the broadcast engine against the local fake Bot API.
+
+Seeds a throwaway SQLite database with users (some blocked in the
+database, some that blocked the bot), then runs four broadcasts:
+
+  - at the fake API's rate limit: every user gets exactly one message and
+    the run takes close to the theoretical minimum (users / rate)
+  - 50% over the limit: the 429 answers slow the sender down and every
+    message still arrives
+  - stopped partway through and resumed: nobody gets the message twice
+  - sent by a child process that gets killed partway through: the
+    resumer takes the job over once the dead process' lease runs out and
+    finishes it; only messages sent after the last recorded batch may
+    arrive twice
+
+The defaults use a high rate to finish quickly; --rate 30 --users 100000
+reproduces a real broadcast (about 56 minutes).
+
+Usage:
+    python -m benchmarks.check_broadcast
+    python -m benchmarks.check_broadcast --users 100000 --rate 30
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+import telebot
+from flask import Flask
+from sqlalchemy import insert, select, func
+from models import db, User, BroadcastJob, BroadcastRecipient
+import broadcast
+from broadcast import BroadcastRunner, create_broadcast, start_resumer
+from config import BROADCAST_FLUSH_SIZE
+from benchmarks.fake_bot_api import FakeBotAPI
+
+
+def make_app(path: str) -> Flask:
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed_users(app, users: int) -> None:
+    with app.app_context():
+        rows = [
+            {"telegram_id": str(1_000_000 + n), "username": f"Курьер {n}", "blocked": n % 100 == 0}
+            for n in range(users)
+        ]
+        db.session.execute(insert(User), rows)
+        db.session.commit()
+
+
+def run_job(app, bot, rate: float, workers: int, stop_after: float = None) -> int:
+    with app.app_context():
+        job_id = create_broadcast("Новые бафы в магазине!").id
+
+    runner = BroadcastRunner(app, bot, job_id, rate=rate, workers=workers)
+    started = time.monotonic()
+    runner.start()
+    if stop_after:
+        time.sleep(stop_after)
+        runner.stop()
+        runner.join()
+        print(f"  stopped after {time.monotonic() - started:.1f}s, resuming")
+        runner = BroadcastRunner(app, bot, job_id, rate=rate, workers=workers).start()
+    runner.join()
+    print(f"  finished in {time.monotonic() - started:.1f}s, throttled {runner.bucket.throttled_count} times")
+    return job_id
+
+
+def run_crashed_job(app, path: str, server: FakeBotAPI, rate: float, workers: int, kill_after: float,
+                    lease: float) -> int:
+    """Send a job from a child process, kill it and let the resumer finish the job."""
+    with app.app_context():
+        job_id = create_broadcast("Новые бафы в магазине!").id
+
+    started = time.monotonic()
+    child = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.check_broadcast", "--child", str(job_id), "--database", path,
+         "--api-url", server.api_url, "--rate", str(rate), "--workers", str(workers), "--lease", str(lease)],
+        env=dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+    time.sleep(kill_after)
+    child.send_signal(signal.SIGKILL)
+    child.wait()
+    with app.app_context():
+        job = db.session.get(BroadcastJob, job_id)
+        print(f"  killed the sender after {time.monotonic() - started:.1f}s "
+              f"({job.sent} sent, status {job.status}), waiting for the resumer")
+
+    bot = telebot.TeleBot("123:fake", threaded=False)
+    start_resumer(app, bot, interval=lease / 4, rate=rate, workers=workers)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        with app.app_context():
+            if db.session.get(BroadcastJob, job_id).status == "done":
+                break
+        time.sleep(0.2)
+    print(f"  finished in {time.monotonic() - started:.1f}s")
+    return job_id
+
+
+def child(args) -> None:
+    """Send a job until the parent kills this process."""
+    telebot.apihelper.API_URL = args.api_url
+    broadcast.BROADCAST_LEASE_SECONDS = args.lease
+    app = make_app(args.database)
+    bot = telebot.TeleBot("123:fake", threaded=False)
+    BroadcastRunner(app, bot, args.child, rate=args.rate, workers=args.workers).start().join()
+
+
+def verify(app, server: FakeBotAPI, job_id: int, expected_sent: int, expected_blocked: int,
+           max_duplicates: int = 0) -> bool:
+    with app.app_context():
+        job = db.session.get(BroadcastJob, job_id)
+        statuses = dict(db.session.execute(
+            select(BroadcastRecipient.status, func.count())
+            .where(BroadcastRecipient.job_id == job_id)
+            .group_by(BroadcastRecipient.status)
+        ).all())
+
+    # Chats that got the message more than once
+    duplicates = sum(1 for count in server.delivered.values() if count > 1)
+    print(f"  job {job.status}: sent {job.sent}, failed {job.failed}, recipients {statuses}, "
+          f"chats messaged {len(server.delivered)}, duplicates {duplicates}")
+
+    ok = (
+        job.status == "done"
+        and statuses.get("sent", 0) == expected_sent
+        and len(server.delivered) == expected_sent
+        and statuses.get("blocked", 0) == expected_blocked
+        and job.sent == expected_sent
+        and duplicates <= max_duplicates
+    )
+    print("  ok" if ok else "  FAILED")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the broadcast engine against a fake Bot API")
+    parser.add_argument("--users", type=int, default=3000)
+    parser.add_argument("--rate", type=float, default=150)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--lease", type=float, default=3, help="job lease in seconds for the crash check")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--database", help=argparse.SUPPRESS)
+    parser.add_argument("--api-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args)
+        return
+
+    server = FakeBotAPI(latency=args.latency, rate_limit=args.rate).start()
+    telebot.apihelper.API_URL = server.api_url
+    bot = telebot.TeleBot("123:fake", threaded=False)
+
+    path = os.path.join(tempfile.mkdtemp(), "broadcast.db")
+    app = make_app(path)
+    seed_users(app, args.users)
+
+    # Every 100th user is blocked in the database, every 50th (the rest of them) blocked the bot
+    server.blocked_chats = {str(1_000_000 + n) for n in range(args.users) if n % 50 == 0 and n % 100}
+    recipients = args.users - len(range(0, args.users, 100))
+    expected_blocked = len(server.blocked_chats)
+    expected_sent = recipients - expected_blocked
+
+    ok = True
+    print(f"== at the rate limit ({args.rate:.0f}/s, theoretical minimum {recipients / args.rate:.1f}s)")
+    job_id = run_job(app, bot, args.rate, args.workers)
+    ok &= verify(app, server, job_id, expected_sent, expected_blocked)
+    print(f"  429 answers: {server.counts['429']}")
+
+    server.reset()
+    print(f"== 50% over the rate limit ({args.rate * 1.5:.0f}/s)")
+    job_id = run_job(app, bot, args.rate * 1.5, args.workers)
+    ok &= verify(app, server, job_id, expected_sent, expected_blocked)
+    print(f"  429 answers: {server.counts['429']}")
+
+    server.reset()
+    print("== stopped and resumed")
+    job_id = run_job(app, bot, args.rate, args.workers, stop_after=recipients / args.rate / 3)
+    ok &= verify(app, server, job_id, expected_sent, expected_blocked)
+
+    server.reset()
+    print(f"== sender killed, resumed after its {args.lease:.0f}s lease")
+    broadcast.BROADCAST_LEASE_SECONDS = args.lease
+    job_id = run_crashed_job(app, path, server, args.rate, args.workers,
+                             kill_after=recipients / args.rate / 3, lease=args.lease)
+    # The killed process could send up to a flush batch per page without recording it
+    ok &= verify(app, server, job_id, expected_sent, expected_blocked,
+                 max_duplicates=BROADCAST_FLUSH_SIZE + args.workers)
+
+    server.stop()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Check that photos are uploaded to Telegram once and then sent by file_id.
+
+Runs the media registry against the local stand-in Bot API, comparing the
+bytes uploaded and the time taken with plain send_photo calls. Exits with
+status 1 if a repeated send uploads the image again.
+
+Usage:
+    python -m benchmarks.check_media_registry --sends 50
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import telebot
+from flask import Flask
+from telebot import apihelper
+from models import db
+from image_cache import as_upload
+from media_registry import MediaRegistry, media_registry, send_photo, edit_message_photo
+from benchmarks.fake_bot_api import FakeBotAPI
+
+CHAT_ID = 1000001
+
+
+def _photo_bytes(size: int = 60_000) -> bytes:
+    # Incompressible bytes stand in for a rendered JPEG
+    return os.urandom(size)
+
+
+def _create_app(database_url: str) -> Flask:
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = database_url
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check Telegram file_id reuse for photos")
+    parser.add_argument("--sends", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--bandwidth", type=float, default=2_000_000, help="upload bytes per second")
+    args = parser.parse_args()
+
+    server = FakeBotAPI(latency=args.latency, upload_bandwidth=args.bandwidth).start()
+    apihelper.API_URL = server.api_url
+    bot = telebot.TeleBot("123456:TEST", threaded=False)
+
+    workdir = tempfile.mkdtemp()
+    app = _create_app(f"sqlite:///{os.path.join(workdir, 'media.db')}")
+    media_registry.init_app(app)
+
+    data = _photo_bytes()
+    ok = True
+
+    # Baseline: upload the bytes on every send
+    started = time.time()
+    for _ in range(args.sends):
+        bot.send_photo(CHAT_ID, as_upload(data), caption="baseline")
+    baseline_time = time.time() - started
+    baseline_bytes = server.bytes_uploaded
+    server.reset()
+
+    # Registry: first send uploads, the rest reference the file_id
+    started = time.time()
+    for _ in range(args.sends):
+        send_photo(bot, CHAT_ID, as_upload(data), caption="cached")
+    message = send_photo(bot, CHAT_ID, as_upload(data))
+    edit_message_photo(bot, CHAT_ID, message.message_id, as_upload(data), caption="edited")
+    cached_time = time.time() - started
+    cached_bytes = server.bytes_uploaded
+
+    print(f"baseline: {args.sends} sends, {baseline_bytes} bytes uploaded, {baseline_time:.2f}s")
+    print(f"registry: {args.sends + 2} sends, {cached_bytes} bytes uploaded, {cached_time:.2f}s")
+    if server.files_uploaded != 1:
+        print(f"[FAIL] expected 1 upload, got {server.files_uploaded}")
+        ok = False
+
+    # A fresh process picks the file_id up from the database
+    restarted = MediaRegistry()
+    restarted.init_app(app)
+    if restarted.metrics()["known"] != 1:
+        print("[FAIL] file_id was not persisted")
+        ok = False
+
+    # Rejected file_ids fall back to an upload
+    server.forget_files()
+    server.reset()
+    send_photo(bot, CHAT_ID, as_upload(data))
+    send_photo(bot, CHAT_ID, as_upload(data))
+    if server.files_uploaded != 1:
+        print(f"[FAIL] expected 1 re-upload after file_ids expired, got {server.files_uploaded}")
+        ok = False
+
+    server.stop()
+    if not ok:
+        sys.exit(1)
+    print("Photos are uploaded once and reused by file_id")
+
+
+if __name__ == '__main__':
+    main()
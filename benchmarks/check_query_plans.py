@@ -0,0 +1,140 @@
+"""
+EXPLAIN-based check for the hot queries in user_data.py, admin.py and dashboard.py.
+
+Seeds the database (1M users by default), asks the planner for every hot
+query and exits with status 1 if any of them scans users or buffs
+sequentially instead of using an index.
+
+Usage:
+    python -m benchmarks.check_query_plans --database-url sqlite:///bench.db
+    python -m benchmarks.check_query_plans --database-url postgresql://localhost/bench
+"""
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from sqlalchemy import create_engine, select, func
+from models import User, Buff
+from admin_queries import users_with_buffs_query, encode_cursor
+from benchmarks.seed import seed
+
+# Tables that must never be scanned sequentially
+CHECKED_TABLES = ("users", "buffs")
+
+
+def hot_queries():
+    """Return (name, statement) pairs mirroring the hot queries of the app."""
+    now = time.time()
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+
+    return [
+        # user_data.py
+        ("user_data: user by telegram_id",
+         select(User).where(User.telegram_id == "1000123")),
+        ("user_data: top users",
+         select(User).order_by(User.deliveries.desc()).limit(5)),
+        ("user_data: active buffs of a user",
+         select(Buff).where(Buff.user_id == 123, Buff.expires_at > now)),
+        ("buff_registry: active buffs on cold start",
+         select(User.telegram_id, Buff).join(User, Buff.user_id == User.id).where(Buff.expires_at > now)),
+        ("buff_registry: expired buffs sweep",
+         select(Buff.id).where(Buff.expires_at < now - 48 * 3600).limit(1000)),
+        # admin.py
+        ("admin: new users today",
+         select(func.count()).select_from(User).where(User.created_at >= today)),
+        ("admin: deliveries today",
+         select(func.count()).select_from(User).where(User.last_delivery >= today)),
+        ("admin: buffs sold today",
+         select(func.count()).select_from(Buff).where(Buff.created_at >= today)),
+        ("admin: latest users",
+         select(User).order_by(User.created_at.desc()).limit(5)),
+        ("admin: users sorted by money",
+         select(User).order_by(User.money.desc()).limit(15)),
+        ("admin: non-blocked users page",
+         select(User.id).where(User.blocked == False, User.id > 500000).order_by(User.id).limit(1000)),  # noqa: E712
+        # dashboard.py
+        ("dashboard: active buffs",
+         select(func.count(Buff.id)).where(Buff.expires_at > now)),
+        ("dashboard: users by deliveries",
+         select(User).order_by(User.deliveries.desc()).limit(100)),
+        ("dashboard: top users",
+         select(User).order_by(User.deliveries.desc()).limit(10)),
+        # admin_queries.py
+        ("admin_queries: users with buff counts",
+         users_with_buffs_query('deliveries', 100, now=now)),
+        ("admin_queries: users with buff counts, keyset page",
+         users_with_buffs_query('money', 100, after=encode_cursor({'money': 5000, 'id': 400000}, 'money'), now=now)),
+    ]
+
+
+def _sequential_scans_sqlite(conn, sql):
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+    details = [row[-1] for row in rows]
+    scans = [
+        detail for detail in details
+        if detail.startswith("SCAN ")
+        and detail.split()[1] in CHECKED_TABLES
+        and "USING" not in detail
+    ]
+    return scans, details
+
+
+def _sequential_scans_postgresql(conn, sql):
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans, details = [], []
+
+    def walk(node):
+        details.append(f"{node['Node Type']} {node.get('Relation Name', '')}".strip())
+        if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in CHECKED_TABLES:
+            scans.append(f"Seq Scan on {node['Relation Name']}")
+        for child in node.get("Plans", []):
+            walk(child)
+
+    walk(plan[0]["Plan"])
+    return scans, details
+
+
+def check(engine) -> bool:
+    """Explain every hot query and report sequential scans."""
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        explain = _sequential_scans_sqlite
+    elif dialect == "postgresql":
+        explain = _sequential_scans_postgresql
+    else:
+        raise ValueError(f"Unsupported database: {dialect}")
+
+    ok = True
+    with engine.connect() as conn:
+        for name, statement in hot_queries():
+            sql = str(statement.compile(dialect=engine.dialect, compile_kwargs={"literal_binds": True}))
+            scans, details = explain(conn, sql)
+            status = "FAIL" if scans else "ok"
+            print(f"[{status}] {name}: {'; '.join(details)}")
+            ok = ok and not scans
+
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check hot query plans for sequential scans")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--buffs", type=int, default=200_000)
+    args = parser.parse_args()
+
+    engine = create_engine(args.database_url)
+    seed(engine, args.users, args.buffs)
+
+    if not check(engine):
+        print("Some hot queries regressed to a sequential scan")
+        sys.exit(1)
+    print("All hot queries use indexes")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,339 @@
+"""
+Local stand-in for the Telegram Bot API, for checks and benchmarks.
+
+Runs an HTTP server that answers the Bot API methods the bot uses with
+well-formed responses, records every call and counts uploaded bytes. Point
+pyTelegramBotAPI at it with:
+
+    server = FakeBotAPI().start()
+    telebot.apihelper.API_URL = server.api_url
+
+Photos uploaded as files get a file_id derived from their content; sending
+an unknown file_id fails with the same 400 error Telegram returns. Errors
+(e.g. 429 with retry_after) can be injected with fail_next(), a global
+message rate limit answered with 429 can be set with rate_limit, and chats
+in blocked_chats answer 403 like users who blocked the bot.
+
+Usage:
+    python -m benchmarks.fake_bot_api --port 8081
+"""
+import json
+import time
+import hashlib
+import argparse
+import threading
+from collections import Counter, deque
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Delivery Bot", "username": "delivery_bot"}
+
+# Methods answered with a bare `true`
+TRUE_METHODS = {
+    "answerCallbackQuery", "setMyCommands", "deleteMyCommands", "setWebhook",
+    "deleteWebhook", "deleteMessage", "sendChatAction", "close", "logOut",
+}
+
+
+class FakeBotAPI:
+    """Threaded HTTP server imitating the Telegram Bot API."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0, upload_bandwidth: float = 0.0, rate_limit: float = 0.0):
+        """
+        Args:
+            latency: Seconds added to every request (network round trip)
+            upload_bandwidth: Bytes per second for uploaded files, 0 for unlimited
+            rate_limit: Messages per second over all chats before answering 429, 0 for unlimited
+        """
+        self.latency = latency
+        self.upload_bandwidth = upload_bandwidth
+        self.rate_limit = rate_limit
+        self.blocked_chats = set()
+        self._sent_times = deque()  # send times within the last second
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread = None
+        self._message_id = 0
+        self._file_ids = set()
+        self._failures = {}  # method -> deque of (error_code, description, parameters)
+        self._updates = deque()
+        self._update_event = threading.Event()
+        self.calls = []  # (method, params)
+        self.counts = Counter()
+        self.delivered = Counter()  # chat_id -> messages successfully sent to it
+        self.bytes_uploaded = 0
+        self.files_uploaded = 0
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self) -> str:
+        """Value for telebot.apihelper.API_URL."""
+        return self.url + "/bot{0}/{1}"
+
+    def start(self) -> "FakeBotAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset(self) -> None:
+        """Clear recorded calls and counters."""
+        with self._lock:
+            self.calls.clear()
+            self.counts.clear()
+            self.delivered.clear()
+            self.bytes_uploaded = 0
+            self.files_uploaded = 0
+
+    def forget_files(self) -> None:
+        """Invalidate all issued file_ids, like a bot token change would."""
+        with self._lock:
+            self._file_ids.clear()
+
+    def fail_next(self, method: str, error_code: int, description: str, retry_after: int = None) -> None:
+        """Make the next call of method fail with the given error."""
+        parameters = {"retry_after": retry_after} if retry_after is not None else None
+        with self._lock:
+            self._failures.setdefault(method, deque()).append((error_code, description, parameters))
+
+    def push_update(self, update: dict) -> None:
+        """Queue an update for getUpdates."""
+        with self._lock:
+            self._updates.append(update)
+        self._update_event.set()
+
+    # Request handling
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._handle()
+
+            def do_POST(self):
+                self._handle()
+
+            def _handle(self):
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                method = parts[-1] if len(parts) >= 2 and parts[-2].startswith("bot") else ""
+
+                params = dict(parse_qsl(url.query))
+                files = {}
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                content_type = self.headers.get("Content-Type", "")
+                if content_type.startswith("multipart/form-data"):
+                    _parse_multipart(content_type, body, params, files)
+                elif content_type.startswith("application/json") and body:
+                    params.update(json.loads(body))
+                elif body:
+                    params.update(parse_qsl(body.decode()))
+
+                status, payload = api._dispatch(method, params, files)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def _dispatch(self, method, params, files):
+        if self.latency:
+            time.sleep(self.latency)
+
+        uploaded = sum(len(data) for _, data in files.values())
+        if uploaded and self.upload_bandwidth:
+            time.sleep(uploaded / self.upload_bandwidth)
+
+        with self._lock:
+            self.calls.append((method, params))
+            self.counts[method] += 1
+            self.bytes_uploaded += uploaded
+            self.files_uploaded += len(files)
+
+            failures = self._failures.get(method)
+            if failures:
+                error_code, description, parameters = failures.popleft()
+                return error_code, _error(error_code, description, parameters)
+
+            if method.startswith("send"):
+                if self._over_rate_limit():
+                    self.counts["429"] += 1
+                    return 429, _error(429, "Too Many Requests: retry after 1", {"retry_after": 1})
+                if str(params.get("chat_id")) in self.blocked_chats:
+                    return 403, _error(403, "Forbidden: bot was blocked by the user")
+
+        try:
+            result = self._result(method, params, files)
+        except _BadRequest as e:
+            return 400, _error(400, f"Bad Request: {e}")
+
+        if method.startswith("send"):
+            with self._lock:
+                self.delivered[str(params.get("chat_id"))] += 1
+        return 200, {"ok": True, "result": result}
+
+    def _over_rate_limit(self):
+        """Count a sent message against the rate limit (called with the lock held)."""
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        while self._sent_times and self._sent_times[0] <= now - 1:
+            self._sent_times.popleft()
+        if len(self._sent_times) >= self.rate_limit:
+            return True
+        self._sent_times.append(now)
+        return False
+
+    def _result(self, method, params, files):
+        if method in TRUE_METHODS:
+            return True
+        if method == "getMe":
+            return BOT_USER
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "getWebhookInfo":
+            return {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        if method in ("sendMessage", "editMessageText"):
+            return self._message(params, text=params.get("text", ""))
+        if method in ("editMessageCaption", "editMessageReplyMarkup"):
+            return self._message(params, text="")
+        if method == "sendPhoto":
+            return self._message(params, photo=self._photo(params.get("photo"), files),
+                                 caption=params.get("caption"))
+        if method == "editMessageMedia":
+            media = json.loads(params.get("media") or "{}")
+            return self._message(params, photo=self._photo(media.get("media"), files),
+                                 caption=media.get("caption"))
+        return True
+
+    def _photo(self, photo, files):
+        """Resolve a photo parameter to a list of PhotoSize dicts."""
+        if photo and photo.startswith("attach://"):
+            name = photo[len("attach://"):]
+            files = {name: files[name]} if name in files else {}
+            photo = None
+
+        if photo:
+            with self._lock:
+                if photo not in self._file_ids:
+                    raise _BadRequest("wrong file identifier/HTTP URL specified")
+            data_id = photo
+        else:
+            if not files:
+                raise _BadRequest("there is no photo in the request")
+            _, data = next(iter(files.values()))
+            data_id = "AgAC" + hashlib.sha1(data).hexdigest()[:28]
+            with self._lock:
+                self._file_ids.add(data_id)
+
+        return [{"file_id": data_id, "file_unique_id": data_id[-12:], "width": 800, "height": 600}]
+
+    def _message(self, params, text=None, photo=None, caption=None):
+        with self._lock:
+            self._message_id += 1
+            message_id = int(params.get("message_id") or self._message_id)
+
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if photo:
+            message["photo"] = photo
+            if caption:
+                message["caption"] = caption
+        else:
+            message["text"] = text or ""
+        return message
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+
+        deadline = time.time() + timeout
+        while True:
+            with self._lock:
+                while self._updates and self._updates[0]["update_id"] < offset:
+                    self._updates.popleft()
+                if self._updates:
+                    limit = int(params.get("limit") or 100)
+                    return list(self._updates)[:limit]
+                self._update_event.clear()
+
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return []
+            self._update_event.wait(min(remaining, 0.5))
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many concurrent clients; the default backlog of 5 drops connections
+    # and stalls them for a second until the SYN is retransmitted
+    request_queue_size = 256
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _error(error_code, description, parameters=None):
+    payload = {"ok": False, "error_code": error_code, "description": description}
+    if parameters:
+        payload["parameters"] = parameters
+    return payload
+
+
+def _parse_multipart(content_type, body, params, files):
+    """Split a multipart/form-data body into plain fields and uploaded files."""
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+    )
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        data = part.get_payload(decode=True) or b""
+        filename = part.get_filename()
+        if filename is not None:
+            files[name] = (filename, data)
+        else:
+            params[name] = data.decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeBotAPI(args.host, args.port, latency=args.latency).start()
+    print(f"Fake Bot API listening on {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Seed a database with synthetic users and buffs for benchmarks.
+
+Usage:
+    python -m benchmarks.seed --database-url sqlite:///bench.db --users 1000000 --buffs 200000
+"""
+import time
+import random
+import argparse
+from sqlalchemy import create_engine, insert, func, select
+from models import db, User, Buff, ShopItem, Stats
+from migrations import run_migrations
+
+# Seeded data spans this many days back from now
+HISTORY_DAYS = 365
+
+BUFF_TYPES = [
+    ("hyper_buff", "Гипер Бафф", 0.5, 40),
+    ("super_buff", "Супер Бафф", 0.15, 30),
+    ("mega_buff", "Мега Бафф", 0.25, 30),
+    ("ultra_buff", "Ультра Бафф", 0.35, 35),
+]
+
+
+def seed(engine, users: int, buffs: int, batch_size: int = 10000, seed_value: int = 42) -> None:
+    """Create the schema and fill it up to the requested number of rows."""
+    rng = random.Random(seed_value)
+    now = time.time()
+    start = now - HISTORY_DAYS * 86400
+
+    db.metadata.create_all(engine)
+    run_migrations(engine)
+
+    with engine.begin() as conn:
+        existing_users = conn.execute(select(func.count()).select_from(User)).scalar()
+        existing_buffs = conn.execute(select(func.count()).select_from(Buff)).scalar()
+
+        if not conn.execute(select(func.count()).select_from(ShopItem)).scalar():
+            conn.execute(insert(ShopItem), [
+                {"item_id": item_id, "name": name, "description": name, "price": 1000,
+                 "bonus": bonus, "duration": duration, "is_active": True}
+                for item_id, name, bonus, duration in BUFF_TYPES
+            ])
+        if not conn.execute(select(func.count()).select_from(Stats)).scalar():
+            conn.execute(insert(Stats), [{"total_users": 0, "total_deliveries": 0, "total_money": 0}])
+
+    # Users: telegram ids are sequential so benchmarks can address them
+    for offset in range(existing_users, users, batch_size):
+        rows = []
+        for n in range(offset, min(offset + batch_size, users)):
+            created_at = rng.uniform(start, now)
+            deliveries = int(rng.paretovariate(1.5)) * 3
+            rows.append({
+                "telegram_id": str(1_000_000 + n),
+                "username": f"Курьер {n}",
+                "deliveries": deliveries,
+                "money": deliveries * rng.randint(35, 200),
+                "experience": deliveries * 2,
+                "last_delivery": rng.uniform(created_at, now) if deliveries else 0,
+                "blocked": rng.random() < 0.01,
+                "created_at": created_at,
+                "is_admin": False,
+            })
+        with engine.begin() as conn:
+            conn.execute(insert(User), rows)
+
+    # Buffs: mostly expired, a few percent active
+    with engine.connect() as conn:
+        max_user_id = conn.execute(select(func.max(User.id))).scalar() or 0
+    for offset in range(existing_buffs, buffs, batch_size):
+        rows = []
+        for _ in range(offset, min(offset + batch_size, buffs)):
+            buff_type, name, bonus, duration = rng.choice(BUFF_TYPES)
+            created_at = rng.uniform(start, now)
+            if rng.random() < 0.03:
+                created_at = now - rng.uniform(0, duration * 60)
+            rows.append({
+                "user_id": rng.randint(1, max_user_id),
+                "buff_type": buff_type,
+                "name": name,
+                "bonus": bonus,
+                "expires_at": created_at + duration * 60,
+                "created_at": created_at,
+            })
+        if rows and max_user_id:
+            with engine.begin() as conn:
+                conn.execute(insert(Buff), rows)
+
+    # Refresh planner statistics
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed a benchmark database")
+    parser.add_argument("--database-url", default="sqlite:///bench.db")
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--buffs", type=int, default=200_000)
+    args = parser.parse_args()
+
+    started = time.time()
+    seed(create_engine(args.database_url), args.users, args.buffs)
+    print(f"Seeded {args.users} users and {args.buffs} buffs in {time.time() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
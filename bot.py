@@ -3,8 +3,7 @@ import logging
 from telebot import TeleBot
 from user_data import (
     get_user_data,
-    update_user_data,
-    can_deliver,
+    deliver,
     get_top_users,
     get_shop_items_count,
     get_shop_item,
@@ -13,7 +12,7 @@ from user_data import (
     is_bot_active,
     set_bot_state
 )
-from config import TELEGRAM_BOT_TOKEN, ADMIN_IDS
+from config import TELEGRAM_BOT_TOKEN, ADMIN_IDS, BOT_MODE
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,7 +25,7 @@ logger = logging.getLogger(__name__)
 if not TELEGRAM_BOT_TOKEN:
     raise ValueError("Не установлен токен бота! Проверьте конфигурацию в config.py")
 
-bot = TeleBot(TELEGRAM_BOT_TOKEN)
+bot = TeleBot(TELEGRAM_BOT_TOKEN, threaded=False)
 
 def check_admin(user_id: int) -> bool:
     """Проверяет, является ли пользователь администратором."""
@@ -91,9 +90,12 @@ def profile_command(message):
 @bot.message_handler(commands=['deliver'])
 @check_bot_active
 def deliver_command(message):
-    can_deliver_now, time_remaining = can_deliver(message.from_user.id)
+    # Рассчитываем заработок
+    base_earnings = 100  # Базовый заработок
+    result = deliver(message.from_user.id, deliveries=1, earnings=base_earnings)
     
-    if not can_deliver_now:
+    if not result["delivered"]:
+        time_remaining = result["time_remaining"]
         if time_remaining:
             minutes = int(time_remaining.total_seconds() // 60)
             seconds = int(time_remaining.total_seconds() % 60)
@@ -105,13 +107,8 @@ def deliver_command(message):
             bot.reply_to(message, "❌ Вы заблокированы!")
         return
     
-    # Рассчитываем заработок
-    base_earnings = 100  # Базовый заработок
-    original_earnings, buffed_earnings = update_user_data(
-        message.from_user.id,
-        deliveries=1,
-        earnings=base_earnings
-    )
+    original_earnings = result["original_earnings"]
+    buffed_earnings = result["buffed_earnings"]
     
     # Формируем сообщение
     if buffed_earnings > original_earnings:
@@ -233,8 +230,14 @@ def main():
     logger.info("Инициализация бота...")
     try:
         logger.info("Бот успешно запущен!")
-        logger.info("Начинаем получение обновлений...")
-        bot.infinity_polling()
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook_server
+            logger.info("Запускаем сервер вебхука...")
+            run_webhook_server(bot)
+        else:
+            from dispatcher import poll_updates
+            logger.info("Начинаем получение обновлений...")
+            poll_updates(bot)
     except Exception as e:
         logger.error(f"Ошибка при работе бота: {e}")
 
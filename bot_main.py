@@ -8,7 +8,8 @@ from dotenv import load_dotenv
 import telebot
 from telebot import types
 from handlers import register_handlers
-from user_data import initialize_database
+from storage import get_storage
+from config import BOT_MODE, BOT_RUNTIME, STORAGE_BACKEND
 
 # Load environment variables
 load_dotenv()
@@ -36,12 +37,23 @@ def run_bot():
         return
     
     try:
-        # Initialize database
-        initialize_database()
-        logger.info("Database initialized successfully")
+        # Initialize storage
+        get_storage().initialize()
+        logger.info(f"Storage ({STORAGE_BACKEND}) initialized successfully")
         
-        # Create the bot instance
-        bot = telebot.TeleBot(token)
+        # Run on asyncio instead of worker threads (works on the database only)
+        if BOT_RUNTIME == "async":
+            if STORAGE_BACKEND != "sqlalchemy":
+                logger.error("BOT_RUNTIME=async requires STORAGE_BACKEND=sqlalchemy")
+                return
+            import asyncio
+            from async_bot import run_async_bot
+            logger.info("Starting bot on the asyncio runtime...")
+            asyncio.run(run_async_bot(token))
+            return
+        
+        # Create the bot instance (the dispatcher runs handlers on its own workers)
+        bot = telebot.TeleBot(token, threaded=False)
         logger.info("Telegram bot initialized successfully")
         
         # Register all handlers
@@ -52,6 +64,7 @@ def run_bot():
             types.BotCommand(command="start", description="Начать использование бота"),
             types.BotCommand(command="raznos", description="Разносить посылки"),
             types.BotCommand(command="top", description="Список лучших курьеров"),
+            types.BotCommand(command="rank", description="Ваше место в рейтинге"),
             types.BotCommand(command="profile", description="Ваш профиль"),
             types.BotCommand(command="magaz", description="Магазин улучшений")
         ]
@@ -59,8 +72,14 @@ def run_bot():
         
         # Run the bot
         logger.info("Bot started successfully!")
-        logger.info("Starting bot polling...")
-        bot.infinity_polling(timeout=10, long_polling_timeout=5)
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook_server
+            logger.info("Starting webhook server...")
+            run_webhook_server(bot)
+        else:
+            from dispatcher import poll_updates
+            logger.info("Starting bot polling...")
+            poll_updates(bot, long_polling_timeout=5)
     except Exception as e:
         logger.error(f"Error starting Telegram bot: {e}")
 
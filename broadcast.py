@@ -0,0 +1,448 @@
+"""
+Broadcast Module
+
+This module sends admin broadcasts to the bot's users. A broadcast is a
+BroadcastJob row; the users are paged through by id (keyset cursor over
+the non-blocked users) and the messages are sent by a small pool of
+threads behind a token bucket that spaces them at BROADCAST_RATE messages
+per second, Telegram's global limit for bots. A 429 answer pauses the
+bucket for retry_after and lowers the rate, which then creeps back up
+while sends succeed.
+
+Every recipient gets a BroadcastRecipient row with the outcome (sent,
+blocked, failed), written in batches together with the job counters and
+the job's cursor. A broadcast interrupted by a restart is resumed from
+its cursor, skipping the users that already have a recipient row, so at
+most the last unrecorded batch can be sent twice. A lease on the job row
+keeps two processes from sending the same broadcast. The process that
+crashed can't give its lease up, so every process checks for jobs whose
+lease ran out every BROADCAST_RESUME_INTERVAL and takes them over.
+"""
+import time
+import queue
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, update, insert, func, exists
+from telebot.apihelper import ApiTelegramException
+from models import db, User, BroadcastJob, BroadcastRecipient
+from config import (
+    BROADCAST_RATE,
+    BROADCAST_WORKERS,
+    BROADCAST_PAGE_SIZE,
+    BROADCAST_FLUSH_SIZE,
+    BROADCAST_MAX_ATTEMPTS,
+    BROADCAST_ACTIVE_DAYS,
+    BROADCAST_LEASE_SECONDS,
+    BROADCAST_RESUME_INTERVAL
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Telegram doesn't allow more than one message per second to the same chat
+PER_CHAT_INTERVAL = 1.0
+
+# Broadcast targets
+TARGETS = ("all", "active")
+
+_STOP = object()
+
+
+class TokenBucket:
+    """Token bucket with pauses and additive-increase / multiplicative-decrease rate."""
+
+    def __init__(self, rate: float, burst: float = 1.0, min_rate: float = 1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._successes = 0
+
+        # Metrics
+        self.throttled_count = 0
+
+    def acquire(self) -> None:
+        """Block until a send is allowed."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def throttled(self, retry_after: float) -> None:
+        """Telegram answered 429: stop for retry_after and slow down."""
+        with self._lock:
+            now = time.monotonic()
+            self._paused_until = max(self._paused_until, now + retry_after)
+            self._tokens = 0
+            self._updated = self._paused_until
+            self.rate = max(self.min_rate, self.rate * 0.8)
+            self._successes = 0
+            self.throttled_count += 1
+
+    def succeeded(self) -> None:
+        """Speed back up by one message per second after a second's worth of successes."""
+        with self._lock:
+            self._successes += 1
+            if self._successes >= self.rate and self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 1)
+                self._successes = 0
+
+
+def _classify_error(error: Exception) -> Tuple[str, float, str]:
+    """
+    Map a send error to (outcome, retry delay, description).
+
+    The outcome is "retry", "blocked" (the user blocked the bot or is
+    deactivated) or "failed".
+    """
+    if isinstance(error, ApiTelegramException):
+        description = error.description or str(error)
+        if error.error_code == 429:
+            parameters = (error.result_json or {}).get("parameters") or {}
+            return "retry", float(parameters.get("retry_after") or 1), description
+        if error.error_code == 403:
+            return "blocked", 0, description
+        if error.error_code >= 500:
+            return "retry", 1, description
+        return "failed", 0, description
+    # Network errors
+    return "retry", 1, str(error)
+
+
+class BroadcastRunner:
+    """Sends one broadcast job from a background thread."""
+
+    def __init__(self, app, bot, job_id: int, rate: float = BROADCAST_RATE,
+                 workers: int = BROADCAST_WORKERS, page_size: int = BROADCAST_PAGE_SIZE):
+        self.app = app
+        self.bot = bot
+        self.job_id = job_id
+        self.page_size = page_size
+        self.workers = max(1, workers)
+        self.bucket = TokenBucket(rate)
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self.text = ""
+        self.parse_mode = None
+
+    def start(self) -> "BroadcastRunner":
+        self._thread = threading.Thread(target=self.run, name=f"broadcast-{self.job_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop after the current page (the job stays resumable)."""
+        self._stop.set()
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        if self._thread:
+            self._thread.join(timeout)
+
+    def run(self) -> None:
+        with self.app.app_context():
+            try:
+                if not _claim(self.job_id):
+                    logger.info(f"Broadcast {self.job_id} is finished or sent by another process")
+                    return
+                self._run()
+            except Exception as e:
+                logger.error(f"Broadcast {self.job_id} stopped with an error: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+                _runners.pop(self.job_id, None)
+
+    def _run(self) -> None:
+        job = db.session.get(BroadcastJob, self.job_id)
+        self.text = job.text
+        cursor, target = job.cursor, job.target
+
+        if not job.total:
+            job.total = db.session.execute(
+                select(func.count()).select_from(User).where(*_target_conditions(target))
+            ).scalar()
+        db.session.commit()
+
+        threads = [
+            threading.Thread(target=self._work, name=f"broadcast-{self.job_id}-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        started = time.monotonic()
+        sent = 0
+        try:
+            while not self._stop.is_set():
+                page = self._next_page(cursor, target)
+                if not page:
+                    break
+                sent += self._send_page(page)
+                cursor = page[-1][0]
+                if not self._save_cursor(cursor):
+                    logger.info(f"Broadcast {self.job_id} was cancelled")
+                    return
+        finally:
+            # After an error the rest of the page must not be sent unrecorded
+            with self._tasks.mutex:
+                self._tasks.queue.clear()
+            for _ in threads:
+                self._tasks.put(_STOP)
+
+        if self._stop.is_set():
+            # Give the lease up so that the job can be resumed right away
+            db.session.execute(
+                update(BroadcastJob).where(BroadcastJob.id == self.job_id).values(lease_until=0)
+            )
+            db.session.commit()
+            return
+
+        db.session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == self.job_id, BroadcastJob.status == 'running')
+            .values(status='done', finished_at=time.time(), lease_until=0)
+        )
+        db.session.commit()
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Broadcast {self.job_id} finished: {sent} messages in {elapsed:.1f}s "
+            f"({sent / elapsed if elapsed else 0:.1f}/s, throttled {self.bucket.throttled_count} times)"
+        )
+
+    def _next_page(self, cursor: int, target: str) -> List[Tuple[int, str]]:
+        """Next users after the cursor that have no recipient row for this job yet."""
+        recorded = exists().where(
+            BroadcastRecipient.job_id == self.job_id,
+            BroadcastRecipient.user_id == User.id
+        )
+        return db.session.execute(
+            select(User.id, User.telegram_id)
+            .where(User.id > cursor, *_target_conditions(target), ~recorded)
+            .order_by(User.id)
+            .limit(self.page_size)
+        ).all()
+
+    def _send_page(self, page: List[Tuple[int, str]]) -> int:
+        """Send to a page of users, recording the outcomes in batches. Returns the number sent."""
+        for user_id, telegram_id in page:
+            self._tasks.put((0.0, user_id, telegram_id, 1))
+
+        rows = []
+        sent = failed = total_sent = 0
+        last_flush = time.monotonic()
+        for _ in range(len(page)):
+            row = self._results.get()
+            rows.append(row)
+            if row["status"] == "sent":
+                sent += 1
+                total_sent += 1
+            else:
+                failed += 1
+
+            if len(rows) >= BROADCAST_FLUSH_SIZE or time.monotonic() - last_flush >= 1:
+                self._flush(rows, sent, failed)
+                rows, sent, failed = [], 0, 0
+                last_flush = time.monotonic()
+
+        self._flush(rows, sent, failed)
+        return total_sent
+
+    def _flush(self, rows: List[Dict[str, Any]], sent: int, failed: int) -> None:
+        """Record recipient outcomes, bump the job counters and renew the lease."""
+        if rows:
+            db.session.execute(insert(BroadcastRecipient), rows)
+        db.session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == self.job_id)
+            .values(
+                sent=BroadcastJob.sent + sent,
+                failed=BroadcastJob.failed + failed,
+                lease_until=time.time() + BROADCAST_LEASE_SECONDS
+            )
+        )
+        db.session.commit()
+
+    def _save_cursor(self, cursor: int) -> bool:
+        """Move the job cursor past a finished page. Returns False if the job was cancelled."""
+        result = db.session.execute(
+            update(BroadcastJob)
+            .where(BroadcastJob.id == self.job_id, BroadcastJob.status == 'running')
+            .values(cursor=cursor, lease_until=time.time() + BROADCAST_LEASE_SECONDS)
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _work(self) -> None:
+        """Worker thread: take a recipient, wait for a token and send."""
+        while True:
+            task = self._tasks.get()
+            if task is _STOP:
+                return
+            not_before, user_id, telegram_id, attempts = task
+
+            delay = not_before - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.bucket.acquire()
+
+            try:
+                self.bot.send_message(telegram_id, self.text, parse_mode=self.parse_mode)
+                self.bucket.succeeded()
+                outcome, error = "sent", None
+            except Exception as e:
+                outcome, retry_after, error = _classify_error(e)
+                if outcome == "retry":
+                    if isinstance(e, ApiTelegramException) and e.error_code == 429:
+                        self.bucket.throttled(retry_after)
+                    if attempts < BROADCAST_MAX_ATTEMPTS:
+                        # Retries of the same chat respect the per-chat limit
+                        ready_at = time.monotonic() + max(retry_after, PER_CHAT_INTERVAL)
+                        self._tasks.put((ready_at, user_id, telegram_id, attempts + 1))
+                        continue
+                    outcome = "failed"
+
+            self._results.put({
+                "job_id": self.job_id,
+                "user_id": user_id,
+                "telegram_id": str(telegram_id),
+                "status": outcome,
+                "attempts": attempts,
+                "error": error[:256] if error else None,
+                "sent_at": time.time()
+            })
+
+
+def _target_conditions(target: str) -> List[Any]:
+    conditions = [User.blocked == False]  # noqa: E712
+    if target == "active":
+        conditions.append(User.last_delivery >= time.time() - BROADCAST_ACTIVE_DAYS * 86400)
+    return conditions
+
+
+def _claim(job_id: int) -> bool:
+    """Take the job's lease if it is unfinished and nobody holds it."""
+    now = time.time()
+    result = db.session.execute(
+        update(BroadcastJob)
+        .where(
+            BroadcastJob.id == job_id,
+            BroadcastJob.status.in_(('pending', 'running')),
+            BroadcastJob.lease_until < now
+        )
+        .values(
+            status='running',
+            started_at=func.coalesce(BroadcastJob.started_at, now),
+            lease_until=now + BROADCAST_LEASE_SECONDS
+        )
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+# Runners of this process by job id
+_runners: Dict[int, BroadcastRunner] = {}
+
+# Thread taking over broadcasts whose lease ran out
+_resumer = None
+_resumer_lock = threading.Lock()
+
+
+def create_broadcast(text: str, target: str = "all", created_by: Optional[str] = None) -> BroadcastJob:
+    """Create a broadcast job (needs app context)."""
+    if target not in TARGETS:
+        raise ValueError(f"Unknown broadcast target: {target}")
+    if not text or not text.strip():
+        raise ValueError("Broadcast text is empty")
+
+    job = BroadcastJob(text=text, target=target, created_by=created_by, status='pending')
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def start_broadcast(app, bot, job_id: int, **kwargs) -> BroadcastRunner:
+    """Start sending a broadcast in the background."""
+    runner = _runners.get(job_id)
+    if runner is None:
+        runner = _runners[job_id] = BroadcastRunner(app, bot, job_id, **kwargs)
+        runner.start()
+    return runner
+
+
+def resume_broadcasts(app, bot, **kwargs) -> List[int]:
+    """Resume the broadcasts a previous run didn't finish. Returns their ids."""
+    with app.app_context():
+        job_ids = db.session.execute(
+            select(BroadcastJob.id)
+            .where(BroadcastJob.status.in_(('pending', 'running')), BroadcastJob.lease_until < time.time())
+            .order_by(BroadcastJob.id)
+        ).scalars().all()
+
+    for job_id in job_ids:
+        logger.info(f"Resuming broadcast {job_id}")
+        start_broadcast(app, bot, job_id, **kwargs)
+    return job_ids
+
+
+def start_resumer(app, bot, interval: float = BROADCAST_RESUME_INTERVAL, **kwargs) -> None:
+    """Resume unfinished broadcasts now, then again whenever a lease runs out (kwargs go to the runners)."""
+    global _resumer
+    with _resumer_lock:
+        if _resumer is not None:
+            return
+        _resumer = threading.Thread(target=_resume_loop, args=(app, bot, interval, kwargs),
+                                    name="broadcast-resumer", daemon=True)
+        _resumer.start()
+
+
+def _resume_loop(app, bot, interval: float, kwargs: Dict[str, Any]) -> None:
+    while True:
+        try:
+            resume_broadcasts(app, bot, **kwargs)
+        except Exception as e:
+            logger.error(f"Error resuming broadcasts: {e}")
+        time.sleep(interval)
+
+
+def cancel_broadcast(job_id: int) -> bool:
+    """Cancel a broadcast (needs app context); its runner stops after the current page."""
+    result = db.session.execute(
+        update(BroadcastJob)
+        .where(BroadcastJob.id == job_id, BroadcastJob.status.in_(('pending', 'running')))
+        .values(status='cancelled', finished_at=time.time(), lease_until=0)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def broadcast_status(job_id: int) -> Optional[Dict[str, Any]]:
+    """Job fields plus recipient counts by status (needs app context)."""
+    job = db.session.get(BroadcastJob, job_id)
+    if job is None:
+        return None
+
+    status = job.to_dict()
+    status["recipients"] = dict(db.session.execute(
+        select(BroadcastRecipient.status, func.count())
+        .where(BroadcastRecipient.job_id == job_id)
+        .group_by(BroadcastRecipient.status)
+    ).all())
+    runner = _runners.get(job_id)
+    status["rate"] = round(runner.bucket.rate, 2) if runner else None
+    return status
@@ -0,0 +1,185 @@
+"""
+Buff Registry Module
+
+This module keeps every user's active buffs in memory so that multiplier
+and buff list lookups don't have to scan the buffs table. Expiry is
+tracked with a min-heap keyed by expires_at and applied lazily on access.
+The database is only read once on cold start. A background sweeper
+deletes long-expired Buff rows in batches to keep the table small.
+"""
+import time
+import heapq
+import logging
+import threading
+from typing import Dict, List, Any
+from sqlalchemy import select, delete
+from models import db, User, Buff
+from config import BUFF_SWEEP_INTERVAL, BUFF_RETENTION_HOURS, BUFF_SWEEP_BATCH_SIZE
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class BuffRegistry:
+    """In-memory index of active buffs per user with heap-based expiry."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._buffs = {}        # telegram_id -> {buff_id: buff fields}
+        self._multipliers = {}  # telegram_id -> total bonus of active buffs
+        self._heap = []         # (expires_at, telegram_id, buff_id)
+        self._loaded = False
+        self._sweeper = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def ensure_loaded(self) -> None:
+        """Load active buffs from the database on cold start (needs app context)."""
+        if self._loaded:
+            return
+
+        with self._lock:
+            if self._loaded:
+                return
+
+            now = time.time()
+            rows = db.session.execute(
+                select(User.telegram_id, Buff)
+                .join(User, Buff.user_id == User.id)
+                .where(Buff.expires_at > now)
+            ).all()
+
+            for telegram_id, buff in rows:
+                self._add(telegram_id, _buff_fields(buff))
+
+            self._loaded = True
+            logger.info(f"Buff registry loaded with {len(rows)} active buffs")
+
+    def add(self, telegram_id: Any, buff: Buff) -> None:
+        """Register a newly purchased buff."""
+        with self._lock:
+            self._add(str(telegram_id), _buff_fields(buff))
+
+    def _add(self, telegram_id: str, fields: Dict[str, Any]) -> None:
+        user_buffs = self._buffs.setdefault(telegram_id, {})
+        user_buffs[fields["id"]] = fields
+        self._multipliers[telegram_id] = self._multipliers.get(telegram_id, 0.0) + fields["bonus"]
+        heapq.heappush(self._heap, (fields["expires_at"], telegram_id, fields["id"]))
+
+    def _evict_expired(self) -> None:
+        """Pop expired buffs off the heap (called with the lock held)."""
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            _, telegram_id, buff_id = heapq.heappop(self._heap)
+            user_buffs = self._buffs.get(telegram_id)
+            if not user_buffs or user_buffs.pop(buff_id, None) is None:
+                continue
+
+            if user_buffs:
+                # Recompute instead of subtracting to avoid float drift
+                self._multipliers[telegram_id] = sum(b["bonus"] for b in user_buffs.values())
+            else:
+                del self._buffs[telegram_id]
+                del self._multipliers[telegram_id]
+
+    def multiplier(self, telegram_id: Any) -> float:
+        """Get the total earnings multiplier of a user's active buffs."""
+        with self._lock:
+            self._evict_expired()
+            return self._multipliers.get(str(telegram_id), 0.0)
+
+    def active_buffs(self, telegram_id: Any) -> List[Dict[str, Any]]:
+        """Get copies of a user's active buffs, ordered by expiry."""
+        with self._lock:
+            self._evict_expired()
+            user_buffs = self._buffs.get(str(telegram_id), {})
+            return sorted((dict(b) for b in user_buffs.values()), key=lambda b: b["expires_at"])
+
+    def active_count(self, telegram_id: Any) -> int:
+        """Get the number of a user's active buffs."""
+        with self._lock:
+            self._evict_expired()
+            return len(self._buffs.get(str(telegram_id), ()))
+
+    def total_active(self) -> int:
+        """Get the number of active buffs across all users."""
+        with self._lock:
+            self._evict_expired()
+            return sum(len(user_buffs) for user_buffs in self._buffs.values())
+
+    def start_sweeper(self, app) -> None:
+        """Start the background thread that deletes long-expired Buff rows."""
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, args=(app,), daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self, app) -> None:
+        while True:
+            time.sleep(BUFF_SWEEP_INTERVAL)
+            try:
+                with app.app_context():
+                    deleted = sweep_expired_buffs()
+                if deleted:
+                    logger.info(f"Deleted {deleted} expired buffs")
+            except Exception as e:
+                logger.error(f"Error sweeping expired buffs: {e}")
+
+
+def sweep_expired_buffs() -> int:
+    """
+    Delete buffs that expired more than BUFF_RETENTION_HOURS ago, in batches.
+
+    Recently expired buffs are kept so that daily admin stats stay correct.
+
+    Returns:
+        Number of deleted rows
+    """
+    cutoff = time.time() - BUFF_RETENTION_HOURS * 3600
+    total = 0
+
+    while True:
+        batch = (
+            select(Buff.id)
+            .where(Buff.expires_at < cutoff)
+            .limit(BUFF_SWEEP_BATCH_SIZE)
+        )
+        result = db.session.execute(
+            delete(Buff)
+            .where(Buff.id.in_(batch.scalar_subquery()))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+        total += result.rowcount
+        if result.rowcount < BUFF_SWEEP_BATCH_SIZE:
+            return total
+
+
+def format_buff(buff: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the remaining time to buff fields, like Buff.to_dict()."""
+    remaining_seconds = max(0, int(buff["expires_at"] - time.time()))
+    minutes, seconds = divmod(remaining_seconds, 60)
+
+    result = dict(buff)
+    result["remaining_time"] = f"{minutes} мин. {seconds} сек."
+    return result
+
+
+def _buff_fields(buff: Buff) -> Dict[str, Any]:
+    return {
+        "id": buff.id,
+        "user_id": buff.user_id,
+        "buff_type": buff.buff_type,
+        "name": buff.name,
+        "bonus": buff.bonus,
+        "expires_at": buff.expires_at,
+        "created_at": buff.created_at
+    }
+
+
+# Shared registry for the process
+buff_registry = BuffRegistry()
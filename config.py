@@ -69,8 +69,116 @@ DELIVERY_COOLDOWN_MINUTES = 7
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 USER_DATA_FILE = os.path.join(DATA_DIR, 'user_data.json')
+USER_DATA_LOG_FILE = os.path.join(DATA_DIR, 'user_data.log')
 SHOP_DATA_FILE = os.path.join(DATA_DIR, 'shop_items.json')
 STATS_DATA_FILE = os.path.join(DATA_DIR, 'stats.json')
+SHOP_CATALOG_VERSION_FILE = os.path.join(DATA_DIR, 'shop_catalog.version')
+COOLDOWN_VERSION_FILE = os.path.join(DATA_DIR, 'cooldown.version')
+
+# Интервал сжатия журнала изменений в снапшот (в секундах)
+SNAPSHOT_COMPACT_INTERVAL = 60
+
+# Отложенная запись статистики: интервал (в секундах) и порог накопленных изменений
+STATS_FLUSH_INTERVAL = 5
+STATS_FLUSH_THRESHOLD = 100
+
+# Очистка истекших баффов: интервал (в секундах), срок хранения (в часах) и размер пачки
+BUFF_SWEEP_INTERVAL = 600
+BUFF_RETENTION_HOURS = 48
+BUFF_SWEEP_BATCH_SIZE = 1000
+
+# Таблица лидеров: сколько лучших курьеров держать в памяти и интервал сверки с БД (в секундах)
+LEADERBOARD_TOP_SIZE = 10
+LEADERBOARD_RECONCILE_INTERVAL = 300
+
+# Кэш изображений доставки: размер кэша в памяти и очистка папки сгенерированных файлов
+IMAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+DELIVERY_IMAGES_MAX_BYTES = 100 * 1024 * 1024
+DELIVERY_IMAGES_MAX_AGE_HOURS = 24
+DELIVERY_IMAGES_SWEEP_INTERVAL = 600
+
+# Как часто проверять, не изменился ли каталог магазина в другом процессе (в секундах)
+SHOP_CATALOG_CHECK_INTERVAL = 1
+
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+
+# Вебхук: публичный URL сервера, путь, секретный токен (если пустой, генерируется при запуске)
+# и адрес отдельного веб-сервера
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8443))
+
+# Обработка обновлений (вебхук и polling): число потоков, размер очереди
+# и время на обработку оставшихся обновлений при остановке (в секундах)
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", 8))
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", 1000))
+UPDATE_DRAIN_TIMEOUT = 30
+
+# Снапшот статистики дашборда: интервал пересчета и время простоя, после которого
+# пересчет останавливается (в секундах)
+STATS_SNAPSHOT_INTERVAL = 2
+STATS_SNAPSHOT_IDLE_TIMEOUT = 60
+
+# Интервал замера загрузки системы (CPU, память, диск) для дашборда (в секундах)
+SYSTEM_SNAPSHOT_INTERVAL = 10
+
+# Живая лента дашборда (SSE): размер буфера событий для повтора после переподключения,
+# лимит подписчиков, интервал heartbeat и время жизни одного соединения (в секундах)
+EVENT_BUFFER_SIZE = 1000
+SSE_MAX_SUBSCRIBERS = 50
+SSE_HEARTBEAT_INTERVAL = 15
+SSE_STREAM_MAX_SECONDS = 300
+
+# Рассылка: сообщений в секунду (глобальный лимит Telegram), число потоков отправки,
+# размер страницы пользователей, сколько результатов записывать за раз, число попыток,
+# кого считать активным (в днях), срок аренды задачи процессом и как часто забирать
+# задачи с истекшей арендой (например, после падения процесса) (в секундах)
+BROADCAST_RATE = 30
+BROADCAST_WORKERS = 8
+BROADCAST_PAGE_SIZE = 1000
+BROADCAST_FLUSH_SIZE = 200
+BROADCAST_MAX_ATTEMPTS = 5
+BROADCAST_ACTIVE_DAYS = 7
+BROADCAST_LEASE_SECONDS = 60
+BROADCAST_RESUME_INTERVAL = 30
+
+# Как часто проверять, не изменились ли блокировки пользователей в другом процессе (в секундах)
+COOLDOWN_CHECK_INTERVAL = 1
+
+# Пул соединений с БД (общий для бота и веб-интерфейса): каждый поток обработки обновлений
+# держит не больше одного соединения, плюс запас для веб-запросов и фоновых задач;
+# сколько соединений можно открыть сверх пула и сколько ждать свободного (в секундах)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", UPDATE_WORKERS + 4))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 4))
+DB_POOL_TIMEOUT = 10
+
+# Режим выполнения бота: "threaded" (потоки, по умолчанию) или "async" (asyncio: AsyncTeleBot
+# и асинхронный драйвер БД asyncpg/aiosqlite); для async - сколько обновлений обрабатывать
+# одновременно, размер пула соединений асинхронного движка и число HTTP-соединений к Bot API
+BOT_RUNTIME = os.environ.get("BOT_RUNTIME", "threaded")
+ASYNC_MAX_CONCURRENT_UPDATES = int(os.environ.get("ASYNC_MAX_CONCURRENT_UPDATES", 1000))
+ASYNC_DB_POOL_SIZE = int(os.environ.get("ASYNC_DB_POOL_SIZE", 20))
+ASYNC_BOT_API_CONNECTIONS = int(os.environ.get("ASYNC_BOT_API_CONNECTIONS", 100))
+
+# Хранилище данных бота: "sqlalchemy" (база данных, по умолчанию), "file" (журналы и снапшоты
+# в STORAGE_FILE_DIR, без сервера БД, только один процесс) или "memory" (без сохранения, для проверок)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlalchemy")
+STORAGE_FILE_DIR = os.path.join(DATA_DIR, 'store')
+
+# Трассировка обновлений бота и HTTP-запросов: время обработчиков, запросов к БД и вызовов Bot API,
+# метрики в формате Prometheus на /metrics. TRACE_EXPORT_FILE - файл для спанов в формате
+# OpenTelemetry JSON (по строке на спан), пусто - не выгружать. N_PLUS_ONE_THRESHOLD - сколько
+# одинаковых запросов за одно обновление или HTTP-запрос записывается в лог как N+1
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") != "0"
+TRACE_EXPORT_FILE = os.environ.get("TRACE_EXPORT_FILE", "")
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 10))
+
+# Экспорт данных из админки: строк в одном запросе к БД и строк в одном отправляемом куске
+EXPORT_PAGE_SIZE = 5000
+EXPORT_CHUNK_ROWS = 500
 
 # Создаем директорию для данных, если её нет
 os.makedirs(DATA_DIR, exist_ok=True)
@@ -0,0 +1,179 @@
+"""
+Cooldown Module
+
+This module answers "can this user deliver now?" from memory. The cache
+keeps the last delivery time of users whose cooldown is still running and
+the set of blocked users; everyone else is free to deliver. It is loaded
+from the database once, then kept up to date write-through by the delivery
+path, so repeated /raznos presses during the cooldown are rejected without
+a database query. Entries whose cooldown ran out are dropped as the cache
+grows, which keeps it at roughly the number of users active within one
+cooldown period.
+
+The cache only ever rejects: a delivery it lets through is still checked
+against the user row by user_data.deliver(), which every delivery command
+goes through. Admin actions that change a user's blocked
+flag call invalidate(), which bumps a version file so that every process
+reloads its cache (checked at most once per COOLDOWN_CHECK_INTERVAL).
+"""
+import os
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+from sqlalchemy import select
+from models import db, User
+from config import DELIVERY_COOLDOWN_MINUTES, COOLDOWN_VERSION_FILE, COOLDOWN_CHECK_INTERVAL
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Entries kept before expired ones are dropped
+MIN_PRUNE_SIZE = 10000
+
+
+class CooldownCache:
+    """Last delivery times and blocked flags of users, for cooldown checks."""
+
+    def __init__(self, cooldown_seconds: float, version_file: str, check_interval: float = 1.0):
+        self.cooldown_seconds = cooldown_seconds
+        self.version_file = version_file
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._last_delivery: Dict[str, float] = {}
+        self._blocked = set()
+        self._prune_at = MIN_PRUNE_SIZE
+        self._loaded_stamp = None  # version file stamp the cache was loaded at
+        self._checked_at = 0.0
+        self._stale = True
+
+        # Metrics
+        self.hits = 0
+        self.rejected = 0
+        self.reloads = 0
+        self.pruned = 0
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.version_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def is_stale(self) -> bool:
+        """Check whether the cache has to be (re)loaded."""
+        if self._stale:
+            return True
+
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        # Another process changed a blocked flag
+        if self._stamp() != self._loaded_stamp:
+            self._stale = True
+        return self._stale
+
+    def reload(self) -> None:
+        """Load blocked users and running cooldowns from the database (needs app context)."""
+        with self._reload_lock:
+            stamp = self._stamp()
+            # Another thread reloaded while this one waited
+            if not self._stale and stamp == self._loaded_stamp:
+                return
+            since = time.time() - self.cooldown_seconds
+
+            blocked = set(db.session.execute(
+                select(User.telegram_id).where(User.blocked == True)  # noqa: E712
+            ).scalars())
+            recent = dict(db.session.execute(
+                select(User.telegram_id, User.last_delivery).where(User.last_delivery > since)
+            ).all())
+
+            with self._lock:
+                self._blocked = blocked
+                self._last_delivery = recent
+                self._prune_at = max(MIN_PRUNE_SIZE, len(recent) * 2)
+                self._loaded_stamp = stamp
+                self._checked_at = time.monotonic()
+                self._stale = False
+                self.reloads += 1
+
+    def check(self, telegram_id: str, now: Optional[float] = None) -> Tuple[bool, float]:
+        """
+        Check a user against the cache.
+
+        Returns:
+            Tuple of (blocked, seconds of cooldown remaining) - (False, 0)
+            means the user may deliver
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            self.hits += 1
+            if telegram_id in self._blocked:
+                self.rejected += 1
+                return True, 0.0
+
+            last_delivery = self._last_delivery.get(telegram_id)
+            if last_delivery:
+                remaining = last_delivery + self.cooldown_seconds - now
+                if remaining > 0:
+                    self.rejected += 1
+                    return False, remaining
+            return False, 0.0
+
+    def record(self, telegram_id: str, last_delivery: float, blocked: Optional[bool] = None) -> None:
+        """
+        Store a user's last delivery time (and blocked flag) as read or written by the database.
+
+        Args:
+            blocked: New blocked flag, None leaves it as it is
+        """
+        with self._lock:
+            if blocked:
+                self._blocked.add(telegram_id)
+            elif blocked is not None:
+                self._blocked.discard(telegram_id)
+
+            if last_delivery:
+                self._last_delivery[telegram_id] = last_delivery
+                if len(self._last_delivery) >= self._prune_at:
+                    self._prune(time.time())
+
+    def _prune(self, now: float) -> None:
+        # Expired cooldowns mean the same as no entry
+        since = now - self.cooldown_seconds
+        expired = [tid for tid, last in self._last_delivery.items() if last <= since]
+        for telegram_id in expired:
+            del self._last_delivery[telegram_id]
+        self.pruned += len(expired)
+        self._prune_at = max(MIN_PRUNE_SIZE, len(self._last_delivery) * 2)
+
+    def invalidate(self) -> None:
+        """Make every process reload its cache, e.g. after a user was (un)blocked."""
+        with self._lock:
+            self._stale = True
+            try:
+                tmp_path = self.version_file + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(str(time.time_ns()))
+                os.replace(tmp_path, self.version_file)
+            except OSError as e:
+                logger.error(f"Error bumping cooldown cache version: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._last_delivery),
+                "blocked": len(self._blocked),
+                "hits": self.hits,
+                "rejected": self.rejected,
+                "reloads": self.reloads,
+                "pruned": self.pruned
+            }
+
+
+# Shared cache for the process
+cooldown_cache = CooldownCache(DELIVERY_COOLDOWN_MINUTES * 60, COOLDOWN_VERSION_FILE, COOLDOWN_CHECK_INTERVAL)
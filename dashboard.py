@@ -9,8 +9,22 @@ import time
 import logging
 import psutil
 from datetime import datetime
-from flask import Blueprint, render_template, jsonify, redirect, url_for
+from sqlalchemy import func
+from flask import Blueprint, Response, render_template, jsonify, redirect, url_for, request
 from models import db, User, Buff, ShopItem, Stats
+from stats_buffer import stats_buffer
+from leaderboard import load_top_users
+from admin_queries import list_users_with_buffs
+from stats_snapshot import StatsSnapshot
+from event_bus import event_bus, TooManySubscribers
+from database import pool_metrics
+from config import (
+    STATS_SNAPSHOT_INTERVAL,
+    STATS_SNAPSHOT_IDLE_TIMEOUT,
+    SYSTEM_SNAPSHOT_INTERVAL,
+    SSE_HEARTBEAT_INTERVAL,
+    SSE_STREAM_MAX_SECONDS
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -33,80 +47,174 @@ def users_page():
     """Render the users page."""
     return render_template('users.html')
 
+def collect_stats():
+    """Build the stats payload served by /api/stats (see stats_snapshot)."""
+    # Get flushed stats plus the increments still buffered in memory
+    stats_row = Stats.query.first()
+    pending = stats_buffer.pending()
+    total_users = (stats_row.total_users if stats_row else 0) + pending["new_users"]
+    total_deliveries = (stats_row.total_deliveries if stats_row else 0) + pending["deliveries"]
+    total_money = (stats_row.total_money if stats_row else 0) + pending["earnings"]
+    # Count in the database (ix_buffs_expires_at): the bot process owns the
+    # buff registry, this process' copy would never see its purchases
+    active_buffs = db.session.query(func.count(Buff.id)).filter(Buff.expires_at > time.time()).scalar()
+    
+    # Format results
+    stats = {
+        "bot": {
+            "total_users": total_users,
+            "total_deliveries": total_deliveries,
+            "total_earnings": total_money,
+            "active_buffs": active_buffs
+        },
+        "stats_flush": stats_buffer.metrics(),
+        "db_pool": pool_metrics.metrics()
+    }
+    
+    return stats
+
+def collect_system_stats():
+    """Build the system payload served by /api/system."""
+    # Get system stats
+    cpu_percent = psutil.cpu_percent()
+    memory = psutil.virtual_memory()
+    memory_percent = memory.percent
+    
+    # Get disk usage
+    disk = psutil.disk_usage('/')
+    disk_percent = disk.percent
+    
+    # Get uptime (in seconds)
+    try:
+        uptime = int(time.time() - psutil.boot_time())
+    except Exception:
+        uptime = 0
+    
+    # Format uptime
+    days, remainder = divmod(uptime, 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    uptime_str = f"{days}d {hours}h {minutes}m {seconds}s"
+    
+    return {
+        "cpu": cpu_percent,
+        "memory": memory_percent,
+        "disk": disk_percent,
+        "uptime": uptime_str
+    }
+
+# Stats are computed once per interval however many dashboards poll them.
+# The ETag only covers the bot counters: the pool and flush diagnostics
+# change on every refresh and would turn every poll into a 200.
+stats_snapshot = StatsSnapshot(collect_stats, STATS_SNAPSHOT_INTERVAL, STATS_SNAPSHOT_IDLE_TIMEOUT,
+                               etag_of=lambda payload: payload["bot"])
+dashboard_bp.record_once(lambda state: stats_snapshot.init_app(state.app))
+
+# The system load is sampled the same way, on its own (longer) interval, so
+# that psutil runs once per interval instead of once per poll
+system_snapshot = StatsSnapshot(collect_system_stats, SYSTEM_SNAPSHOT_INTERVAL, STATS_SNAPSHOT_IDLE_TIMEOUT,
+                                name="system-snapshot")
+dashboard_bp.record_once(lambda state: system_snapshot.init_app(state.app))
+
 @dashboard_bp.route('/api/stats')
 def api_stats():
-    """API endpoint for getting real-time stats."""
+    """API endpoint for getting real-time stats (answers 304 to If-None-Match)."""
     try:
-        # Get database stats
-        total_users = User.query.count()
-        total_deliveries = db.session.query(db.func.sum(User.deliveries)).scalar() or 0
-        total_money = db.session.query(db.func.sum(User.money)).scalar() or 0
-        active_buffs = Buff.query.filter(Buff.expires_at > time.time()).count()
-        
-        # Get system stats
-        cpu_percent = psutil.cpu_percent()
-        memory = psutil.virtual_memory()
-        memory_percent = memory.percent
-        
-        # Get disk usage
-        disk = psutil.disk_usage('/')
-        disk_percent = disk.percent
-        
-        # Get uptime (in seconds)
-        try:
-            uptime = int(time.time() - psutil.boot_time())
-        except Exception:
-            uptime = 0
-        
-        # Format uptime
-        days, remainder = divmod(uptime, 86400)
-        hours, remainder = divmod(remainder, 3600)
-        minutes, seconds = divmod(remainder, 60)
-        uptime_str = f"{days}d {hours}h {minutes}m {seconds}s"
-        
-        # Format results
-        stats = {
-            "system": {
-                "cpu": cpu_percent,
-                "memory": memory_percent,
-                "disk": disk_percent,
-                "uptime": uptime_str
-            },
-            "bot": {
-                "total_users": total_users,
-                "total_deliveries": total_deliveries,
-                "total_earnings": total_money,
-                "active_buffs": active_buffs
-            }
-        }
-        
-        return jsonify(stats)
+        body, etag = stats_snapshot.get()
     except Exception as e:
         logger.error(f"Error fetching stats: {e}")
         return jsonify({"error": str(e)}), 500
+    
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Browsers revalidate on every poll and reuse the cached body on 304
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@dashboard_bp.route('/api/system')
+def api_system():
+    """API endpoint for getting the system load (sampled once per SYSTEM_SNAPSHOT_INTERVAL)."""
+    try:
+        body, etag = system_snapshot.get()
+    except Exception as e:
+        logger.error(f"Error fetching system stats: {e}")
+        return jsonify({"error": str(e)}), 500
+
+    response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@dashboard_bp.route('/stream')
+def stream():
+    """
+    Server-Sent Events feed of live events (see event_bus).
+
+    Browsers reconnect with Last-Event-ID and get the events they missed
+    replayed; if those already left the buffer, or the id comes from before
+    a restart or from another worker, a "reset" event tells the client to
+    reload its data. Each stream is closed after SSE_STREAM_MAX_SECONDS so
+    that worker threads get recycled.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    last_id = event_bus.parse_id(last_event_id) if last_event_id else None
+    
+    try:
+        subscription = event_bus.subscribe()
+    except TooManySubscribers:
+        return Response("too many subscribers", status=503, headers={"Retry-After": "30"})
+    
+    def generate():
+        with subscription:
+            # New clients start at the current event, reconnecting ones where they left off
+            position = event_bus.last_id if last_id is None else last_id
+            yield f"retry: 3000\nid: {event_bus.format_id(position)}\nevent: hello\ndata: {{}}\n\n"
+            if last_event_id and last_id is None:
+                # The client's position belongs to another bus, what it missed is unknown
+                yield f"event: reset\ndata: {{}}\n\n"
+            
+            deadline = time.monotonic() + SSE_STREAM_MAX_SECONDS
+            while time.monotonic() < deadline:
+                events, complete = event_bus.wait(position, SSE_HEARTBEAT_INTERVAL)
+                if not complete:
+                    position = event_bus.last_id
+                    yield f"id: {event_bus.format_id(position)}\nevent: reset\ndata: {{}}\n\n"
+                    continue
+                if not events:
+                    # Heartbeat keeps proxies from closing an idle connection
+                    yield ": ping\n\n"
+                    continue
+                yield ''.join(event.to_sse() for event in events)
+                position = events[-1].id
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+    # Frees the slot even if the client leaves before the stream starts
+    response.call_on_close(subscription.close)
+    return response
 
 @dashboard_bp.route('/api/users')
 def api_users():
-    """API endpoint for getting user data."""
+    """
+    API endpoint for getting user data.
+
+    Users come with their active buff counts from a single query. The page
+    is sorted by ?sort= (see admin_queries.USER_SORT_KEYS) and the next one
+    is requested with ?after=<next_cursor>.
+    """
     try:
-        # Get all users
-        users = User.query.order_by(User.deliveries.desc()).limit(100).all()
+        sort = request.args.get('sort', 'deliveries')
+        limit = request.args.get('limit', 100, type=int)
+        after = request.args.get('after')
         
-        # Format results
-        user_list = []
-        for user in users:
-            # Count active buffs for user
-            active_buffs_count = Buff.query.filter(
-                Buff.user_id == user.id,
-                Buff.expires_at > time.time()
-            ).count()
-            
-            # Add user data to list
-            user_data = user.to_dict()
-            user_data["active_buffs_count"] = active_buffs_count
-            user_list.append(user_data)
+        try:
+            user_list, next_cursor = list_users_with_buffs(db.session, sort=sort, limit=limit, after=after)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        return jsonify({"users": user_list})
+        return jsonify({"users": user_list, "next_cursor": next_cursor})
     except Exception as e:
         logger.error(f"Error fetching users: {e}")
         return jsonify({"error": str(e)}), 500
@@ -116,7 +224,7 @@ def api_top_users():
     """API endpoint for getting top users."""
     try:
         # Get top 10 users
-        top_users = User.query.order_by(User.deliveries.desc()).limit(10).all()
+        top_users = load_top_users(10)
         
         # Format results
         result = [
@@ -0,0 +1,160 @@
+"""
+Database Module
+
+This module sets up the one engine and connection pool of the process,
+shared by the bot and the web app (both use the Flask app from app.py),
+and the unit of work the bot code runs in.
+
+unit_of_work() enters an app context unless one is already active, so
+nested calls (update_user_data -> get_active_earnings_multiplier -> ...)
+reuse the same context-local session and connection instead of opening
+one each. The dispatcher wraps every bot update in a unit of work, so a
+worker holds at most one connection and the pool is sized from the
+number of update workers.
+
+The unit of work is a session boundary, not a single transaction: the
+user_data functions (deliver, purchase_buff, update_user_data, ...)
+commit their own changes, so that the in-process caches, the leaderboard
+and the published events only ever reflect committed rows. An update can
+therefore commit more than once. The unit of work commits whatever a
+handler left pending when it returns and rolls back the uncommitted part
+if it raises.
+
+The pool reports checkout wait times and how often it was exhausted.
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from flask import has_app_context
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+from models import db
+from dispatcher import Histogram, WAIT_BUCKETS_MS
+import config
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# App whose context the units of work run in
+_app = None
+
+
+class PoolMetrics:
+    """Checkout wait time and exhaustion counters of the connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pool: Optional[QueuePool] = None
+        self.checkouts = 0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.max_wait_ms = 0.0
+        self._wait_ms = Histogram(WAIT_BUCKETS_MS)
+
+    def observe(self, wait_ms: float, exhausted: bool, timed_out: bool = False) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.exhausted += exhausted
+            self.timeouts += timed_out
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            self._wait_ms.observe(wait_ms)
+
+    def metrics(self) -> Dict[str, Any]:
+        pool = self.pool
+        with self._lock:
+            return {
+                "size": pool.size() if pool else None,
+                "max_overflow": pool.max_overflow if pool else None,
+                "checked_out": pool.checkedout() if pool else None,
+                "overflow": pool.overflow() if pool else None,
+                "checkouts": self.checkouts,
+                "exhausted": self.exhausted,
+                "timeouts": self.timeouts,
+                "max_wait_ms": round(self.max_wait_ms, 3),
+                "wait_ms": self._wait_ms.snapshot()
+            }
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def __init__(self, creator, pool_size: int = 5, max_overflow: int = 10, **kw):
+        super().__init__(creator, pool_size=pool_size, max_overflow=max_overflow, **kw)
+        self.max_overflow = max_overflow
+        pool_metrics.pool = self
+
+    def _do_get(self):
+        # Every connection is checked out, the caller has to wait for one
+        exhausted = self.max_overflow > -1 and self.checkedout() >= self.size() + self.max_overflow
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            pool_metrics.observe((time.perf_counter() - started) * 1000, exhausted, timed_out)
+
+
+def database_url() -> str:
+    """URL of the database (DATABASE_URL from the environment overrides config)."""
+    return os.environ.get("DATABASE_URL") or config.DATABASE_URL
+
+
+def engine_options(url: str) -> Dict[str, Any]:
+    """Engine options with the pool sized for the update workers."""
+    options = dict(config.SQLALCHEMY_ENGINE_OPTIONS)
+    # In-memory SQLite keeps its single shared connection
+    if not (url.startswith("sqlite") and (":memory:" in url or url.rstrip("/") == "sqlite:")):
+        options.update(
+            poolclass=MeteredQueuePool,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_timeout=config.DB_POOL_TIMEOUT
+        )
+    return options
+
+
+def init_app(app) -> None:
+    """Configure the database of the app and use it for units of work."""
+    global _app
+    url = database_url()
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = config.SQLALCHEMY_TRACK_MODIFICATIONS
+    db.init_app(app)
+    _app = app
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Run a block on the context-local session.
+
+    The outermost unit enters the app context, commits the transaction the
+    block left open when it returns (including Core statements and flushed
+    changes, which the session no longer lists as pending), rolls back if it
+    raises, and releases the session when it exits. Nested units just reuse
+    the session.
+    """
+    if has_app_context() or _app is None:
+        yield db.session
+        return
+
+    with _app.app_context():
+        try:
+            yield db.session
+            session = db.session()
+            if session.in_transaction() or session.new or session.dirty or session.deleted:
+                session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+# Shared metrics of the pool
+pool_metrics = PoolMetrics()
@@ -7,6 +7,9 @@ import os
 import logging
 import random
 from PIL import Image, ImageDraw, ImageFont
+from image_cache import ImageCache, file_digest, as_upload
+from config import IMAGE_CACHE_MAX_BYTES
+from tracing import tracer
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -15,6 +18,25 @@ logger = logging.getLogger(__name__)
 DEFAULT_IMAGE_PATH = "assets/delivery_default.svg"
 DELIVERY_IMAGE_PATH = "delivery_custom.jpg"
 
+# Image file contents kept in memory, keyed by content hash
+_image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES)
+
+@tracer.traced("image get_delivery_photo")
+def get_delivery_photo():
+    """
+    Returns the delivery image as an in-memory file for send_photo.
+    
+    The file is read from disk once per content version.
+    """
+    image_path = create_delivery_image()
+    
+    def read():
+        with open(image_path, 'rb') as f:
+            return f.read()
+    
+    data = _image_cache.get_or_render(file_digest(image_path), read)
+    return as_upload(data, os.path.basename(image_path))
+
 def create_delivery_image():
     """
     Returns path to a delivery image.
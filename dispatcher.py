@@ -0,0 +1,325 @@
+"""
+Update Dispatcher Module
+
+This module runs bot updates on a fixed pool of worker threads while
+keeping the updates of each user strictly ordered. Every user gets a lane
+(a FIFO of their pending updates); a lane is scheduled on at most one
+worker at a time, so two quick /raznos from the same user can never run
+concurrently, while updates from different users run in parallel. Lanes
+exist only while they have pending updates.
+
+The dispatcher is used both by the webhook endpoint and by the polling
+loop below, and reports lane depth and wait time histograms.
+"""
+import time
+import queue
+import atexit
+import bisect
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+from telebot import types
+from config import UPDATE_WORKERS, UPDATE_QUEUE_SIZE, UPDATE_DRAIN_TIMEOUT
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+DEPTH_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+_STOP = object()
+
+
+def update_user_id(update: types.Update) -> int:
+    """Get the user an update comes from (falls back to the chat, then the update id)."""
+    for field in (
+        "message", "edited_message", "callback_query", "inline_query",
+        "chosen_inline_result", "shipping_query", "pre_checkout_query"
+    ):
+        event = getattr(update, field, None)
+        if event is not None and getattr(event, "from_user", None) is not None:
+            return event.from_user.id
+
+    for field in ("channel_post", "edited_channel_post"):
+        event = getattr(update, field, None)
+        if event is not None:
+            return event.chat.id
+
+    return update.update_id
+
+
+class Histogram:
+    """Fixed-bucket histogram (not thread-safe, guard it with a lock)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get cumulative bucket counts keyed by upper bound ("+Inf" for the last one)."""
+        cumulative, buckets = 0, {}
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": round(self.sum, 3)}
+
+
+class UpdateDispatcher:
+    """Per-user serial lanes executed by a fixed worker pool."""
+
+    def __init__(self, process: Callable[[Any], None], workers: int = 8, max_pending: int = 1000,
+                 key: Callable[[Any], Any] = update_user_id, name: str = "dispatcher"):
+        """
+        Args:
+            process: Function called with each update
+            workers: Number of worker threads
+            max_pending: Maximum number of queued updates over all lanes
+            key: Function mapping an update to its lane
+        """
+        self.process = process
+        self.key = key
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._lanes: Dict[Any, deque] = {}
+        self._ready = queue.Queue()  # lane keys waiting for a worker
+        self._threads: List[threading.Thread] = []
+        self._pending = 0
+        self._accepting = False
+        self._stopped = False
+
+        # Metrics
+        self.accepted = 0
+        self.rejected = 0
+        self.processed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self.max_lane_depth = 0
+        self._lane_depth = Histogram(DEPTH_BUCKETS)
+        self._wait_ms = Histogram(WAIT_BUCKETS_MS)
+        self._process_ms = Histogram(WAIT_BUCKETS_MS)
+
+    @property
+    def accepting(self) -> bool:
+        return self._accepting
+
+    def start(self) -> None:
+        """Start the worker threads."""
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"{self.name}-{index}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._accepting = True
+
+    def submit(self, update, block: bool = False, timeout: Optional[float] = None) -> bool:
+        """
+        Queue an update on its user's lane.
+
+        Args:
+            block: Wait for room instead of rejecting when the dispatcher is full
+
+        Returns:
+            False if the update was rejected (full or draining)
+        """
+        key = self.key(update)
+        with self._lock:
+            if block:
+                self._not_full.wait_for(
+                    lambda: self._pending < self.max_pending or not self._accepting, timeout
+                )
+            if not self._accepting or self._pending >= self.max_pending:
+                # A blocking caller only timed out waiting, nothing was dropped
+                if not block:
+                    self.rejected += 1
+                return False
+
+            lane = self._lanes.get(key)
+            scheduled = lane is not None
+            if lane is None:
+                lane = self._lanes[key] = deque()
+            lane.append((time.monotonic(), update))
+
+            self._pending += 1
+            self.accepted += 1
+            self.max_depth = max(self.max_depth, self._pending)
+            self.max_lane_depth = max(self.max_lane_depth, len(lane))
+            self._lane_depth.observe(len(lane))
+
+        # A lane is on the ready queue or running as long as it exists
+        if not scheduled:
+            self._ready.put(key)
+        return True
+
+    def depth(self) -> int:
+        """Number of queued updates."""
+        with self._lock:
+            return self._pending
+
+    def _work(self) -> None:
+        while True:
+            key = self._ready.get()
+            if key is _STOP:
+                return
+
+            with self._lock:
+                queued_at, update = self._lanes[key].popleft()
+                self._pending -= 1
+                self.in_flight += 1
+                self._not_full.notify()
+
+            started = time.monotonic()
+            try:
+                self.process(update)
+                failed = False
+            except Exception as e:
+                logger.error(f"Error processing update {getattr(update, 'update_id', '?')}: {e}")
+                failed = True
+            finished = time.monotonic()
+
+            with self._lock:
+                self.in_flight -= 1
+                self.processed += 1
+                self.failed += failed
+                self._wait_ms.observe((started - queued_at) * 1000)
+                self._process_ms.observe((finished - started) * 1000)
+
+                # Keep the lane scheduled while it has updates, behind the other lanes
+                if self._lanes[key]:
+                    reschedule = True
+                else:
+                    del self._lanes[key]
+                    reschedule = False
+
+            if reschedule:
+                self._ready.put(key)
+
+    def drain(self, timeout: float = 30) -> bool:
+        """
+        Stop accepting updates and wait for the queued ones to be processed.
+
+        Returns:
+            True if everything was processed within the timeout
+        """
+        with self._lock:
+            if self._stopped:
+                return True
+            self._stopped = True
+            self._accepting = False
+            self._not_full.notify_all()
+
+        deadline = time.monotonic() + timeout
+        while (self.depth() or self.in_flight) and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        remaining = self.depth() + self.in_flight
+        if remaining:
+            logger.warning(f"{self.name}: drain timed out with {remaining} updates unprocessed")
+
+        for _ in self._threads:
+            self._ready.put(_STOP)
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        logger.info(f"{self.name}: stopped after processing {self.processed} updates")
+        return remaining == 0
+
+    def metrics(self) -> Dict[str, Any]:
+        """Backpressure counters and lane depth / wait time histograms."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "accepting": self._accepting,
+                "depth": self._pending,
+                "capacity": self.max_pending,
+                "max_depth": self.max_depth,
+                "lanes": len(self._lanes),
+                "max_lane_depth": self.max_lane_depth,
+                "in_flight": self.in_flight,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "processed": self.processed,
+                "failed": self.failed,
+                "lane_depth": self._lane_depth.snapshot(),
+                "wait_ms": self._wait_ms.snapshot(),
+                "process_ms": self._process_ms.snapshot()
+            }
+
+
+def create_dispatcher(bot, workers: int, max_pending: int, name: str = "dispatcher") -> UpdateDispatcher:
+    """
+    Create and start a dispatcher handling updates of the bot.
+
+    The bot should be created with threaded=False, so that each update is
+    handled on the worker its lane is scheduled on. Each update runs in its
+    own unit of work (one session, committed when the handler returns) and
+    in its own trace (see tracing.py).
+    """
+    from database import unit_of_work
+    from tracing import tracer
+
+    def process(update):
+        with tracer.span("update", update_id=update.update_id, user_id=update_user_id(update)), unit_of_work():
+            bot.process_new_updates([update])
+
+    dispatcher = UpdateDispatcher(
+        process,
+        workers=workers,
+        max_pending=max_pending,
+        name=name
+    )
+    dispatcher.start()
+    return dispatcher
+
+
+def run_polling(bot, dispatcher: UpdateDispatcher, long_polling_timeout: int = 20,
+                stop_event: Optional[threading.Event] = None) -> None:
+    """
+    Fetch updates with getUpdates and hand them to the dispatcher.
+
+    Replaces bot.infinity_polling: when the dispatcher is full the loop
+    waits instead of dropping updates, and Telegram keeps the rest.
+    """
+    offset = None
+    while not (stop_event and stop_event.is_set()):
+        try:
+            updates = bot.get_updates(
+                offset=offset,
+                timeout=long_polling_timeout + 5,
+                long_polling_timeout=long_polling_timeout
+            )
+        except Exception as e:
+            logger.error(f"Error getting updates: {e}")
+            time.sleep(3)
+            continue
+
+        for update in updates:
+            while not dispatcher.submit(update, block=True, timeout=1):
+                if not dispatcher.accepting:
+                    return
+            offset = update.update_id + 1
+
+
+def poll_updates(bot, long_polling_timeout: int = 20) -> None:
+    """Run the bot with long polling on per-user lanes (blocks)."""
+    dispatcher = create_dispatcher(bot, UPDATE_WORKERS, UPDATE_QUEUE_SIZE, name="polling")
+
+    # Finish queued updates on shutdown
+    atexit.register(dispatcher.drain, UPDATE_DRAIN_TIMEOUT)
+
+    logger.info(f"Polling for updates with {dispatcher.workers} workers")
+    run_polling(bot, dispatcher, long_polling_timeout)
@@ -0,0 +1,187 @@
+"""
+Event Bus Module
+
+This module is an in-process publish/subscribe bus for live dashboard
+updates (deliveries, purchases, new users, leaderboard changes). Events
+are appended to a ring buffer with increasing ids; subscribers don't get
+queues of their own, they wait on the bus and read the events after the
+last id they have seen. Publishing therefore costs the same however many
+viewers are connected, and a viewer that reconnects with Last-Event-ID
+gets the events it missed replayed from the ring buffer.
+
+Ids restart at 1 with every process, so the SSE ids carry the bus epoch
+("<epoch>-<id>"): an id issued before a restart or by another worker
+can't be mistaken for a position in this bus.
+
+Only events published in the same process are seen, i.e. the dashboard
+shows live events when the bot runs inside the web app (main.py).
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List, Optional, Tuple
+from config import EVENT_BUFFER_SIZE, SSE_MAX_SUBSCRIBERS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class TooManySubscribers(Exception):
+    """Raised when the subscriber cap is reached."""
+
+
+class Event:
+    """A published event with its pre-serialized data."""
+
+    __slots__ = ("id", "epoch", "type", "data", "created_at")
+
+    def __init__(self, event_id: int, epoch: str, event_type: str, data: str):
+        self.id = event_id
+        self.epoch = epoch
+        self.type = event_type
+        self.data = data
+        self.created_at = time.time()
+
+    def to_sse(self) -> str:
+        """Format the event as a Server-Sent Events message."""
+        return f"id: {self.epoch}-{self.id}\nevent: {self.type}\ndata: {self.data}\n\n"
+
+
+class EventBus:
+    """Ring buffer of events that subscribers wait on."""
+
+    def __init__(self, buffer_size: int = 1000, max_subscribers: int = 50):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._published = threading.Condition(self._lock)
+        self._events = deque(maxlen=buffer_size)
+        self._last_id = 0
+        self._subscribers = 0
+        # Tells this bus' ids from those of a previous process or another worker
+        self.epoch = f"{os.getpid():x}{time.time_ns() // 1000:x}"
+
+        # Metrics
+        self.published = 0
+        self.rejected_subscribers = 0
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    def format_id(self, event_id: int) -> str:
+        """SSE id of a position in this bus."""
+        return f"{self.epoch}-{event_id}"
+
+    def parse_id(self, value: str) -> Optional[int]:
+        """Position of an SSE id, None if this bus didn't issue it (restart, other worker)."""
+        epoch, _, number = value.strip().rpartition('-')
+        if epoch != self.epoch or not number.isdigit() or int(number) > self._last_id:
+            return None
+        return int(number)
+
+    def publish(self, event_type: str, data: Dict[str, Any]) -> int:
+        """
+        Publish an event to all subscribers.
+
+        Returns:
+            Id of the event
+        """
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        with self._lock:
+            self._last_id += 1
+            self._events.append(Event(self._last_id, self.epoch, event_type, payload))
+            self.published += 1
+            self._published.notify_all()
+            return self._last_id
+
+    def subscribe(self) -> "Subscription":
+        """
+        Register a subscriber (use as a context manager).
+
+        Raises:
+            TooManySubscribers: The subscriber cap is reached
+        """
+        with self._lock:
+            if self._subscribers >= self.max_subscribers:
+                self.rejected_subscribers += 1
+                raise TooManySubscribers(f"{self._subscribers} subscribers connected")
+            self._subscribers += 1
+        return Subscription(self)
+
+    def _unsubscribe(self) -> None:
+        with self._lock:
+            self._subscribers -= 1
+
+    def events_after(self, last_id: int) -> Tuple[List[Event], bool]:
+        """
+        Get the buffered events with ids greater than last_id.
+
+        Returns:
+            Tuple of (events, complete) - complete is False when some of the
+            events after last_id already fell out of the ring buffer, or when
+            last_id is ahead of the bus (it wasn't issued by this bus)
+        """
+        with self._lock:
+            return self._events_after(last_id)
+
+    def _events_after(self, last_id: int) -> Tuple[List[Event], bool]:
+        if last_id > self._last_id:
+            return [], False
+        if last_id == self._last_id:
+            return [], True
+        oldest = self._events[0].id if self._events else self._last_id + 1
+        # Ids are consecutive, so the position in the buffer is known
+        start = max(0, last_id + 1 - oldest)
+        events = [self._events[i] for i in range(start, len(self._events))]
+        return events, last_id + 1 >= oldest
+
+    def wait(self, last_id: int, timeout: float) -> Tuple[List[Event], bool]:
+        """Wait up to timeout for events after last_id, then return them as events_after does."""
+        with self._lock:
+            self._published.wait_for(lambda: self._last_id != last_id, timeout)
+            return self._events_after(last_id)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "last_id": self._last_id,
+                "buffered": len(self._events),
+                "subscribers": self._subscribers,
+                "max_subscribers": self.max_subscribers,
+                "published": self.published,
+                "rejected_subscribers": self.rejected_subscribers
+            }
+
+
+class Subscription:
+    """Slot of a connected subscriber, released on exit."""
+
+    def __init__(self, bus: EventBus):
+        self.bus = bus
+        self._closed = False
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            self.bus._unsubscribe()
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def publish(event_type: str, data: Dict[str, Any]) -> None:
+    """Publish to the shared bus, never letting a failure reach the caller."""
+    try:
+        event_bus.publish(event_type, data)
+    except Exception as e:
+        logger.error(f"Error publishing {event_type} event: {e}")
+
+
+# Shared bus for the process
+event_bus = EventBus(EVENT_BUFFER_SIZE, SSE_MAX_SUBSCRIBERS)
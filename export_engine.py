@@ -0,0 +1,169 @@
+"""
+Export Engine Module
+
+This module streams table exports for the admin panel without loading the
+table into memory. Rows are read in keyset pages (WHERE id > last id
+ORDER BY id), each page through a streaming cursor, and are encoded as a
+JSON array, NDJSON or CSV as they arrive. The output can be gzipped on the
+fly. An interrupted download is resumed by requesting the export again
+with after_id set to the last id received.
+
+JSON array and NDJSON exports can be imported back with import_data.py.
+"""
+import io
+import csv
+import json
+import zlib
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+from sqlalchemy import select
+from models import User, Buff, AdminLoginAttempt
+from config import EXPORT_PAGE_SIZE, EXPORT_CHUNK_ROWS
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Exportable tables by export type
+EXPORT_TABLES = {
+    'users': User.__table__,
+    'buffs': Buff.__table__,
+    'login_attempts': AdminLoginAttempt.__table__,
+}
+
+# Content types of the export formats
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_rows(engine, table, after_id: int = 0, limit: Optional[int] = None,
+              page_size: int = EXPORT_PAGE_SIZE) -> Iterator[Dict[str, Any]]:
+    """
+    Iterate over table rows ordered by id, starting after after_id.
+
+    Each page is a short query of its own, so the connection goes back to
+    the pool between pages instead of being held for the whole download.
+    """
+    columns = list(table.columns)
+    remaining = limit
+
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        query = (
+            select(*columns)
+            .where(table.c.id > after_id)
+            .order_by(table.c.id)
+            .limit(size)
+        )
+
+        fetched = 0
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=size).execute(query)
+            for row in result.mappings():
+                fetched += 1
+                after_id = row['id']
+                yield dict(row)
+
+        if remaining is not None:
+            remaining -= fetched
+        if fetched < size:
+            return
+
+
+def _json_default(value):
+    return str(value)
+
+
+def _encode_json(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    yield '['
+    first = True
+    for chunk in _chunks(rows):
+        text = ',\n'.join(json.dumps(row, ensure_ascii=False, default=_json_default) for row in chunk)
+        yield text if first else ',\n' + text
+        first = False
+    yield ']\n'
+
+
+def _encode_ndjson(rows: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    for chunk in _chunks(rows):
+        yield ''.join(json.dumps(row, ensure_ascii=False, default=_json_default) + '\n' for row in chunk)
+
+
+def _encode_csv(rows: Iterator[Dict[str, Any]], columns: List[str], header: bool) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+
+    for chunk in _chunks(rows):
+        for row in chunk:
+            writer.writerow([row[col] for col in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _chunks(rows: Iterator[Dict[str, Any]], size: int = EXPORT_CHUNK_ROWS) -> Iterator[List[Dict[str, Any]]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _gzip(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 - gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(engine, export_type: str, fmt: str = 'json', after_id: int = 0,
+                  limit: Optional[int] = None, compress: bool = False) -> Iterator[bytes]:
+    """
+    Stream an export as encoded bytes.
+
+    Args:
+        export_type: Key of EXPORT_TABLES
+        fmt: 'json' (array), 'ndjson' or 'csv'
+        after_id: Only rows with a greater id (resuming a download)
+        limit: Maximum number of rows
+        compress: Gzip the output
+
+    Raises:
+        ValueError: Unknown export type or format
+    """
+    if export_type not in EXPORT_TABLES:
+        raise ValueError(f"Unknown export type: {export_type}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    table = EXPORT_TABLES[export_type]
+    rows = iter_rows(engine, table, after_id=after_id, limit=limit)
+
+    if fmt == 'ndjson':
+        text = _encode_ndjson(rows)
+    elif fmt == 'csv':
+        # A resumed CSV download continues the same file, without a second header
+        text = _encode_csv(rows, [col.name for col in table.columns], header=not after_id)
+    else:
+        text = _encode_json(rows)
+
+    chunks = (chunk.encode('utf-8') for chunk in text)
+    return _gzip(chunks) if compress else chunks
+
+
+def export_filename(export_type: str, fmt: str, after_id: int = 0, compress: bool = False) -> str:
+    """File name offered for the download."""
+    name = export_type if not after_id else f"{export_type}_after_{after_id}"
+    return f"{name}.{fmt}" + (".gz" if compress else "")
@@ -8,21 +8,17 @@ import logging
 import os
 from telebot import types
 from datetime import datetime, timedelta
-from user_data import (
-    get_user_data, update_user_data, can_deliver, get_top_users,
-    get_shop_item, purchase_buff, get_active_buffs_info, get_all_shop_items,
-    get_shop_items_count
-)
-from delivery_image import create_delivery_image
+from storage import get_storage
+from delivery_image import get_delivery_photo
+from media_registry import send_photo, edit_message_photo
+from tracing import tracer
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Store the bot instance for use in command handlers
+# Store the bot instance and the storage backend for use in command handlers
 _bot = None
-
-# Keep track of users' current shop position
-shop_positions = {}
+_storage = None
 
 def register_handlers(bot):
     """
@@ -31,13 +27,15 @@ def register_handlers(bot):
     Args:
         bot: The TeleBot instance
     """
-    global _bot
+    global _bot, _storage
     _bot = bot
+    _storage = get_storage()
     
     # Register message handlers
     bot.message_handler(commands=['start'])(start_command)
     bot.message_handler(commands=['raznos'])(raznos_command)
     bot.message_handler(commands=['top'])(top_command)
+    bot.message_handler(commands=['rank'])(rank_command)
     bot.message_handler(commands=['profile'])(profile_command)
     bot.message_handler(commands=['magaz'])(shop_command)
     
@@ -50,7 +48,7 @@ def register_handlers(bot):
         # Send message asking for a new name
         msg = bot.send_message(
             call.message.chat.id,
-            "✏️ Введите новое имя для вашего профиля:",
+            NAME_PROMPT,
             reply_markup=types.ForceReply(selective=True)
         )
         # Register the next step handler
@@ -66,27 +64,28 @@ def register_handlers(bot):
         # Answer the callback query to stop the loading animation
         bot.answer_callback_query(call.id)
         
-        # Get current position or initialize
-        current_pos = shop_positions.get(user_id, 0)
+        action, current_pos = parse_shop_callback(call.data)
         
-        if call.data == "shop_prev":
+        if action == "prev":
             # Move to previous item
-            current_pos = (current_pos - 1) % get_shop_items_count()
-        elif call.data == "shop_next":
+            current_pos = (current_pos - 1) % _storage.get_shop_items_count()
+        elif action == "next":
             # Move to next item
-            current_pos = (current_pos + 1) % get_shop_items_count()
-        elif call.data == "shop_buy":
+            current_pos = (current_pos + 1) % _storage.get_shop_items_count()
+        elif action == "buy":
             # Attempt to buy the item
-            success, message = purchase_buff(user_id, current_pos)
+            success, message = _storage.purchase_buff(user_id, current_pos)
             bot.send_message(chat_id, message)
             
             # Re-display the shop with updated balance
             show_shop_item(chat_id, user_id, current_pos, message_id)
             return
         
-        # Update position and display the item
-        shop_positions[user_id] = current_pos
+        # Display the item
         show_shop_item(chat_id, user_id, current_pos, message_id)
+    
+    # Run every handler and Bot API call in a span (see tracing.py)
+    tracer.instrument_bot(bot)
 
 def process_name_change(message):
     """Process the name change request."""
@@ -95,22 +94,15 @@ def process_name_change(message):
     
     # Validate name
     if not new_name or len(new_name) > 20:
-        _bot.send_message(
-            message.chat.id,
-            "Имя должно быть от 1 до 20 символов. Попробуйте снова с командой /profile."
-        )
+        _bot.send_message(message.chat.id, NAME_INVALID)
         return
     
     # Update user data with new name
-    user_data = get_user_data(user_id)
+    user_data = _storage.get_user_data(user_id)
     user_data["username"] = new_name
     
     # Confirm the change
-    _bot.send_message(
-        message.chat.id,
-        f"✅ Ваше имя изменено на *{new_name}*. Изменения отразятся в вашем профиле.",
-        parse_mode="Markdown"
-    )
+    _bot.send_message(message.chat.id, name_changed_message(new_name), parse_mode="Markdown")
 
 def start_command(message):
     """Handle the /start command."""
@@ -118,19 +110,12 @@ def start_command(message):
     first_name = message.from_user.first_name
     
     # Store username in user data
-    data = get_user_data(user_id)
+    data = _storage.get_user_data(user_id)
     data["username"] = first_name
     
-    welcome_message = (
-        f"👋 Привет *{first_name}* жми *команду /raznos* и разноси первые "
-        f"посылки и получай деньги! 💰✨\n\n"
-        f"📊 Смотри свой *прогресс в /profile*\n"
-        f"🛒 Покупай *усиления в /magaz*"
-    )
-    
     _bot.send_message(
         message.chat.id,
-        welcome_message,
+        welcome_message(first_name),
         parse_mode="Markdown"
     )
 
@@ -138,36 +123,154 @@ def raznos_command(message):
     """Handle the /raznos command."""
     user_id = message.from_user.id
     
-    # Check if user is in cooldown
-    can_do_delivery, time_remaining = can_deliver(user_id)
+    # Generate random delivery data
+    deliveries = random.randint(1, 3)
+    base_earnings = random.randint(35, 200)
+    
+    # Check cooldown, apply buffs and update user data in one transaction
+    result = _storage.deliver(user_id, deliveries, base_earnings)
     
-    if not can_do_delivery and time_remaining:
-        # User is in cooldown, inform them of the remaining time
-        minutes = time_remaining.seconds // 60
-        seconds = time_remaining.seconds % 60
-        
-        cooldown_message = (
-            f"⏳ Ты уже недавно разносил подарки!\n"
-            f"⌚ Следущий заказ через *{minutes}* мин. *{seconds}* сек. 🕒"
-        )
+    if not result["delivered"]:
+        if not result["time_remaining"]:
+            # Blocked users can't make deliveries
+            _bot.send_message(message.chat.id, BLOCKED_MESSAGE)
+            return
         
+        # User is in cooldown, inform them of the remaining time
         _bot.send_message(
             message.chat.id,
-            cooldown_message,
+            cooldown_message(result["time_remaining"]),
             parse_mode="Markdown"
         )
         return
     
-    # Generate random delivery data
-    deliveries = random.randint(1, 3)
-    base_earnings = random.randint(35, 200)
+    # Send the image with caption
+    send_photo(
+        _bot,
+        message.chat.id, 
+        get_delivery_photo(),
+        caption=delivery_message(result, deliveries)
+    )
+
+def top_command(message):
+    """Handle the /top command."""
+    # Get top 5 users
+    top_users = _storage.get_top_users(5)
+    
+    _bot.send_message(
+        message.chat.id,
+        top_message(top_users),
+        parse_mode="Markdown"
+    )
+    
+def rank_command(message):
+    """Handle the /rank command."""
+    user_id = message.from_user.id
+    
+    # Get the user's position on the leaderboard
+    rank = _storage.get_user_rank(user_id)
+    
+    _bot.send_message(
+        message.chat.id,
+        rank_message(rank),
+        parse_mode="Markdown"
+    )
+
+def profile_command(message):
+    """Handle the /profile command."""
+    user_id = message.from_user.id
+    user_data = _storage.get_user_data(user_id)
+    
+    # Get username or default to the one from Telegram
+    username = user_data.get("username", message.from_user.first_name)
+    
+    # Get active buffs info
+    active_buffs = _storage.get_active_buffs_info(user_id)
+    
+    _bot.send_message(
+        message.chat.id,
+        profile_message(username, user_data, active_buffs),
+        parse_mode="Markdown",
+        reply_markup=profile_keyboard()
+    )
+
+def shop_command(message):
+    """Handle the /magaz command to open the shop."""
+    user_id = message.from_user.id
+    
+    # Display the first shop item
+    show_shop_item(message.chat.id, user_id, 0)
+
+def show_shop_item(chat_id, user_id, item_index, message_id=None):
+    """Display a shop item with navigation buttons."""
+    # Get item details
+    items_count = _storage.get_shop_items_count()
+    if items_count:
+        item_index %= items_count
+    item = _storage.get_shop_item(item_index)
+    user_data = _storage.get_user_data(user_id)
     
-    # Update user data and get buffed earnings
-    original_earnings, buffed_earnings = update_user_data(user_id, deliveries, base_earnings)
-    user_data = get_user_data(user_id)
+    keyboard = shop_keyboard(item_index)
+    caption = shop_caption(item, item_index, items_count, user_data.get('money', 0))
     
-    # Get delivery image
-    image_path = create_delivery_image()
+    # Get the image
+    photo = get_delivery_photo()
+    
+    # Check if we need to edit existing message or send new one
+    try:
+        if message_id:
+            edit_message_photo(
+                _bot,
+                chat_id,
+                message_id,
+                photo,
+                caption=caption,
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+        else:
+            send_photo(
+                _bot,
+                chat_id,
+                photo,
+                caption=caption,
+                parse_mode="Markdown",
+                reply_markup=keyboard
+            )
+    except Exception as e:
+        logger.error(f"Error showing shop item: {e}")
+
+# Messages and keyboards, shared with the asyncio runtime (async_bot.py)
+
+NAME_PROMPT = "✏️ Введите новое имя для вашего профиля:"
+NAME_INVALID = "Имя должно быть от 1 до 20 символов. Попробуйте снова с командой /profile."
+BLOCKED_MESSAGE = "⛔ Ты заблокирован и не можешь разносить посылки."
+
+def name_changed_message(new_name):
+    return f"✅ Ваше имя изменено на *{new_name}*. Изменения отразятся в вашем профиле."
+
+def welcome_message(first_name):
+    return (
+        f"👋 Привет *{first_name}* жми *команду /raznos* и разноси первые "
+        f"посылки и получай деньги! 💰✨\n\n"
+        f"📊 Смотри свой *прогресс в /profile*\n"
+        f"🛒 Покупай *усиления в /magaz*"
+    )
+
+def cooldown_message(time_remaining):
+    """Message for a /raznos during the cooldown."""
+    minutes = time_remaining.seconds // 60
+    seconds = time_remaining.seconds % 60
+    
+    return (
+        f"⏳ Ты уже недавно разносил подарки!\n"
+        f"⌚ Следущий заказ через *{minutes}* мин. *{seconds}* сек. 🕒"
+    )
+
+def delivery_message(user_data, deliveries):
+    """Caption of the delivery photo for the result of deliver()."""
+    original_earnings = user_data["original_earnings"]
+    buffed_earnings = user_data["buffed_earnings"]
     
     # Prepare response message with correct Russian grammar
     package_word = "посылку"
@@ -177,7 +280,7 @@ def raznos_command(message):
         package_word = "посылок"
     
     # Check if experience is at a multiple of 100, add bonus
-    old_exp = user_data['experience'] - 1  # Experience before this delivery
+    old_exp = user_data['experience'] - user_data['experience_gained']  # Experience before this delivery
     new_exp = user_data['experience']
     
     bonus_message = ""
@@ -192,27 +295,15 @@ def raznos_command(message):
     if buffed_earnings > original_earnings:
         buff_message = f"💎 Бонус от улучшений: +{buffed_earnings - original_earnings} рублей!\n\n"
     
-    delivery_message = (
+    return (
         f"🚚 Доставка завершена! 📬\n"
         f"👏 Ты разнес {deliveries} {package_word}\n\n"
         f"💸 Ты получил {buffed_earnings} рублей\n\n"
         f"{bonus_message}{buff_message}💪 Опыт разносчика - {user_data['experience']}/500 ✨"
     )
-    
-    # Send the image with caption
-    with open(image_path, 'rb') as photo:
-        _bot.send_photo(
-            message.chat.id, 
-            photo,
-            caption=delivery_message
-        )
 
-def top_command(message):
-    """Handle the /top command."""
-    # Get top 5 users
-    top_users = get_top_users(5)
-    
-    # Build leaderboard message
+def top_message(top_users):
+    """Leaderboard message for get_top_users() results."""
     leaderboard = "🏆 Лучшие разносчики 🎖\n\n"
     
     medals = ["🥇", "🥈", "🥉"]
@@ -229,32 +320,28 @@ def top_command(message):
     if not top_users:
         leaderboard += "🤷‍♂️ Пока нет данных о разносчиках! 🤷‍♀️"
     
-    _bot.send_message(
-        message.chat.id,
-        leaderboard,
-        parse_mode="Markdown"
+    return leaderboard
+
+def rank_message(rank):
+    """Message for the result of get_user_rank()."""
+    if not rank:
+        return "🤷‍♂️ Ты ещё не разносил посылки! Жми /raznos 🚚"
+    
+    return (
+        f"🏅 Твоё место в рейтинге: *{rank['rank']}* из *{rank['total']}*\n"
+        f"📦 Доставок: *{rank['deliveries']}*\n\n"
+        f"🏆 Лучшие разносчики - /top"
     )
-    
-def profile_command(message):
-    """Handle the /profile command."""
-    user_id = message.from_user.id
-    user_data = get_user_data(user_id)
-    
-    # Get username or default to the one from Telegram
-    username = user_data.get("username", message.from_user.first_name)
-    
-    # Get active buffs info
-    active_buffs = get_active_buffs_info(user_id)
-    
-    # Build active buffs message
+
+def profile_message(username, user_data, active_buffs):
+    """Profile message with the buffs from get_active_buffs_info()."""
     buffs_message = ""
     if active_buffs:
         buffs_message = "\n\n🔮 Активные улучшения:\n"
         for buff in active_buffs:
-            buffs_message += f"• {buff['name']} (+{int(buff['multiplier'] * 100)}%) - {buff['remaining_minutes']}м {buff['remaining_seconds']}с\n"
+            buffs_message += f"• {buff['name']} (+{buff['bonus']}%) - {buff['remaining_time']}\n"
     
-    # Build profile message
-    profile_message = (
+    return (
         f"🌟 Профиль курьера *{username}* 🌟\n\n"
         f"📦 Коробок разнесено: *{user_data['deliveries']}* шт.\n"
         f"💡 Опыт разносчика: *{user_data['experience']}* ✨\n"
@@ -263,73 +350,40 @@ def profile_command(message):
         f"🔄 Продолжай доставлять посылки командой /raznos 🚚\n"
         f"🛒 Покупай усиления в магазине /magaz 🏪"
     )
-    
-    # Create inline keyboard for changing name
+
+def profile_keyboard():
+    """Inline keyboard for changing the name."""
     keyboard = types.InlineKeyboardMarkup()
     change_name_button = types.InlineKeyboardButton(text="✏️ Изменить имя", callback_data="change_name")
     keyboard.add(change_name_button)
-    
-    _bot.send_message(
-        message.chat.id,
-        profile_message,
-        parse_mode="Markdown",
-        reply_markup=keyboard
-    )
+    return keyboard
 
-def shop_command(message):
-    """Handle the /magaz command to open the shop."""
-    user_id = message.from_user.id
-    
-    # Start with first item
-    shop_positions[user_id] = 0
+def parse_shop_callback(data):
+    """
+    Split shop callback data into (action, shown position).
     
-    # Display the first shop item
-    show_shop_item(message.chat.id, user_id, 0)
+    The shown position travels in the callback data ("shop_next_2"),
+    buttons from older messages without it start from the first item.
+    """
+    action, _, position = data[len("shop_"):].partition("_")
+    return action, int(position) if position.isdigit() else 0
 
-def show_shop_item(chat_id, user_id, item_index, message_id=None):
-    """Display a shop item with navigation buttons."""
-    # Get item details
-    item = get_shop_item(item_index)
-    user_data = get_user_data(user_id)
-    
-    # Create navigation keyboard
+def shop_keyboard(item_index):
+    """Navigation keyboard, the buttons carry the shown position."""
     keyboard = types.InlineKeyboardMarkup(row_width=3)
-    prev_button = types.InlineKeyboardButton(text="⬅️", callback_data="shop_prev")
-    buy_button = types.InlineKeyboardButton(text="🔥 Купить 🔥", callback_data="shop_buy")
-    next_button = types.InlineKeyboardButton(text="➡️", callback_data="shop_next")
+    prev_button = types.InlineKeyboardButton(text="⬅️", callback_data=f"shop_prev_{item_index}")
+    buy_button = types.InlineKeyboardButton(text="🔥 Купить 🔥", callback_data=f"shop_buy_{item_index}")
+    next_button = types.InlineKeyboardButton(text="➡️", callback_data=f"shop_next_{item_index}")
     keyboard.add(prev_button, buy_button, next_button)
-    
-    # Format the caption
-    caption = (
+    return keyboard
+
+def shop_caption(item, item_index, items_count, money):
+    """Caption of a shop item."""
+    return (
         f"🏪 *{item['name']}* 🏪\n\n"
         f"📝 {item['description']}\n"
-        f"⏱ Срок действия: {item['duration_minutes']} минут\n\n"
+        f"⏱ Срок действия: {item['duration']} минут\n\n"
         f"💰 Цена: *{item['price']}* рублей\n"
-        f"💵 Ваш баланс: *{user_data.get('money', 0)}* рублей\n\n"
-        f"{item_index + 1}/{get_shop_items_count()}"
+        f"💵 Ваш баланс: *{money}* рублей\n\n"
+        f"{item_index + 1}/{items_count}"
     )
-    
-    # Try to open the image
-    image_path = create_delivery_image()
-    
-    # Check if we need to edit existing message or send new one
-    try:
-        if message_id:
-            with open(image_path, 'rb') as photo:
-                _bot.edit_message_media(
-                    media=types.InputMediaPhoto(photo, caption=caption, parse_mode="Markdown"),
-                    chat_id=chat_id,
-                    message_id=message_id,
-                    reply_markup=keyboard
-                )
-        else:
-            with open(image_path, 'rb') as photo:
-                _bot.send_photo(
-                    chat_id,
-                    photo,
-                    caption=caption,
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-    except Exception as e:
-        logger.error(f"Error showing shop item: {e}")
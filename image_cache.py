@@ -0,0 +1,131 @@
+"""
+Image Cache Module
+
+This module keeps encoded images in memory so they are rendered (or read
+from disk) once and then served as bytes. Entries are keyed by a content
+hash and evicted in least-recently-used order once the cache exceeds its
+byte budget. It also provides a sweeper for directories of generated
+images.
+"""
+import io
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def content_hash(*parts) -> str:
+    """Get a SHA-256 hex digest of the given bytes/str parts."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+# (path, mtime, size) -> digest of the file contents
+_file_digests: Dict[Tuple[str, float, int], str] = {}
+
+
+def file_digest(path: str) -> str:
+    """Get the content hash of a file, re-hashing only when it changes."""
+    stat = os.stat(path)
+    key = (path, stat.st_mtime, stat.st_size)
+    digest = _file_digests.get(key)
+    if digest is None:
+        with open(path, "rb") as f:
+            digest = content_hash(f.read())
+        _file_digests[key] = digest
+    return digest
+
+
+class ImageCache:
+    """LRU cache of encoded images with a total size limit in bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> bytes
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = data
+            self._size += len(data)
+
+            # Evict least recently used entries over the budget
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> bytes:
+        """Get cached bytes, rendering and caching them on a miss."""
+        data = self.get(key)
+        if data is None:
+            data = render()
+            self.put(key, data)
+        return data
+
+
+def as_upload(data: bytes, name: str = "image.jpg") -> io.BytesIO:
+    """Wrap image bytes in a named file object for send_photo."""
+    photo = io.BytesIO(data)
+    photo.name = name
+    return photo
+
+
+def sweep_directory(path: str, max_bytes: int, max_age: float) -> int:
+    """
+    Delete files older than max_age seconds, then the oldest files until
+    the directory is under max_bytes.
+
+    Returns:
+        Number of deleted files
+    """
+    if not os.path.isdir(path):
+        return 0
+
+    now = time.time()
+    files = []
+    for entry in os.scandir(path):
+        if entry.is_file():
+            stat = entry.stat()
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for mtime, size, file_path in files:
+        if now - mtime <= max_age and total <= max_bytes:
+            break
+        try:
+            os.remove(file_path)
+            total -= size
+            deleted += 1
+        except OSError as e:
+            logger.error(f"Error deleting {file_path}: {e}")
+
+    return deleted
@@ -1,43 +1,296 @@
+import io
+import os
+import csv
 import json
-from sqlalchemy import create_engine, text
+import time
+import argparse
+from sqlalchemy import create_engine, insert, JSON
+from sqlalchemy.dialects import postgresql, sqlite
 from dotenv import load_dotenv
-import os
+from models import db
 
 # Загрузка переменных окружения
 load_dotenv()
 
-# Подключение к базе данных
-engine = create_engine(os.environ.get("DATABASE_URL"))
+# Ключ upsert - первичный ключ id. Выгрузки сохраняют id, и внешние ключи
+# (buffs.user_id и т.п.) продолжают указывать на те же строки. Поэтому
+# выгрузку загружают в пустую базу или в ту, из которой она сделана:
+# пользователь с тем же telegram_id под другим id вызовет ошибку уникальности
+UPSERT_KEY = 'id'
+
+# Размер пачки строк для одной вставки и одного коммита
+BATCH_SIZE = 5000
+
+# Как часто выводить прогресс (в секундах)
+PROGRESS_INTERVAL = 5
+
+# Символы между объектами в JSON-массиве или NDJSON
+_SEPARATORS = ' \t\r\n,[]'
+
+
+def iter_json_rows(json_file, offset=0, chunk_size=1 << 20):
+    """
+    Читает объекты из JSON-массива или NDJSON файла по одному, не загружая файл целиком.
+
+    Возвращает пары (строка, смещение в байтах после неё) - по смещению
+    можно продолжить чтение с того же места.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(json_file, 'rb') as raw:
+        # Пропускаем BOM, чтобы смещения совпадали с байтами файла
+        if offset == 0 and raw.read(3) == b'\xef\xbb\xbf':
+            offset = 3
+        raw.seek(offset)
+        f = io.TextIOWrapper(raw, encoding='utf-8')
+
+        buf = ''
+        pos = 0
+        position = offset
+        eof = False
+
+        while True:
+            # Пропускаем разделители (все они - однобайтовые символы)
+            start = pos
+            while pos < len(buf) and buf[pos] in _SEPARATORS:
+                pos += 1
+            position += pos - start
+
+            if pos == len(buf):
+                if eof:
+                    return
+                buf = f.read(chunk_size)
+                pos = 0
+                eof = not buf
+                continue
+
+            try:
+                row, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Объект не поместился в буфер целиком - дочитываем
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+
+            position += len(buf[pos:end].encode('utf-8'))
+            pos = end
+            yield row, position
+
+
+def _checkpoint_path(json_file):
+    return json_file + '.checkpoint'
+
+
+def _load_checkpoint(table_name, json_file):
+    try:
+        with open(_checkpoint_path(json_file), 'r', encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get('table') == table_name:
+            return checkpoint['offset'], checkpoint['rows']
+    except (OSError, ValueError, KeyError):
+        pass
+    return 0, 0
+
+
+def _save_checkpoint(table_name, json_file, offset, rows):
+    path = _checkpoint_path(json_file)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'table': table_name, 'offset': offset, 'rows': rows}, f)
+    os.replace(path + '.tmp', path)
+
+
+def _upsert_statement(conn, table, key, columns):
+    """INSERT ... ON CONFLICT (key) DO UPDATE для PostgreSQL и SQLite, иначе обычный INSERT."""
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        stmt = postgresql.insert(table)
+    elif dialect == 'sqlite':
+        stmt = sqlite.insert(table)
+    else:
+        return insert(table)
+
+    updated = {col: stmt.excluded[col] for col in columns if col not in (key, 'id')}
+    if not updated:
+        return stmt.on_conflict_do_nothing(index_elements=[key])
+    return stmt.on_conflict_do_update(index_elements=[key], set_=updated)
+
+
+def _with_defaults(table, columns, rows):
+    """
+    Дополняет строки значениями по умолчанию (заданными в моделях) для пропущенных колонок.
+
+    Нужны только для вставки новых строк: обновляются по-прежнему лишь колонки из выгрузки.
+    """
+    missing = [col for col in table.columns
+               if col.name not in columns and col.default is not None and not col.primary_key]
+    if not missing:
+        return columns, rows
+
+    defaults = [col.default for col in missing]
+    rows = [row + tuple(default.arg(None) if default.is_callable else default.arg for default in defaults)
+            for row in rows]
+    return columns + [col.name for col in missing], rows
+
+
+def _write_batch(conn, table, key, columns, rows):
+    """Вставляет пачку строк (кортежей в порядке columns) через executemany."""
+    stmt = _upsert_statement(conn, table, key, columns)
+    columns, rows = _with_defaults(table, columns, rows)
+
+    if conn.dialect.name == 'sqlite':
+        # Кортежи передаются драйверу напрямую, без обработки параметров SQLAlchemy
+        compiled = stmt.compile(dialect=conn.dialect, column_keys=columns)
+        if list(compiled.positiontup) != columns:
+            order = [columns.index(name) for name in compiled.positiontup]
+            rows = [tuple(row[i] for i in order) for row in rows]
+        conn.exec_driver_sql(str(compiled), rows)
+    else:
+        conn.execute(stmt, [dict(zip(columns, row)) for row in rows])
+
+
+def _csv_value(value):
+    return '\\N' if value is None else value
+
+
+def _copy_batch(conn, table, key, columns, rows):
+    """Загружает пачку через COPY FROM STDIN во временную таблицу и переносит её с upsert (PostgreSQL)."""
+    staging = f"import_{table.name}"
+    updated = [col for col in columns if col not in (key, 'id')]
+    columns, rows = _with_defaults(table, columns, rows)
+    columns_str = ', '.join(columns)
+    if updated:
+        on_conflict = "DO UPDATE SET " + ', '.join(f"{col} = EXCLUDED.{col}" for col in updated)
+    else:
+        on_conflict = "DO NOTHING"
+
+    conn.exec_driver_sql(
+        f"CREATE TEMP TABLE IF NOT EXISTS {staging} "
+        f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS"
+    )
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_csv_value(value) for value in row])
+    buffer.seek(0)
+
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {staging} ({columns_str}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer
+        )
+    finally:
+        cursor.close()
+
+    conn.exec_driver_sql(
+        f"INSERT INTO {table.name} ({columns_str}) SELECT {columns_str} FROM {staging} "
+        f"ON CONFLICT ({key}) {on_conflict}"
+    )
+
+
+def _reset_sequence(conn, table):
+    """После вставки явных id сдвигаем последовательность PostgreSQL за максимальный id."""
+    if conn.dialect.name == 'postgresql' and 'id' in table.columns:
+        conn.exec_driver_sql(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {table.name}), 1))"
+        )
+
 
 # Функция для импорта данных из JSON файла
-def import_table_data(table_name, json_file):
-    with open(json_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    if not data:
+def import_table_data(engine, table_name, json_file, batch_size=BATCH_SIZE, use_copy=True, resume=True):
+    """
+    Импортирует строки из JSON файла пачками с upsert по id.
+
+    После каждой пачки сохраняется контрольная точка, и при повторном запуске
+    импорт продолжается с неё.
+
+    Returns:
+        Количество импортированных строк
+    """
+    table = db.metadata.tables[table_name]
+    key = UPSERT_KEY
+    copy = use_copy and engine.dialect.name == 'postgresql'
+
+    offset, imported = _load_checkpoint(table_name, json_file) if resume else (0, 0)
+    if offset:
+        print(f"Продолжаем импорт {table_name} с {imported} строки")
+
+    started = time.time()
+    last_report = started
+    session_rows = 0
+    json_columns = {col.name for col in table.columns if isinstance(col.type, JSON)}
+    # Колонки строки по набору её ключей (только существующие в таблице)
+    row_columns = {}
+    batch = {}
+
+    def flush(position):
+        nonlocal imported, session_rows, last_report
+        # Строки с разным набором колонок пишутся отдельными запросами: пропущенная
+        # колонка не должна затирать значение в базе или значение по умолчанию
+        groups = {}
+        for columns, values in batch.values():
+            groups.setdefault(columns, []).append(values)
+        with engine.begin() as conn:
+            for columns, rows in groups.items():
+                if copy:
+                    _copy_batch(conn, table, key, list(columns), rows)
+                else:
+                    _write_batch(conn, table, key, list(columns), rows)
+        imported += len(batch)
+        session_rows += len(batch)
+        batch.clear()
+        _save_checkpoint(table_name, json_file, position, imported)
+
+        now = time.time()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            print(f"{table_name}: {imported} строк, {session_rows / (now - started):.0f} строк/с")
+
+    position = offset
+    for row, position in iter_json_rows(json_file, offset):
+        row_keys = tuple(row)
+        columns = row_columns.get(row_keys)
+        if columns is None:
+            columns = row_columns[row_keys] = tuple(col for col in row_keys if col in table.columns)
+
+        # JSON-колонки (например, права админов) передаются строкой
+        for col in json_columns:
+            if row.get(col) is not None:
+                row[col] = json.dumps(row[col], ensure_ascii=False)
+        values = tuple(map(row.get, columns))
+
+        # Повтор ключа внутри одной пачки нельзя обновить одним INSERT ... ON CONFLICT
+        row_key = row.get(key)
+        batch[(None, len(batch)) if row_key is None else row_key] = (columns, values)
+        if len(batch) >= batch_size:
+            flush(position)
+
+    if batch:
+        flush(position)
+
+    if session_rows:
+        with engine.begin() as conn:
+            _reset_sequence(conn, table)
+
+    # Импорт завершен - контрольная точка больше не нужна
+    if os.path.exists(_checkpoint_path(json_file)):
+        os.remove(_checkpoint_path(json_file))
+
+    elapsed = time.time() - started
+    if not imported:
         print(f"Нет данных для импорта в таблицу {table_name}")
-        return
-    
-    # Получаем список колонок из первого элемента
-    columns = list(data[0].keys())
-    columns_str = ', '.join(columns)
-    values_placeholder = ', '.join(['%s' for _ in columns])
-    
-    # Создаем SQL запрос
-    query = f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_placeholder})"
-    
-    # Подготавливаем данные для вставки
-    values = [[row[col] for col in columns] for row in data]
-    
-    # Выполняем запрос
-    with engine.connect() as conn:
-        for value_set in values:
-            conn.execute(text(query), value_set)
-        conn.commit()
-    
-    print(f"Импортировано {len(data)} записей в таблицу {table_name}")
-
-# Импортируем данные из всех JSON файлов
+    else:
+        rate = session_rows / elapsed if elapsed > 0 else session_rows
+        print(f"Импортировано {imported} записей в таблицу {table_name} ({rate:.0f} строк/с)")
+    return imported
+
+
+# Импортируем данные из всех JSON файлов (порядок важен для внешних ключей)
 tables = {
     'users': 'users.json',
     'shop_items': 'shop_items.json',
@@ -46,10 +299,32 @@ tables = {
     'admin_login_attempts': 'admin_login_attempts.json'
 }
 
-for table, json_file in tables.items():
-    try:
-        import_table_data(table, json_file)
-    except Exception as e:
-        print(f"Ошибка при импорте данных в таблицу {table}: {str(e)}")
 
-print("Импорт данных завершен") 
\ No newline at end of file
+def main():
+    parser = argparse.ArgumentParser(description="Импорт данных из JSON файлов")
+    parser.add_argument("--database-url", default=os.environ.get("DATABASE_URL"))
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-copy", action="store_true", help="не использовать COPY на PostgreSQL")
+    parser.add_argument("--restart", action="store_true", help="игнорировать контрольные точки")
+    args = parser.parse_args()
+
+    # Подключение к базе данных
+    engine = create_engine(args.database_url)
+    db.metadata.create_all(engine)
+
+    for table, json_file in tables.items():
+        try:
+            import_table_data(
+                engine, table, json_file,
+                batch_size=args.batch_size,
+                use_copy=not args.no_copy,
+                resume=not args.restart
+            )
+        except Exception as e:
+            print(f"Ошибка при импорте данных в таблицу {table}: {str(e)}")
+
+    print("Импорт данных завершен")
+
+
+if __name__ == '__main__':
+    main()
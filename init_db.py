@@ -1,5 +1,6 @@
 from flask import Flask
 from models import db
+from migrations import run_migrations
 from config import DATABASE_URL, SQLALCHEMY_TRACK_MODIFICATIONS, SQLALCHEMY_ENGINE_OPTIONS
 
 app = Flask(__name__)
@@ -11,4 +12,5 @@ db.init_app(app)
 
 with app.app_context():
     db.create_all()
+    run_migrations(db.engine)
     print("База данных успешно инициализирована!") 
\ No newline at end of file
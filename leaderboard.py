@@ -0,0 +1,248 @@
+"""
+Leaderboard Module
+
+This module maintains the delivery leaderboard in memory so that /top and
+/rank don't have to sort or count the users table. Users are bucketed by
+their number of deliveries in a Fenwick (binary indexed) tree, which gives
+any user's rank in O(log n). The top entries are kept in a small sorted
+list that is updated incrementally from the delivery path. The whole
+structure is periodically rebuilt from the database to pick up changes
+made elsewhere (admin edits, deleted users, renames).
+"""
+import time
+import heapq
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple, Any
+from sqlalchemy import select, func
+from models import db, User
+from config import LEADERBOARD_TOP_SIZE, LEADERBOARD_RECONCILE_INTERVAL
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class DeliveryCounts:
+    """
+    Fenwick tree counting users per number of deliveries.
+
+    The tree grows with the largest count it holds, up to max_size; the
+    rare larger counts (e.g. set by an admin edit) are kept in a dict, so a
+    single huge value can't allocate a huge tree. Negative counts are
+    treated as 0.
+    """
+
+    def __init__(self, size: int = 1024, max_size: int = 1 << 20):
+        self._size = min(size, max_size)
+        self._max_size = max_size
+        self._tree = [0] * (self._size + 1)
+        self._overflow = {}  # deliveries >= max_size -> users
+        self.total = 0
+
+    def _grow(self, value: int) -> None:
+        size = self._size
+        while size <= value:
+            size *= 2
+
+        # Rebuild from the per-bucket counts
+        counts = [self.count(v) for v in range(self._size)]
+        self._size = size
+        self._tree = [0] * (size + 1)
+        for v, count in enumerate(counts):
+            if count:
+                self._tree_add(v, count)
+
+    def _tree_add(self, value: int, delta: int) -> None:
+        i = value + 1
+        while i <= self._size:
+            self._tree[i] += delta
+            i += i & -i
+
+    def add(self, value: int, delta: int = 1) -> None:
+        """Add delta users with the given number of deliveries."""
+        value = max(0, value)
+        self.total += delta
+        if value >= self._max_size:
+            count = self._overflow.get(value, 0) + delta
+            if count:
+                self._overflow[value] = count
+            else:
+                self._overflow.pop(value, None)
+            return
+
+        if value >= self._size:
+            self._grow(value)
+        self._tree_add(value, delta)
+
+    def count_at_most(self, value: int) -> int:
+        """Count users with at most value deliveries."""
+        if value < 0:
+            return 0
+        i = min(value, self._size - 1) + 1
+        result = 0
+        while i > 0:
+            result += self._tree[i]
+            i -= i & -i
+        if value >= self._max_size:
+            result += sum(count for v, count in self._overflow.items() if v <= value)
+        return result
+
+    def count(self, value: int) -> int:
+        """Count users with exactly value deliveries."""
+        return self.count_at_most(value) - (self.count_at_most(value - 1) if value else 0)
+
+
+class Leaderboard:
+    """Incrementally maintained leaderboard with O(log n) rank lookups."""
+
+    def __init__(self, top_size: int = 10):
+        self.top_size = top_size
+        self._lock = threading.Lock()
+        self._counts = DeliveryCounts()
+        self._top = []  # dicts sorted by deliveries, descending
+        self._loaded = False
+        self._reconciler = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def ensure_loaded(self) -> None:
+        """Build the leaderboard from the database on first use (needs app context)."""
+        if not self._loaded:
+            self.reconcile()
+
+    def reconcile(self) -> None:
+        """
+        Rebuild the leaderboard from the database (needs app context).
+
+        The database is read under the lock: a delivery recorded between the
+        read and the swap would otherwise be lost from the buckets. Deliveries
+        wait for the two (indexed) queries instead.
+        """
+        with self._lock:
+            counts = DeliveryCounts()
+            rows = db.session.execute(
+                select(User.deliveries, func.count()).group_by(User.deliveries)
+            ).all()
+            for deliveries, count in rows:
+                counts.add(deliveries or 0, count)
+
+            top_users = db.session.execute(
+                select(User.id, User.telegram_id, User.username, User.deliveries)
+                .order_by(User.deliveries.desc())
+                .limit(self.top_size)
+            ).all()
+            top = [_entry(*row) for row in top_users]
+
+            self._counts = counts
+            self._top = top
+            self._loaded = True
+
+    def build(self, users: Iterable[Dict[str, Any]]) -> None:
+        """Build the leaderboard from user dicts (id, telegram_id, username, deliveries)."""
+        users = list(users)
+        counts = DeliveryCounts()
+        for user in users:
+            counts.add(user["deliveries"] or 0, 1)
+
+        top_users = heapq.nlargest(self.top_size, users, key=lambda user: user["deliveries"] or 0)
+        top = [_entry(u["id"], u["telegram_id"], u["username"], u["deliveries"]) for u in top_users]
+
+        with self._lock:
+            self._counts = counts
+            self._top = top
+            self._loaded = True
+
+    def add_user(self, user_id: int, telegram_id: Any, username: str, deliveries: int = 0) -> bool:
+        """Register a newly created user."""
+        return self.record_delivery(user_id, telegram_id, username, None, deliveries)
+
+    def record_delivery(self, user_id: int, telegram_id: Any, username: str,
+                        old_deliveries: Optional[int], new_deliveries: int) -> bool:
+        """
+        Move a user from old_deliveries to new_deliveries (old is None for new users).
+
+        Returns:
+            True if the top entries changed
+        """
+        with self._lock:
+            if not self._loaded:
+                return False
+
+            if old_deliveries is not None:
+                self._counts.add(old_deliveries, -1)
+            self._counts.add(new_deliveries, 1)
+
+            # Update the top entries
+            top = [entry for entry in self._top if entry["id"] != user_id]
+            if len(top) < self.top_size or new_deliveries > top[-1]["deliveries"]:
+                top.append(_entry(user_id, telegram_id, username, new_deliveries))
+                top.sort(key=lambda entry: entry["deliveries"], reverse=True)
+                del top[self.top_size:]
+            changed = top != self._top
+            self._top = top
+            return changed
+
+    def top(self, limit: int = 5) -> List[Dict[str, Any]]:
+        """Get up to limit top users as dicts with id, telegram_id, username and deliveries."""
+        with self._lock:
+            return [dict(entry) for entry in self._top[:limit]]
+
+    def rank(self, deliveries: int) -> Tuple[int, int]:
+        """
+        Get the rank for a number of deliveries.
+
+        Users with equal deliveries share a rank.
+
+        Returns:
+            Tuple of (rank, total_users)
+        """
+        with self._lock:
+            total = self._counts.total
+            better = total - self._counts.count_at_most(deliveries)
+            return better + 1, total
+
+    def start_reconciler(self, app) -> None:
+        """Start the background thread that periodically rebuilds the leaderboard."""
+        with self._lock:
+            if self._reconciler is not None:
+                return
+            self._reconciler = threading.Thread(target=self._reconcile_loop, args=(app,), daemon=True)
+            self._reconciler.start()
+
+    def _reconcile_loop(self, app) -> None:
+        while True:
+            time.sleep(LEADERBOARD_RECONCILE_INTERVAL)
+            try:
+                with app.app_context():
+                    self.reconcile()
+            except Exception as e:
+                logger.error(f"Error reconciling leaderboard: {e}")
+
+
+def load_top_users(limit: int = 10) -> List[User]:
+    """
+    Load the User rows of the top users (needs app context).
+
+    The web views read the database instead of the in-memory leaderboard:
+    deliveries are recorded in the bot process, so this process' copy would
+    only catch up on the next reconcile. The query walks ix_users_deliveries.
+    """
+    return (User.query
+            .order_by(User.deliveries.desc())
+            .limit(limit)
+            .all())
+
+
+def _entry(user_id, telegram_id, username, deliveries) -> Dict[str, Any]:
+    return {
+        "id": user_id,
+        "telegram_id": str(telegram_id),
+        "username": username,
+        "deliveries": deliveries or 0
+    }
+
+
+# Shared leaderboard for the process
+leaderboard = Leaderboard(LEADERBOARD_TOP_SIZE)
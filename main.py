@@ -4,7 +4,8 @@ Delivery Bot - Main Entry Point
 import logging
 import os
 from app import app, db
-from telegram_bot import run_telegram_bot
+from telegram_bot import run_telegram_bot, setup_telegram_webhook
+from config import BOT_MODE
 import threading
 
 # Configure logging
@@ -45,6 +46,10 @@ if __name__ == '__main__':
     token = os.environ.get("TELEGRAM_BOT_TOKEN")
     if not token:
         logger.error("No TELEGRAM_BOT_TOKEN found! Bot will not work!")
+    elif BOT_MODE == "webhook":
+        # Updates are received by the web server below
+        setup_telegram_webhook(app)
+        logger.info("Webhook configured")
     else:
         # Start bot in a separate thread
         bot_thread = threading.Thread(target=start_bot)
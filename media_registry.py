@@ -0,0 +1,198 @@
+"""
+Media Registry Module
+
+This module remembers the file_id Telegram returns after the bot uploads an
+image, keyed by the content hash of the image bytes. Later sends of the same
+image reference the file_id instead of uploading the bytes again. Known
+file_ids are kept in memory and persisted in the media_files table so they
+survive restarts. The *_async functions do the same for AsyncTeleBot.
+"""
+import asyncio
+import logging
+import threading
+from typing import Dict, Optional
+from sqlalchemy import select
+from telebot import types
+from telebot.apihelper import ApiTelegramException
+from models import db, MediaFile
+from image_cache import content_hash
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class MediaRegistry:
+    """Content hash -> Telegram file_id map backed by the media_files table."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._file_ids: Dict[str, str] = {}
+        self._app = None
+        self.uploads = 0
+        self.reuses = 0
+
+    def init_app(self, app) -> None:
+        """Persist file_ids through the given app's database and load known ones."""
+        self._app = app
+        try:
+            with app.app_context():
+                rows = db.session.execute(select(MediaFile.content_hash, MediaFile.file_id)).all()
+            with self._lock:
+                self._file_ids.update(dict(rows))
+        except Exception as e:
+            logger.error(f"Error loading media files: {e}")
+
+    def get(self, digest: str) -> Optional[str]:
+        with self._lock:
+            return self._file_ids.get(digest)
+
+    def remember(self, digest: str, file_id: str) -> None:
+        """Store the file_id of an uploaded image."""
+        with self._lock:
+            if self._file_ids.get(digest) == file_id:
+                return
+            self._file_ids[digest] = file_id
+
+        if self._app is None:
+            return
+
+        try:
+            with self._app.app_context():
+                media_file = MediaFile.query.filter_by(content_hash=digest).first()
+                if media_file:
+                    media_file.file_id = file_id
+                else:
+                    db.session.add(MediaFile(content_hash=digest, file_id=file_id))
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"Error saving media file {digest[:16]}: {e}")
+
+    def forget(self, digest: str) -> None:
+        """Drop a file_id Telegram no longer accepts."""
+        with self._lock:
+            self._file_ids.pop(digest, None)
+
+        if self._app is None:
+            return
+
+        try:
+            with self._app.app_context():
+                MediaFile.query.filter_by(content_hash=digest).delete()
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"Error deleting media file {digest[:16]}: {e}")
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return {"known": len(self._file_ids), "uploads": self.uploads, "reuses": self.reuses}
+
+
+def _is_bad_file_id(error: ApiTelegramException) -> bool:
+    """Check whether Telegram rejected a file_id (expired, foreign bot etc.)."""
+    description = str(error.description or "").lower()
+    return error.error_code == 400 and ("file" in description or "photo" in description)
+
+
+def _file_id_of(message) -> Optional[str]:
+    # The largest size is the one matching the uploaded image
+    if isinstance(message, types.Message) and message.photo:
+        return message.photo[-1].file_id
+    return None
+
+
+def _send(digest, photo, send):
+    """Send by file_id if known, otherwise upload and remember the file_id."""
+    file_id = media_registry.get(digest)
+    if file_id:
+        try:
+            message = send(file_id)
+            media_registry.reuses += 1
+            return message
+        except ApiTelegramException as e:
+            if not _is_bad_file_id(e):
+                raise
+            logger.warning(f"Telegram rejected cached file_id, uploading again: {e.description}")
+            media_registry.forget(digest)
+
+    photo.seek(0)
+    message = send(photo)
+    media_registry.uploads += 1
+
+    file_id = _file_id_of(message)
+    if file_id:
+        media_registry.remember(digest, file_id)
+    return message
+
+
+def send_photo(bot, chat_id, photo, **kwargs):
+    """
+    Send an in-memory photo, uploading its bytes only the first time.
+
+    Args:
+        bot: The TeleBot instance
+        chat_id: Chat to send the photo to
+        photo: File object with the image bytes (see image_cache.as_upload)
+        **kwargs: Extra arguments for bot.send_photo (caption, reply_markup, ...)
+    """
+    digest = content_hash(photo.getvalue())
+    return _send(digest, photo, lambda media: bot.send_photo(chat_id, media, **kwargs))
+
+
+def edit_message_photo(bot, chat_id, message_id, photo, caption=None, parse_mode=None, reply_markup=None):
+    """Replace the photo of a message, uploading its bytes only the first time."""
+    digest = content_hash(photo.getvalue())
+    return _send(digest, photo, lambda media: bot.edit_message_media(
+        media=types.InputMediaPhoto(media, caption=caption, parse_mode=parse_mode),
+        chat_id=chat_id,
+        message_id=message_id,
+        reply_markup=reply_markup
+    ))
+
+
+async def _send_async(digest, photo, send):
+    """Async version of _send for AsyncTeleBot (the database writes run in a thread)."""
+    # Only needed by the asyncio runtime, which requires aiohttp
+    from telebot.asyncio_helper import ApiTelegramException as AsyncApiTelegramException
+
+    file_id = media_registry.get(digest)
+    if file_id:
+        try:
+            message = await send(file_id)
+            media_registry.reuses += 1
+            return message
+        except AsyncApiTelegramException as e:
+            if not _is_bad_file_id(e):
+                raise
+            logger.warning(f"Telegram rejected cached file_id, uploading again: {e.description}")
+            await asyncio.to_thread(media_registry.forget, digest)
+
+    photo.seek(0)
+    message = await send(photo)
+    media_registry.uploads += 1
+
+    file_id = _file_id_of(message)
+    if file_id:
+        await asyncio.to_thread(media_registry.remember, digest, file_id)
+    return message
+
+
+async def send_photo_async(bot, chat_id, photo, **kwargs):
+    """send_photo for an AsyncTeleBot."""
+    digest = content_hash(photo.getvalue())
+    return await _send_async(digest, photo, lambda media: bot.send_photo(chat_id, media, **kwargs))
+
+
+async def edit_message_photo_async(bot, chat_id, message_id, photo, caption=None, parse_mode=None,
+                                   reply_markup=None):
+    """edit_message_photo for an AsyncTeleBot."""
+    digest = content_hash(photo.getvalue())
+    return await _send_async(digest, photo, lambda media: bot.edit_message_media(
+        media=types.InputMediaPhoto(media, caption=caption, parse_mode=parse_mode),
+        chat_id=chat_id,
+        message_id=message_id,
+        reply_markup=reply_markup
+    ))
+
+
+# Shared registry for the process
+media_registry = MediaRegistry()
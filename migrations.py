@@ -0,0 +1,195 @@
+"""
+Database Migrations Module
+
+This module applies schema changes that db.create_all() can't make on an
+existing database, such as adding indexes to tables that already exist.
+Applied migrations are recorded in the schema_migrations table, so each
+one runs exactly once per database. Migrations pin their DDL instead of
+deriving it from the current models, so that later model changes don't
+change what an old migration does.
+
+Every worker runs the migrations on startup. A migration's version is
+inserted before the migration runs, in the same transaction: the row
+lock on the version makes concurrent workers wait for the one applying
+it, and they skip it once it is committed.
+
+On PostgreSQL index migrations build their indexes with CREATE INDEX
+CONCURRENTLY instead, so that they don't block writes to large tables.
+That can't run inside a transaction, so they run in autocommit under a
+session advisory lock, and workers that don't get the lock skip the
+migration instead of waiting for the build.
+
+Usage:
+    python migrations.py [DATABASE_URL]
+"""
+import sys
+import time
+import logging
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
+from models import db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+# Base of the advisory lock keys of concurrent migrations (plus the version)
+ADVISORY_LOCK_BASE = 0x6d696700
+
+INVALID_INDEX_QUERY = (
+    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+    "WHERE c.relname = :name AND NOT i.indisvalid"
+)
+
+
+def _create_indexes(statements: Dict[str, List[str]]) -> Callable:
+    """Build a migration that runs the given CREATE INDEX statements per table."""
+    def migrate(conn):
+        for table_name, table_statements in statements.items():
+            # Tables created later by create_all() get their indexes with them
+            if not inspect(conn).has_table(table_name):
+                continue
+            for statement in table_statements:
+                conn.execute(text(statement))
+
+    def migrate_concurrently(conn):
+        for table_name, table_statements in statements.items():
+            if not inspect(conn).has_table(table_name):
+                continue
+            for statement in table_statements:
+                # "CREATE INDEX IF NOT EXISTS <name> ON ..."
+                index_name = statement.split()[5]
+                # An interrupted build leaves an invalid index that IF NOT EXISTS would keep
+                if conn.execute(text(INVALID_INDEX_QUERY), {"name": index_name}).first():
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+                conn.execute(text(statement.replace("CREATE INDEX", "CREATE INDEX CONCURRENTLY", 1)))
+
+    migrate.concurrently = migrate_concurrently
+    return migrate
+
+
+def _create_tables(*table_names: str) -> Callable:
+    """Build a migration that creates the given model tables if they are missing."""
+    def migrate(conn):
+        for table_name in table_names:
+            db.metadata.tables[table_name].create(conn, checkfirst=True)
+    return migrate
+
+
+# Indexes of migration 1 as they were declared on the models at the time
+HOT_QUERY_INDEXES = {
+    "users": [
+        "CREATE INDEX IF NOT EXISTS ix_users_deliveries ON users (deliveries DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_users_money ON users (money DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_users_created_at ON users (created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_users_last_delivery ON users (last_delivery)",
+        "CREATE INDEX IF NOT EXISTS ix_users_not_blocked ON users (id) WHERE blocked = false",
+    ],
+    "buffs": [
+        "CREATE INDEX IF NOT EXISTS ix_buffs_user_id_expires_at ON buffs (user_id, expires_at)",
+        "CREATE INDEX IF NOT EXISTS ix_buffs_expires_at ON buffs (expires_at)",
+        "CREATE INDEX IF NOT EXISTS ix_buffs_created_at ON buffs (created_at)",
+    ],
+}
+
+# Ordered list of (version, name, migration function)
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "hot query indexes for users and buffs", _create_indexes(HOT_QUERY_INDEXES)),
+    (2, "media files table for Telegram file_id reuse", _create_tables("media_files")),
+    (3, "broadcast jobs and recipients", _create_tables("broadcast_jobs", "broadcast_recipients")),
+]
+
+
+def _record(conn, version: int, name: str) -> None:
+    """Record a migration as applied."""
+    conn.execute(
+        text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)"),
+        {"v": version, "n": name, "t": time.time()}
+    )
+
+
+def _migrate_concurrently(engine, version: int, name: str, migrate: Callable) -> bool:
+    """
+    Apply a migration in autocommit under an advisory lock (PostgreSQL).
+
+    Returns:
+        False if another worker holds the lock or has applied the migration
+    """
+    key = ADVISORY_LOCK_BASE + version
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key}).scalar():
+            return False
+        try:
+            # The worker that held the lock may have just finished it
+            applied = conn.execute(
+                text("SELECT 1 FROM schema_migrations WHERE version = :v"), {"v": version}
+            ).first()
+            if applied:
+                return False
+            migrate(conn)
+            _record(conn, version, name)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+    return True
+
+
+def run_migrations(engine) -> List[int]:
+    """
+    Apply pending migrations.
+
+    Returns:
+        List of applied migration versions
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, "
+                "name VARCHAR(128) NOT NULL, "
+                "applied_at FLOAT NOT NULL)"
+            ))
+    except IntegrityError:
+        # Another worker created the table at the same time (PostgreSQL)
+        pass
+
+    with engine.connect() as conn:
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    newly_applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version in applied:
+            continue
+
+        concurrently = getattr(migrate, "concurrently", None)
+        if concurrently is not None and engine.dialect.name == "postgresql":
+            if not _migrate_concurrently(engine, version, name, concurrently):
+                logger.info(f"Migration {version} is applied by another worker")
+                continue
+            logger.info(f"Applied migration {version} concurrently: {name}")
+            newly_applied.append(version)
+            continue
+
+        # Each migration runs in its own transaction, after claiming its version
+        try:
+            with engine.begin() as conn:
+                _record(conn, version, name)
+                migrate(conn)
+        except IntegrityError:
+            logger.info(f"Migration {version} was applied by another worker")
+            continue
+
+        logger.info(f"Applied migration {version}: {name}")
+        newly_applied.append(version)
+
+    return newly_applied
+
+
+if __name__ == '__main__':
+    from config import DATABASE_URL
+
+    logging.basicConfig(level=logging.INFO)
+    url = sys.argv[1] if len(sys.argv) > 1 else DATABASE_URL
+    versions = run_migrations(create_engine(url))
+    print(f"Применено миграций: {len(versions)}")
@@ -23,6 +23,19 @@ class User(db.Model):
     
     # Relationships
     buffs = db.relationship("Buff", backref="user", lazy=True)
+    
+    # Indexes for the hot query patterns (see migrations.py)
+    __table_args__ = (
+        db.Index("ix_users_deliveries", deliveries.desc()),
+        db.Index("ix_users_money", money.desc()),
+        db.Index("ix_users_created_at", created_at),
+        db.Index("ix_users_last_delivery", last_delivery),
+        db.Index(
+            "ix_users_not_blocked", id,
+            sqlite_where=db.text("blocked = false"),
+            postgresql_where=db.text("blocked = false")
+        ),
+    )
 
     def to_dict(self):
         """Convert user object to dictionary."""
@@ -51,6 +64,13 @@ class Buff(db.Model):
     expires_at = db.Column(db.Float, nullable=False)
     created_at = db.Column(db.Float, default=time.time)
     
+    # Indexes for the hot query patterns (see migrations.py)
+    __table_args__ = (
+        db.Index("ix_buffs_user_id_expires_at", user_id, expires_at),
+        db.Index("ix_buffs_expires_at", expires_at),
+        db.Index("ix_buffs_created_at", created_at),
+    )
+    
     def to_dict(self):
         """Convert buff object to dictionary."""
         remaining_seconds = max(0, int(self.expires_at - time.time()))
@@ -163,3 +183,86 @@ class AdminLoginAttempt(db.Model):
             "success": self.success,
             "timestamp": self.timestamp
         }
+
+class MediaFile(db.Model):
+    """Telegram file_id of an image the bot has already uploaded."""
+    __tablename__ = 'media_files'
+
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), unique=True, nullable=False)
+    file_id = db.Column(db.String(256), nullable=False)
+    created_at = db.Column(db.Float, default=time.time)
+    
+    def to_dict(self):
+        """Convert media file to dictionary."""
+        return {
+            "id": self.id,
+            "content_hash": self.content_hash,
+            "file_id": self.file_id,
+            "created_at": self.created_at
+        }
+
+class BroadcastJob(db.Model):
+    """Broadcast of a message to the bot's users (see broadcast.py)."""
+    __tablename__ = 'broadcast_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.Text, nullable=False)
+    target = db.Column(db.String(16), nullable=False, default='all')  # all, active
+    status = db.Column(db.String(16), nullable=False, default='pending')  # pending, running, done, cancelled
+    cursor = db.Column(db.Integer, nullable=False, default=0)  # users up to this id are processed
+    total = db.Column(db.Integer, nullable=False, default=0)
+    sent = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    created_by = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.Float, default=time.time)
+    started_at = db.Column(db.Float, nullable=True)
+    finished_at = db.Column(db.Float, nullable=True)
+    lease_until = db.Column(db.Float, nullable=False, default=0)  # the sending process renews it
+    
+    def to_dict(self):
+        """Convert broadcast job to dictionary."""
+        return {
+            "id": self.id,
+            "text": self.text,
+            "target": self.target,
+            "status": self.status,
+            "cursor": self.cursor,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+class BroadcastRecipient(db.Model):
+    """Delivery status of a broadcast to one user."""
+    __tablename__ = 'broadcast_recipients'
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('broadcast_jobs.id'), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    telegram_id = db.Column(db.String(32), nullable=False)
+    status = db.Column(db.String(16), nullable=False)  # sent, blocked, failed
+    attempts = db.Column(db.Integer, nullable=False, default=1)
+    error = db.Column(db.String(256), nullable=True)
+    sent_at = db.Column(db.Float, default=time.time)
+    
+    __table_args__ = (
+        db.UniqueConstraint("job_id", "user_id", name="uq_broadcast_recipients_job_user"),
+    )
+    
+    def to_dict(self):
+        """Convert broadcast recipient to dictionary."""
+        return {
+            "id": self.id,
+            "job_id": self.job_id,
+            "user_id": self.user_id,
+            "telegram_id": self.telegram_id,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "sent_at": self.sent_at
+        }
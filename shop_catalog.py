@@ -0,0 +1,192 @@
+"""
+Shop Catalog Module
+
+This module keeps the active shop items in memory, indexed by position and
+by item_id, so that rendering a shop page doesn't query the shop_items
+table or parse the shop JSON file. The catalog carries a version number
+stored in a small file next to the data files. Code that changes shop
+items calls invalidate() after committing, which bumps the version, and
+every process reloads its catalog once it notices the file has changed
+(checked at most once per SHOP_CATALOG_CHECK_INTERVAL).
+"""
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+from models import ShopItem
+from config import SHOP_DATA_FILE, SHOP_CATALOG_VERSION_FILE, SHOP_CATALOG_CHECK_INTERVAL
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ShopCatalog:
+    """In-memory catalog of active shop items with cross-process invalidation."""
+
+    def __init__(self, version_file: str, check_interval: float = 1.0):
+        self.version_file = version_file
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._items: List[Dict[str, Any]] = []
+        self._by_item_id: Dict[str, Dict[str, Any]] = {}
+        self._loaded_stamp = None  # version file stamp the items were loaded at
+        self._checked_at = 0.0
+        self._stale = True
+        self.version = 0
+        self.reloads = 0
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.version_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def is_stale(self) -> bool:
+        """Check whether the catalog has to be reloaded."""
+        if self._stale:
+            return True
+
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = now
+
+        # Another process bumped the version
+        if self._stamp() != self._loaded_stamp:
+            self._stale = True
+        return self._stale
+
+    def reload(self, images: Optional[Dict[str, str]] = None) -> None:
+        """
+        Load the active shop items from the database (needs app context).
+
+        Args:
+            images: item_id -> image path, attached to the items
+        """
+        stamp = self._stamp()
+        images = images or {}
+
+        items = []
+        for position, item in enumerate(ShopItem.query.filter_by(is_active=True).order_by(ShopItem.id)):
+            item_data = item.to_dict()
+            item_data["image"] = images.get(item.item_id, "")
+            item_data["position"] = position
+            items.append(item_data)
+
+        with self._lock:
+            self._items = items
+            self._by_item_id = {item["item_id"]: item for item in items}
+            self._loaded_stamp = stamp
+            self._checked_at = time.monotonic()
+            self._stale = False
+            self.version = _read_version(self.version_file)
+            self.reloads += 1
+
+    def invalidate(self) -> None:
+        """Bump the catalog version so that all processes reload it."""
+        with self._lock:
+            self._stale = True
+            version = _read_version(self.version_file) + 1
+            try:
+                tmp_path = self.version_file + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(str(version))
+                os.replace(tmp_path, self.version_file)
+            except OSError as e:
+                logger.error(f"Error bumping shop catalog version: {e}")
+
+    def items(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(item) for item in self._items]
+
+    def count(self) -> int:
+        return len(self._items)
+
+    def get(self, index: int) -> Optional[Dict[str, Any]]:
+        """Get an item by position, wrapping around the end of the catalog."""
+        with self._lock:
+            if not self._items:
+                return None
+            return dict(self._items[index % len(self._items)])
+
+    def by_item_id(self, item_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._by_item_id.get(item_id)
+            return dict(item) if item else None
+
+
+def load_shop_items() -> List[Dict[str, Any]]:
+    """Load shop items from JSON file or use defaults."""
+    default_items = [
+        {
+            "item_id": "hyper_buff",
+            "name": "Гипер Бафф",
+            "description": "Повышает доход на 50%",
+            "price": 2750,
+            "bonus": 0.5,
+            "duration": 40,
+            "image": "assets/shop/IMG_1914.jpeg"
+        },
+        {
+            "item_id": "super_buff",
+            "name": "Супер Бафф",
+            "description": "Повышает доход на 15%",
+            "price": 850,
+            "bonus": 0.15,
+            "duration": 30,
+            "image": "assets/shop/IMG_2282.jpeg"
+        },
+        {
+            "item_id": "mega_buff",
+            "name": "Мега Бафф",
+            "description": "Повышает доход на 25%",
+            "price": 1800,
+            "bonus": 0.25,
+            "duration": 30,
+            "image": "assets/shop/IMG_2283.jpeg"
+        },
+        {
+            "item_id": "ultra_buff",
+            "name": "Ультра Бафф",
+            "description": "Повышает доход на 35%",
+            "price": 2200,
+            "bonus": 0.35,
+            "duration": 35,
+            "image": "assets/shop/IMG_2284.jpeg"
+        }
+    ]
+
+    # Try to load from JSON file
+    if os.path.exists(SHOP_DATA_FILE):
+        try:
+            with open(SHOP_DATA_FILE, 'r', encoding='utf-8') as f:
+                items = json.load(f)
+                if items and len(items) > 0:
+                    return items
+        except Exception as e:
+            logger.error(f"Error loading shop items from file: {e}")
+
+    # Save default items to file
+    try:
+        with open(SHOP_DATA_FILE, 'w', encoding='utf-8') as f:
+            json.dump(default_items, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        logger.error(f"Error saving default shop items to file: {e}")
+
+    return default_items
+
+
+def _read_version(path: str) -> int:
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+# Shared catalog for the process
+shop_catalog = ShopCatalog(SHOP_CATALOG_VERSION_FILE, SHOP_CATALOG_CHECK_INTERVAL)
+
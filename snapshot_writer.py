@@ -0,0 +1,172 @@
+"""
+Snapshot Writer Module
+
+This module persists per-key records (e.g. users) to a JSON snapshot file
+incrementally. Every change is appended to a change log as a compact JSON
+line, and a background thread periodically compacts the log into the full
+snapshot. The snapshot is always replaced atomically, so a crash mid-write
+never leaves a truncated file behind.
+"""
+import json
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Dict, Any, Optional
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class SnapshotWriter:
+    """Append-only change log with periodic compaction into a snapshot."""
+
+    def __init__(self, snapshot_path: str, log_path: str,
+                 compact_interval: float = 60, compact_threshold: int = 5000):
+        self.snapshot_path = snapshot_path
+        self.log_path = log_path
+        self.compacting_path = log_path + ".compacting"
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._log_file = None
+        self._dirty = set()
+        self._log_entries = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+
+    def record(self, key: Any, delta: Dict[str, Any]) -> None:
+        """Append a delta for one record to the change log."""
+        self._append({"key": str(key), "delta": delta})
+
+    def delete(self, key: Any) -> None:
+        """Append a deletion marker for one record to the change log."""
+        self._append({"key": str(key), "deleted": True})
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":"))
+
+        with self._lock:
+            if self._log_file is None:
+                self._log_file = open(self.log_path, "a", encoding="utf-8")
+            self._log_file.write(line + "\n")
+            self._log_file.flush()
+
+            self._dirty.add(entry["key"])
+            self._log_entries += 1
+            needs_compaction = self._log_entries >= self.compact_threshold
+
+        self._ensure_started()
+        if needs_compaction:
+            threading.Thread(target=self.compact, daemon=True).start()
+
+    def load(self) -> Dict[str, Any]:
+        """Return the snapshot with all logged changes replayed on top."""
+        data = {}
+        if os.path.exists(self.snapshot_path):
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading snapshot {self.snapshot_path}: {e}")
+
+        # A leftover .compacting file means a compaction was interrupted
+        for path in (self.compacting_path, self.log_path):
+            self._replay(path, data)
+
+        return data
+
+    @staticmethod
+    def _replay(path: str, data: Dict[str, Any]) -> None:
+        if not os.path.exists(path):
+            return
+
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last line after a crash
+                    continue
+
+                key = entry["key"]
+                if entry.get("deleted"):
+                    data.pop(key, None)
+                else:
+                    data.setdefault(key, {}).update(entry["delta"])
+
+    def compact(self) -> Optional[float]:
+        """
+        Fold the change log into the snapshot.
+
+        Returns:
+            Compaction time in seconds, or None if there was nothing to do
+        """
+        with self._compact_lock:
+            started = time.time()
+
+            # Rotate the log so new changes keep flowing during compaction
+            with self._lock:
+                if not self._dirty and not os.path.exists(self.compacting_path):
+                    return None
+                if self._log_file is not None:
+                    self._log_file.close()
+                    self._log_file = None
+                if os.path.exists(self.log_path) and not os.path.exists(self.compacting_path):
+                    os.replace(self.log_path, self.compacting_path)
+                self._dirty = set()
+                self._log_entries = 0
+
+            data = {}
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            self._replay(self.compacting_path, data)
+
+            # Write to a temporary file and atomically swap it in
+            tmp_path = self.snapshot_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.snapshot_path)
+
+            if os.path.exists(self.compacting_path):
+                os.remove(self.compacting_path)
+
+            return time.time() - started
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error(f"Error compacting snapshot {self.snapshot_path}: {e}")
+
+    def close(self) -> None:
+        """Stop the background thread and compact pending changes."""
+        self._stop.set()
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Error compacting snapshot {self.snapshot_path}: {e}")
+        with self._lock:
+            if self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
@@ -52,26 +52,48 @@ document.querySelector('.shop-button').addEventListener('click', function() {
     tg.sendData(JSON.stringify({action: 'open_shop'}));
 });
 
+function renderLeaderboard(data) {
+    const list = document.getElementById('top-couriers');
+    list.innerHTML = data.map((user, index) => `
+        <div class="leaderboard-item">
+            <span class="position">${index + 1}</span>
+            <span class="name">${user.name || user.username}</span>
+            <span class="score">${user.deliveries} доставок</span>
+        </div>
+    `).join('');
+}
+
 function updateLeaderboard() {
     fetch('/api/leaderboard')
         .then(res => res.json())
-        .then(data => {
-            const list = document.getElementById('top-couriers');
-            list.innerHTML = data.map((user, index) => `
-                <div class="leaderboard-item">
-                    <span class="position">${index + 1}</span>
-                    <span class="name">${user.name}</span>
-                    <span class="score">${user.deliveries} доставок</span>
-                </div>
-            `).join('');
-        });
+        .then(renderLeaderboard);
 }
 
+if (window.EventSource) {
+    // Live updates: the leaderboard and the user's own deliveries and purchases
+    const source = new EventSource('/dashboard/stream');
+    const refreshOwnData = event => {
+        const userId = tg.initDataUnsafe?.user?.id;
+        if (userId && JSON.parse(event.data).telegram_id === String(userId)) {
+            loadUserData(userId);
+        }
+    };
 
-// Update stats every 30 seconds
-setInterval(() => {
-    if (tg.initDataUnsafe?.user?.id) {
-        loadUserData(tg.initDataUnsafe.user.id);
-    }
-    updateLeaderboard();
-}, 30000);
\ No newline at end of file
+    source.addEventListener('leaderboard', event => renderLeaderboard(JSON.parse(event.data).top));
+    source.addEventListener('delivery', refreshOwnData);
+    source.addEventListener('purchase', refreshOwnData);
+    source.addEventListener('reset', () => {
+        if (tg.initDataUnsafe?.user?.id) {
+            loadUserData(tg.initDataUnsafe.user.id);
+        }
+        updateLeaderboard();
+    });
+} else {
+    // Update stats every 30 seconds
+    setInterval(() => {
+        if (tg.initDataUnsafe?.user?.id) {
+            loadUserData(tg.initDataUnsafe.user.id);
+        }
+        updateLeaderboard();
+    }, 30000);
+}
\ No newline at end of file
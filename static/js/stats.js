@@ -1,33 +1,47 @@
 document.addEventListener('DOMContentLoaded', function() {
     let activityChart = null;
     
-    // Function to update the stats
-    function updateStats() {
-        fetch('/dashboard/api/stats')
+    // Function to update the system stats
+    function updateSystem() {
+        fetch('/dashboard/api/system')
             .then(response => response.json())
             .then(data => {
                 if (data.error) {
-                    console.error('Error fetching stats:', data.error);
+                    console.error('Error fetching system stats:', data.error);
                     return;
                 }
                 
-                // Update system stats
                 const cpuBar = document.getElementById('cpu-usage');
-                cpuBar.style.width = `${data.system.cpu}%`;
-                cpuBar.textContent = `${data.system.cpu}%`;
-                cpuBar.setAttribute('aria-valuenow', data.system.cpu);
+                cpuBar.style.width = `${data.cpu}%`;
+                cpuBar.textContent = `${data.cpu}%`;
+                cpuBar.setAttribute('aria-valuenow', data.cpu);
                 
                 const memoryBar = document.getElementById('memory-usage');
-                memoryBar.style.width = `${data.system.memory}%`;
-                memoryBar.textContent = `${data.system.memory}%`;
-                memoryBar.setAttribute('aria-valuenow', data.system.memory);
+                memoryBar.style.width = `${data.memory}%`;
+                memoryBar.textContent = `${data.memory}%`;
+                memoryBar.setAttribute('aria-valuenow', data.memory);
                 
                 const diskBar = document.getElementById('disk-usage');
-                diskBar.style.width = `${data.system.disk}%`;
-                diskBar.textContent = `${data.system.disk}%`;
-                diskBar.setAttribute('aria-valuenow', data.system.disk);
+                diskBar.style.width = `${data.disk}%`;
+                diskBar.textContent = `${data.disk}%`;
+                diskBar.setAttribute('aria-valuenow', data.disk);
                 
-                document.getElementById('system-uptime').textContent = data.system.uptime;
+                document.getElementById('system-uptime').textContent = data.uptime;
+            })
+            .catch(error => {
+                console.error('Error fetching system stats:', error);
+            });
+    }
+    
+    // Function to update the bot stats (the browser revalidates with the ETag)
+    function updateStats() {
+        fetch('/dashboard/api/stats')
+            .then(response => response.json())
+            .then(data => {
+                if (data.error) {
+                    console.error('Error fetching stats:', data.error);
+                    return;
+                }
                 
                 // Update bot stats
                 document.getElementById('stats-users-count').textContent = data.bot.total_users;
@@ -99,9 +113,50 @@ document.addEventListener('DOMContentLoaded', function() {
         activityChart = new Chart(ctx, config);
     }
     
+    // Function to add a live event to a counter
+    function addToCounter(elementId, delta) {
+        const element = document.getElementById(elementId);
+        const value = parseInt(element.textContent, 10);
+        if (!isNaN(value)) {
+            element.textContent = value + delta;
+        }
+    }
+    
+    // Function to subscribe to live events
+    function connectStream() {
+        const source = new EventSource('/dashboard/stream');
+        
+        source.addEventListener('delivery', event => {
+            const data = JSON.parse(event.data);
+            addToCounter('stats-deliveries-count', data.deliveries);
+            addToCounter('stats-earnings-count', data.earnings);
+        });
+        
+        source.addEventListener('new_user', () => {
+            addToCounter('stats-users-count', 1);
+        });
+        
+        source.addEventListener('purchase', () => {
+            addToCounter('stats-buffs-count', 1);
+        });
+        
+        // Missed events are gone from the server buffer - reload everything
+        source.addEventListener('reset', updateStats);
+    }
+    
     // Initial update
     updateStats();
+    updateSystem();
+    
+    // System stats are refreshed every 30 seconds
+    setInterval(updateSystem, 30000);
     
-    // Auto-refresh every 5 seconds
-    setInterval(updateStats, 5000);
+    if (window.EventSource) {
+        // Bot counters arrive live and are resynced every 30 seconds
+        connectStream();
+        setInterval(updateStats, 30000);
+    } else {
+        // Auto-refresh every 5 seconds
+        setInterval(updateStats, 5000);
+    }
 });
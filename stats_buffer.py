@@ -0,0 +1,148 @@
+"""
+Stats Buffer Module
+
+This module buffers increments to the global statistics in memory and
+flushes them to the database in one atomic UPDATE, either on a timer or
+once enough increments have piled up. This keeps bot workers from
+contending on the single stats row for every delivery.
+"""
+import time
+import atexit
+import logging
+import threading
+from typing import Callable, Dict, Optional
+from config import STATS_FLUSH_INTERVAL, STATS_FLUSH_THRESHOLD
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Counters tracked by the buffer
+COUNTERS = ("new_users", "deliveries", "earnings", "buffs_purchased")
+
+
+class StatsBuffer:
+    """In-process accumulator for stats increments with write-behind flushing."""
+
+    def __init__(self, flush_interval: float = 5, flush_threshold: int = 100):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+
+        self._flush_func = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = dict.fromkeys(COUNTERS, 0)
+        self._pending_events = 0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        # Flush metrics
+        self._flushes = 0
+        self._failed_flushes = 0
+        self._last_flush_at = None
+        self._last_flush_latency = 0.0
+        self._max_flush_latency = 0.0
+        self._total_flush_latency = 0.0
+
+    def start(self, flush_func: Callable[[Dict[str, int]], None]) -> None:
+        """
+        Start the background flusher.
+
+        Args:
+            flush_func: Callable that applies a delta to the database and
+                raises on failure
+        """
+        if self._thread is not None:
+            return
+
+        with self._lock:
+            self._flush_func = flush_func
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def add(self, new_users=0, deliveries=0, earnings=0, buffs_purchased=0) -> None:
+        """Buffer an increment of the global stats."""
+        with self._lock:
+            self._pending["new_users"] += new_users
+            self._pending["deliveries"] += deliveries
+            self._pending["earnings"] += earnings
+            self._pending["buffs_purchased"] += buffs_purchased
+            self._pending_events += 1
+            if self._pending_events >= self.flush_threshold:
+                self._wakeup.set()
+
+    def pending(self) -> Dict[str, int]:
+        """Get the increments that have not been flushed yet."""
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self) -> bool:
+        """
+        Flush buffered increments to the database.
+
+        Returns:
+            bool: False if the flush failed and the delta was kept
+        """
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending_events or self._flush_func is None:
+                    return True
+                delta = self._pending
+                self._pending = dict.fromkeys(COUNTERS, 0)
+                self._pending_events = 0
+
+            started = time.perf_counter()
+            try:
+                self._flush_func(delta)
+            except Exception as e:
+                logger.error(f"Error flushing stats: {e}")
+                # Put the delta back so it is retried on the next flush
+                with self._lock:
+                    for key, value in delta.items():
+                        self._pending[key] += value
+                    self._pending_events += 1
+                    self._failed_flushes += 1
+                return False
+
+            latency = time.perf_counter() - started
+            with self._lock:
+                self._flushes += 1
+                self._last_flush_at = time.time()
+                self._last_flush_latency = latency
+                self._max_flush_latency = max(self._max_flush_latency, latency)
+                self._total_flush_latency += latency
+            return True
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        """Get flush latency metrics."""
+        with self._lock:
+            return {
+                "flushes": self._flushes,
+                "failed_flushes": self._failed_flushes,
+                "pending_events": self._pending_events,
+                "last_flush_at": self._last_flush_at,
+                "last_flush_latency": self._last_flush_latency,
+                "max_flush_latency": self._max_flush_latency,
+                "avg_flush_latency": (
+                    self._total_flush_latency / self._flushes if self._flushes else 0.0
+                )
+            }
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def stop(self) -> None:
+        """Stop the background flusher and flush what is left."""
+        self._stop.set()
+        self._wakeup.set()
+        self.flush()
+
+
+# Shared buffer for the process
+stats_buffer = StatsBuffer(STATS_FLUSH_INTERVAL, STATS_FLUSH_THRESHOLD)
@@ -0,0 +1,147 @@
+"""
+Stats Snapshot Module
+
+This module serves the dashboard stats from a snapshot instead of
+computing them on every request. A background thread refreshes the
+snapshot once per interval while someone is reading it, and goes idle
+when nobody is. Requests that find the snapshot outdated (e.g. after an
+idle period) trigger a refresh themselves; concurrent ones wait for that
+single refresh instead of computing the stats again.
+
+Every snapshot is stored pre-serialized with an ETag, so that clients
+polling with If-None-Match get a 304 until the stats change. The ETag can
+be computed from a part of the payload only (etag_of), so that volatile
+diagnostics in the payload don't change it on every refresh.
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class StatsSnapshot:
+    """Periodically refreshed, single-flight snapshot of a JSON payload."""
+
+    def __init__(self, compute: Callable[[], Dict[str, Any]], interval: float = 2,
+                 idle_timeout: float = 60, name: str = "stats-snapshot",
+                 etag_of: Optional[Callable[[Dict[str, Any]], Any]] = None):
+        """
+        Args:
+            compute: Function building the payload (runs in an app context)
+            interval: Seconds between refreshes
+            idle_timeout: Stop refreshing when nobody read the snapshot for this long
+            etag_of: Part of the payload the ETag is computed from (default: all of it)
+        """
+        self.compute = compute
+        self.etag_of = etag_of
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.name = name
+
+        self._app = None
+        self._lock = threading.Lock()
+        self._done = threading.Condition(self._lock)
+        self._thread = None
+        self._computing = False
+        self._body: Optional[bytes] = None
+        self._etag: Optional[str] = None
+        self._generated_at = 0.0  # monotonic
+        self._last_read = 0.0  # monotonic
+
+        # Metrics
+        self.refreshes = 0
+        self.failures = 0
+        self.coalesced = 0
+        self.served = 0
+        self.last_compute_ms = 0.0
+
+    def init_app(self, app) -> None:
+        """Use the app's context for computing the payload."""
+        self._app = app
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            if time.monotonic() - self._last_read < self.idle_timeout:
+                self.refresh()
+
+    def refresh(self) -> None:
+        """Recompute the snapshot, or wait for the refresh already running."""
+        with self._lock:
+            if self._computing:
+                self.coalesced += 1
+                self._done.wait_for(lambda: not self._computing)
+                return
+            self._computing = True
+
+        body = etag = None
+        started = time.monotonic()
+        try:
+            if self._app is not None:
+                with self._app.app_context():
+                    payload = self.compute()
+            else:
+                payload = self.compute()
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            if self.etag_of is not None:
+                tagged = json.dumps(self.etag_of(payload), sort_keys=True).encode('utf-8')
+            else:
+                tagged = body
+            etag = hashlib.sha1(tagged).hexdigest()[:20]
+        except Exception as e:
+            logger.error(f"{self.name}: error computing snapshot: {e}")
+        finally:
+            with self._lock:
+                self._computing = False
+                self.last_compute_ms = (time.monotonic() - started) * 1000
+                if body is None:
+                    self.failures += 1
+                else:
+                    self.refreshes += 1
+                    self._body, self._etag = body, etag
+                    self._generated_at = time.monotonic()
+                self._done.notify_all()
+
+    def get(self) -> Tuple[bytes, str]:
+        """
+        Get the current snapshot as (JSON body, ETag).
+
+        Raises:
+            RuntimeError: No snapshot could be computed yet
+        """
+        self._last_read = time.monotonic()
+        self._ensure_thread()
+
+        # The background thread keeps it fresh unless it was idle
+        if self._last_read - self._generated_at > self.interval * 2 or self._body is None:
+            self.refresh()
+
+        with self._lock:
+            if self._body is None:
+                raise RuntimeError("Stats snapshot is not available")
+            self.served += 1
+            return self._body, self._etag
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "coalesced": self.coalesced,
+                "served": self.served,
+                "last_compute_ms": round(self.last_compute_ms, 3),
+                "age_seconds": round(time.monotonic() - self._generated_at, 3) if self._body else None
+            }
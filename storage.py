@@ -0,0 +1,586 @@
+"""
+Storage Module
+
+This module defines the storage backend interface the bot handlers use
+(users, buffs, shop, stats, admins) and its implementations:
+
+  - "sqlalchemy": the database through user_data (the default; the web
+    panel, the dashboards and the async runtime need it)
+  - "file": local files without a database server. Records live in
+    memory; every change is appended to a journal as one JSON line and the
+    journals are folded into snapshots in the background (see
+    snapshot_writer.py), so an action costs one short append instead of a
+    rewrite of all users. Only one process may use the files.
+  - "memory": nothing is persisted, for checks and benchmarks
+
+STORAGE_BACKEND selects the backend of get_storage().
+"""
+import os
+import time
+import random
+import logging
+import threading
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+from config import (
+    STORAGE_BACKEND,
+    STORAGE_FILE_DIR,
+    SNAPSHOT_COMPACT_INTERVAL,
+    DELIVERY_COOLDOWN_MINUTES,
+    LEADERBOARD_TOP_SIZE
+)
+from models import db, User, Admin, Stats
+from database import unit_of_work
+from leaderboard import Leaderboard
+from buff_registry import format_buff
+from shop_catalog import load_shop_items
+from snapshot_writer import SnapshotWriter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Cooldown between deliveries
+DELIVERY_COOLDOWN = timedelta(minutes=DELIVERY_COOLDOWN_MINUTES)
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+class StorageBackend(Protocol):
+    """What the handlers need from a storage backend (see user_data for the semantics)."""
+
+    def initialize(self) -> None:
+        """Prepare the storage and load what is kept in memory."""
+
+    def close(self) -> None:
+        """Persist pending changes."""
+
+    # Users
+
+    def get_user_data(self, telegram_id: int) -> Dict[str, Any]:
+        """Get user data (with "active_buffs") or initialize it if it doesn't exist."""
+
+    def can_deliver(self, telegram_id: int) -> Tuple[bool, Optional[timedelta]]:
+        """Check the cooldown: (allowed, time remaining or None)."""
+
+    def deliver(self, telegram_id: int, deliveries: int, earnings: int) -> Dict[str, Any]:
+        """Check the cooldown, apply buffs and record a delivery (result dict of user_data.deliver)."""
+
+    def get_top_users(self, limit: int = 5) -> List[Tuple[int, str, int]]:
+        """Get (position, username, deliveries) of the top users."""
+
+    def get_user_rank(self, telegram_id: int) -> Optional[Dict[str, int]]:
+        """Get "rank", "total" and "deliveries" of a user, None if the user doesn't exist."""
+
+    # Shop and buffs
+
+    def get_shop_item(self, index: int) -> Optional[Dict[str, Any]]:
+        """Get a shop item by position, wrapping around the end."""
+
+    def get_all_shop_items(self) -> List[Dict[str, Any]]:
+        """Get all shop items."""
+
+    def get_shop_items_count(self) -> int:
+        """Get the number of shop items."""
+
+    def purchase_buff(self, telegram_id: int, item_index: int) -> Tuple[bool, str]:
+        """Buy a buff: (success, message for the user)."""
+
+    def get_active_buffs_info(self, telegram_id: int) -> List[Dict[str, Any]]:
+        """Get "name", "bonus" (percent) and "remaining_time" of the active buffs."""
+
+    # Stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get total_users, total_deliveries, total_money and updated_at."""
+
+    def is_bot_active(self) -> bool:
+        """Check whether the bot is switched on."""
+
+    def set_bot_state(self, active: bool) -> bool:
+        """Switch the bot on or off, False on failure."""
+
+    # Admins
+
+    def is_admin(self, telegram_id: int) -> bool:
+        """Check whether a user is an admin."""
+
+    def get_admins(self) -> List[Dict[str, Any]]:
+        """Get telegram_id, name, role and permissions of every admin."""
+
+    def add_admin(self, telegram_id: int, name: str, role: str = "admin",
+                  permissions: Optional[Dict[str, bool]] = None, added_by: Optional[int] = None) -> None:
+        """Add an admin or update an existing one."""
+
+    def remove_admin(self, telegram_id: int) -> bool:
+        """Remove an admin, False if there was none."""
+
+
+class SQLAlchemyStorage:
+    """Storage in the database, through the user_data module."""
+
+    def __init__(self):
+        # Imported here so that the other backends don't create the Flask app and engine
+        import user_data
+        self._user_data = user_data
+
+    def initialize(self) -> None:
+        self._user_data.initialize_database()
+
+    def close(self) -> None:
+        pass
+
+    def get_user_data(self, telegram_id: int) -> Dict[str, Any]:
+        return self._user_data.get_user_data(telegram_id)
+
+    def can_deliver(self, telegram_id: int) -> Tuple[bool, Optional[timedelta]]:
+        return self._user_data.can_deliver(telegram_id)
+
+    def deliver(self, telegram_id: int, deliveries: int, earnings: int) -> Dict[str, Any]:
+        return self._user_data.deliver(telegram_id, deliveries, earnings)
+
+    def get_top_users(self, limit: int = 5) -> List[Tuple[int, str, int]]:
+        return self._user_data.get_top_users(limit)
+
+    def get_user_rank(self, telegram_id: int) -> Optional[Dict[str, int]]:
+        return self._user_data.get_user_rank(telegram_id)
+
+    def get_shop_item(self, index: int) -> Optional[Dict[str, Any]]:
+        return self._user_data.get_shop_item(index)
+
+    def get_all_shop_items(self) -> List[Dict[str, Any]]:
+        return self._user_data.get_all_shop_items()
+
+    def get_shop_items_count(self) -> int:
+        return self._user_data.get_shop_items_count()
+
+    def purchase_buff(self, telegram_id: int, item_index: int) -> Tuple[bool, str]:
+        return self._user_data.purchase_buff(telegram_id, item_index)
+
+    def get_active_buffs_info(self, telegram_id: int) -> List[Dict[str, Any]]:
+        return self._user_data.get_active_buffs_info(telegram_id)
+
+    def is_bot_active(self) -> bool:
+        return self._user_data.is_bot_active()
+
+    def set_bot_state(self, active: bool) -> bool:
+        return self._user_data.set_bot_state(active)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with unit_of_work():
+            stats = Stats.query.first()
+            if not stats:
+                return {"total_users": 0, "total_deliveries": 0, "total_money": 0, "updated_at": None}
+            return {
+                "total_users": stats.total_users,
+                "total_deliveries": stats.total_deliveries,
+                "total_money": stats.total_money,
+                "updated_at": stats.updated_at
+            }
+
+    def is_admin(self, telegram_id: int) -> bool:
+        with unit_of_work():
+            str_telegram_id = str(telegram_id)
+            if db.session.query(Admin.id).filter_by(telegram_id=str_telegram_id).first():
+                return True
+            user = db.session.query(User.id).filter_by(telegram_id=str_telegram_id, is_admin=True).first()
+            return user is not None
+
+    def get_admins(self) -> List[Dict[str, Any]]:
+        with unit_of_work():
+            return [
+                {"telegram_id": admin.telegram_id, "name": admin.name,
+                 "role": admin.role, "permissions": admin.permissions}
+                for admin in Admin.query.order_by(Admin.id)
+            ]
+
+    def add_admin(self, telegram_id: int, name: str, role: str = "admin",
+                  permissions: Optional[Dict[str, bool]] = None, added_by: Optional[int] = None) -> None:
+        with unit_of_work():
+            admin = Admin.query.filter_by(telegram_id=str(telegram_id)).first()
+            if not admin:
+                admin = Admin(telegram_id=str(telegram_id), added_by=str(added_by or ""), added_at=time.time())
+                db.session.add(admin)
+            admin.name = name
+            admin.role = role
+            admin.permissions = permissions or {}
+            db.session.commit()
+
+    def remove_admin(self, telegram_id: int) -> bool:
+        with unit_of_work():
+            deleted = Admin.query.filter_by(telegram_id=str(telegram_id)).delete()
+            db.session.commit()
+            return bool(deleted)
+
+
+class MemoryStorage:
+    """Storage in dicts of this process."""
+
+    def __init__(self, shop_items: Optional[List[Dict[str, Any]]] = None):
+        self._lock = threading.RLock()
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._stats = {"total_users": 0, "total_deliveries": 0, "total_money": 0,
+                       "buffs_purchased": 0, "updated_at": time.time(), "is_disabled": False}
+        self._admins: Dict[str, Dict[str, Any]] = {}
+        self._shop_items = shop_items
+        self._next_id = 1
+        self._next_buff_id = 1
+        self.leaderboard = Leaderboard(LEADERBOARD_TOP_SIZE)
+        self.leaderboard.build([])
+
+    # Persistence hooks of FileStorage
+
+    def _user_changed(self, telegram_id: str, delta: Dict[str, Any]) -> None:
+        pass
+
+    def _stats_changed(self) -> None:
+        pass
+
+    def _admin_changed(self, telegram_id: str, admin: Optional[Dict[str, Any]]) -> None:
+        pass
+
+    def initialize(self) -> None:
+        if self._shop_items is None:
+            self._shop_items = load_shop_items()
+        with self._lock:
+            self.leaderboard.build(self._users.values())
+
+    def close(self) -> None:
+        pass
+
+    # Users
+
+    def _get_or_create(self, telegram_id: str, now: float) -> Tuple[Dict[str, Any], bool]:
+        """Get a user record, creating it if needed (called with the lock held)."""
+        user = self._users.get(telegram_id)
+        if user is not None:
+            return user, False
+
+        user = self._users[telegram_id] = {
+            "id": self._next_id,
+            "telegram_id": telegram_id,
+            "username": f"Курьер {telegram_id[-4:]}",
+            "deliveries": 0,
+            "money": 0,
+            "experience": 0,
+            "last_delivery": 0,
+            "blocked": False,
+            "created_at": now,
+            "is_admin": False,
+            "buffs": []
+        }
+        self._next_id += 1
+        self._stats["total_users"] += 1
+        self._stats["updated_at"] = now
+        self.leaderboard.add_user(user["id"], telegram_id, user["username"])
+        self._user_changed(telegram_id, dict(user))
+        self._stats_changed()
+        return user, True
+
+    @staticmethod
+    def _active_buffs(user: Dict[str, Any], now: float) -> List[Dict[str, Any]]:
+        # Expired buffs are skipped on read and dropped on the next purchase
+        return [buff for buff in user["buffs"] if buff["expires_at"] > now]
+
+    def get_user_data(self, telegram_id: int) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            user, _ = self._get_or_create(str(telegram_id), now)
+            user_data = {key: value for key, value in user.items() if key != "buffs"}
+            user_data["active_buffs"] = [format_buff(buff) for buff in self._active_buffs(user, now)]
+            return user_data
+
+    def can_deliver(self, telegram_id: int) -> Tuple[bool, Optional[timedelta]]:
+        with self._lock:
+            user = self._users.get(str(telegram_id))
+            if user is None:
+                return True, None
+            if user["blocked"]:
+                return False, None
+            time_passed = timedelta(seconds=time.time() - user["last_delivery"])
+            if user["last_delivery"] and time_passed < DELIVERY_COOLDOWN:
+                return False, DELIVERY_COOLDOWN - time_passed
+            return True, None
+
+    def deliver(self, telegram_id: int, deliveries: int, earnings: int) -> Dict[str, Any]:
+        str_telegram_id = str(telegram_id)
+        now = time.time()
+
+        result = {
+            "delivered": False,
+            "blocked": False,
+            "time_remaining": None,
+            "original_earnings": earnings,
+            "buffed_earnings": 0,
+            "experience_gained": 0
+        }
+
+        with self._lock:
+            user, _ = self._get_or_create(str_telegram_id, now)
+
+            # Check if user is blocked
+            if user["blocked"]:
+                result["blocked"] = True
+                return result
+
+            # Check cooldown
+            if user["last_delivery"]:
+                time_passed = timedelta(seconds=now - user["last_delivery"])
+                if time_passed < DELIVERY_COOLDOWN:
+                    result["time_remaining"] = DELIVERY_COOLDOWN - time_passed
+                    return result
+
+            # Calculate earnings with active buffs
+            multiplier = sum(buff["bonus"] for buff in self._active_buffs(user, now))
+            buffed_earnings = int(earnings * (1 + multiplier))
+            experience_gained = random.randint(1, 3)  # Random experience gain
+
+            old_deliveries = user["deliveries"]
+            user["deliveries"] += deliveries
+            user["money"] += buffed_earnings
+            user["experience"] += experience_gained
+            user["last_delivery"] = now
+            self._user_changed(str_telegram_id, {
+                "deliveries": user["deliveries"],
+                "money": user["money"],
+                "experience": user["experience"],
+                "last_delivery": now
+            })
+
+            # Update stats and the leaderboard
+            self._stats["total_deliveries"] += deliveries
+            self._stats["total_money"] += buffed_earnings
+            self._stats["updated_at"] = now
+            self._stats_changed()
+            self.leaderboard.record_delivery(
+                user["id"], str_telegram_id, user["username"], old_deliveries, user["deliveries"]
+            )
+
+            result.update({
+                "delivered": True,
+                "buffed_earnings": buffed_earnings,
+                "experience_gained": experience_gained,
+                "username": user["username"],
+                "deliveries": user["deliveries"],
+                "money": user["money"],
+                "experience": user["experience"]
+            })
+            return result
+
+    def get_top_users(self, limit: int = 5) -> List[Tuple[int, str, int]]:
+        return [
+            (i + 1, user["username"], user["deliveries"])
+            for i, user in enumerate(self.leaderboard.top(limit))
+        ]
+
+    def get_user_rank(self, telegram_id: int) -> Optional[Dict[str, int]]:
+        with self._lock:
+            user = self._users.get(str(telegram_id))
+            if user is None:
+                return None
+            deliveries = user["deliveries"]
+        rank, total = self.leaderboard.rank(deliveries)
+        return {"rank": rank, "total": total, "deliveries": deliveries}
+
+    # Shop and buffs
+
+    def get_shop_item(self, index: int) -> Optional[Dict[str, Any]]:
+        items = self._shop_items or []
+        return dict(items[index % len(items)]) if items else None
+
+    def get_all_shop_items(self) -> List[Dict[str, Any]]:
+        return [dict(item) for item in self._shop_items or []]
+
+    def get_shop_items_count(self) -> int:
+        return len(self._shop_items or [])
+
+    def purchase_buff(self, telegram_id: int, item_index: int) -> Tuple[bool, str]:
+        str_telegram_id = str(telegram_id)
+        now = time.time()
+
+        with self._lock:
+            user = self._users.get(str_telegram_id)
+            if user is None:
+                return False, "❌ Пользователь не найден."
+
+            # Get shop item
+            item_data = self.get_shop_item(item_index)
+            if not item_data:
+                return False, "❌ Предмет не найден."
+
+            # Check if user has enough money
+            if user["money"] < item_data["price"]:
+                return False, f"❌ Недостаточно денег! Нужно: {item_data['price']} руб."
+
+            # Subtract cost and add the buff
+            user["money"] -= item_data["price"]
+            user["buffs"] = self._active_buffs(user, now) + [{
+                "id": self._next_buff_id,
+                "user_id": user["id"],
+                "buff_type": item_data["item_id"],
+                "name": item_data["name"],
+                "bonus": item_data["bonus"],
+                "expires_at": now + item_data["duration"] * 60,
+                "created_at": now
+            }]
+            self._next_buff_id += 1
+            self._user_changed(str_telegram_id, {"money": user["money"], "buffs": user["buffs"]})
+
+            self._stats["buffs_purchased"] += 1
+            self._stats_changed()
+
+        return True, f"✅ Вы приобрели {item_data['name']} на {item_data['duration']} минут!"
+
+    def get_active_buffs_info(self, telegram_id: int) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            user = self._users.get(str(telegram_id))
+            buffs = self._active_buffs(user, now) if user else []
+
+        buff_info = []
+        for buff in buffs:
+            remaining_seconds = max(0, int(buff["expires_at"] - now))
+            minutes, seconds = divmod(remaining_seconds, 60)
+            buff_info.append({
+                "name": buff["name"],
+                "bonus": int(buff["bonus"] * 100),
+                "remaining_time": f"{minutes}м {seconds}с"
+            })
+        return buff_info
+
+    # Stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total_users": self._stats["total_users"],
+                "total_deliveries": self._stats["total_deliveries"],
+                "total_money": self._stats["total_money"],
+                "updated_at": self._stats["updated_at"]
+            }
+
+    def is_bot_active(self) -> bool:
+        return not self._stats["is_disabled"]
+
+    def set_bot_state(self, active: bool) -> bool:
+        with self._lock:
+            self._stats["is_disabled"] = not active
+            self._stats_changed()
+        return True
+
+    # Admins
+
+    def is_admin(self, telegram_id: int) -> bool:
+        str_telegram_id = str(telegram_id)
+        with self._lock:
+            user = self._users.get(str_telegram_id)
+            return str_telegram_id in self._admins or bool(user and user["is_admin"])
+
+    def get_admins(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"telegram_id": telegram_id, "name": admin["name"],
+                 "role": admin["role"], "permissions": dict(admin["permissions"])}
+                for telegram_id, admin in self._admins.items()
+            ]
+
+    def add_admin(self, telegram_id: int, name: str, role: str = "admin",
+                  permissions: Optional[Dict[str, bool]] = None, added_by: Optional[int] = None) -> None:
+        str_telegram_id = str(telegram_id)
+        with self._lock:
+            admin = self._admins.setdefault(str_telegram_id, {
+                "added_by": str(added_by or ""),
+                "added_at": time.time()
+            })
+            admin.update(name=name, role=role, permissions=permissions or {})
+            self._admin_changed(str_telegram_id, admin)
+
+    def remove_admin(self, telegram_id: int) -> bool:
+        str_telegram_id = str(telegram_id)
+        with self._lock:
+            if self._admins.pop(str_telegram_id, None) is None:
+                return False
+            self._admin_changed(str_telegram_id, None)
+            return True
+
+
+class FileStorage(MemoryStorage):
+    """MemoryStorage persisted to journals and snapshots in a directory."""
+
+    def __init__(self, directory: str = STORAGE_FILE_DIR, compact_interval: float = SNAPSHOT_COMPACT_INTERVAL,
+                 shop_items: Optional[List[Dict[str, Any]]] = None):
+        super().__init__(shop_items)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        # One journal and snapshot per collection
+        self._writers = {
+            name: SnapshotWriter(
+                os.path.join(directory, f"{name}.json"),
+                os.path.join(directory, f"{name}.log"),
+                compact_interval=compact_interval
+            )
+            for name in ("users", "stats", "admins")
+        }
+
+    def initialize(self) -> None:
+        with self._lock:
+            self._users = self._writers["users"].load()
+            self._stats.update(self._writers["stats"].load().get("stats", {}))
+            self._admins = self._writers["admins"].load()
+
+            # Continue the ids after the loaded records
+            self._next_id = max((user["id"] for user in self._users.values()), default=0) + 1
+            self._next_buff_id = max(
+                (buff["id"] for user in self._users.values() for buff in user.get("buffs", [])), default=0
+            ) + 1
+            for user in self._users.values():
+                user.setdefault("buffs", [])
+        logger.info(f"File storage loaded {len(self._users)} users from {self.directory}")
+        super().initialize()
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+
+    def compact(self) -> None:
+        """Fold the journals into the snapshots now."""
+        for writer in self._writers.values():
+            writer.compact()
+
+    def _user_changed(self, telegram_id: str, delta: Dict[str, Any]) -> None:
+        self._writers["users"].record(telegram_id, delta)
+
+    def _stats_changed(self) -> None:
+        self._writers["stats"].record("stats", self._stats)
+
+    def _admin_changed(self, telegram_id: str, admin: Optional[Dict[str, Any]]) -> None:
+        if admin is None:
+            self._writers["admins"].delete(telegram_id)
+        else:
+            self._writers["admins"].record(telegram_id, admin)
+
+
+BACKENDS = {
+    "sqlalchemy": SQLAlchemyStorage,
+    "file": FileStorage,
+    "memory": MemoryStorage
+}
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> StorageBackend:
+    """Create a storage backend by name (not initialized)."""
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def get_storage() -> StorageBackend:
+    """Get the storage backend of the process (STORAGE_BACKEND), created on first use."""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
@@ -13,28 +13,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def create_telegram_bot():
+    """Create the bot instance with all handlers registered, or None without a token."""
+    # Get token from environment
+    token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    
+    if not token:
+        logger.error("No Telegram bot token found!")
+        return None
+    
+    # Create bot instance (the dispatcher runs handlers on its own workers)
+    bot = telebot.TeleBot(token, threaded=False)
+    
+    # Register all handlers
+    from telegram_bot.handlers import register_handlers
+    register_handlers(bot)
+    
+    # Log successful initialization
+    logger.info("Telegram bot initialized successfully")
+    return bot
+
+def setup_telegram_webhook(app):
+    """Receive bot updates through a webhook served by the given Flask app."""
+    try:
+        bot = create_telegram_bot()
+        if bot:
+            from webhook import setup_webhook
+            setup_webhook(bot, app)
+    except Exception as e:
+        logger.error(f"Error setting up Telegram webhook: {e}")
+
 def run_telegram_bot():
     """Initialize and run the Telegram bot."""
     try:
-        # Get token from environment
-        token = os.environ.get("TELEGRAM_BOT_TOKEN")
-        
-        if not token:
-            logger.error("No Telegram bot token found!")
+        bot = create_telegram_bot()
+        if not bot:
             return
         
-        # Create bot instance
-        bot = telebot.TeleBot(token)
-        
-        # Register all handlers
-        from telegram_bot.handlers import register_handlers
-        register_handlers(bot)
-        
-        # Log successful initialization
-        logger.info("Telegram bot initialized successfully")
-        
         # Start polling
-        bot.infinity_polling(timeout=60)
+        from dispatcher import poll_updates
+        poll_updates(bot)
         
     except Exception as e:
         logger.error(f"Error initializing Telegram bot: {e}")
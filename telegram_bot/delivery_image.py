@@ -1,11 +1,23 @@
 """
 Module for generating delivery images.
+
+Each (background, caption) variant is rendered once and the encoded JPEG
+is kept in an in-memory LRU cache keyed by content hash, so deliveries can
+stream the image to send_photo without touching PIL or the disk.
 """
+import io
 import os
+import time
 import random
 from PIL import Image, ImageDraw, ImageFont
-from datetime import datetime
 import logging
+from image_cache import ImageCache, content_hash, file_digest, as_upload, sweep_directory
+from config import (
+    IMAGE_CACHE_MAX_BYTES,
+    DELIVERY_IMAGES_MAX_BYTES,
+    DELIVERY_IMAGES_MAX_AGE_HOURS,
+    DELIVERY_IMAGES_SWEEP_INTERVAL
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -14,106 +26,173 @@ logger = logging.getLogger(__name__)
 ASSETS_DIR = 'assets'
 OUTPUT_DIR = os.path.join('static', 'images', 'deliveries')
 
+# Default caption drawn on the image
+DEFAULT_TEXT = "Доставка завершена!"
+
 # Ensure output directory exists
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# Rendered images, keyed by content hash of (background, caption)
+_image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES)
+_last_sweep = 0.0
+
+def _pick_background():
+    """Pick a background image path, or None if there is none."""
+    # Use default delivery background if available
+    background_path = os.path.join(ASSETS_DIR, 'delivery_default.svg')
+    if os.path.exists(background_path):
+        return background_path
+
+    # If SVG not found, look for JPG/PNG backgrounds
+    delivery_images = []
+    if os.path.exists(ASSETS_DIR):
+        delivery_images = [
+            os.path.join(ASSETS_DIR, f) for f in os.listdir(ASSETS_DIR)
+            if f.lower().endswith(('.png', '.jpg', '.jpeg')) and 'delivery' in f.lower()
+        ]
+
+    # If we found images, pick one randomly
+    if delivery_images:
+        return random.choice(delivery_images)
+    return None
+
+def _encode(img):
+    """Encode a PIL image as JPEG bytes."""
+    buffer = io.BytesIO()
+    img.convert('RGB').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+def _load_font():
+    # Try to load a font, use default if not available
+    try:
+        return ImageFont.load_default()
+    except Exception:
+        return None
+
+def _render_background(background_path, text):
+    """Render text over a background image."""
+    try:
+        img = Image.open(background_path)
+
+        # Resize to a reasonable size
+        max_size = (800, 600)
+        img.thumbnail(max_size)
+
+        # Add text overlay
+        draw = ImageDraw.Draw(img)
+        font = _load_font()
+        text_width = draw.textlength(text, font=font) if font else 200
+
+        # Position text at the bottom center
+        position = ((img.width - text_width) // 2, img.height - 50)
+
+        # Draw text with shadow for visibility
+        draw.text((position[0]+2, position[1]+2), text, font=font, fill=(0, 0, 0))
+        draw.text(position, text, font=font, fill=(255, 255, 255))
+
+        return _encode(img)
+    except Exception as e:
+        logger.error(f"Error processing image {background_path}: {e}")
+        # Cached under the background's key, so a broken file is only tried once
+        return _render_simple(text)
+
+def _render_simple(text):
+    """Render a simple image with text when no background is available."""
+    # Create a new image with a solid background
+    width, height = 600, 400
+    img = Image.new('RGB', (width, height), color=(53, 57, 68))
+
+    # Add text
+    draw = ImageDraw.Draw(img)
+    font = _load_font()
+
+    # Draw text
+    text_width = draw.textlength(text, font=font) if font else 200
+    position = ((width - text_width) // 2, height // 2)
+
+    # Draw with a white color
+    draw.text(position, text, font=font, fill=(255, 255, 255))
+
+    return _encode(img)
+
+def render_delivery_image(text=DEFAULT_TEXT):
+    """
+    Get the encoded delivery image, rendering it on first use.
+
+    Returns:
+        Tuple of (cache key, JPEG bytes)
+    """
+    background_path = _pick_background()
+
+    if background_path:
+        key = content_hash("background", file_digest(background_path), text)
+        data = _image_cache.get_or_render(key, lambda: _render_background(background_path, text))
+    else:
+        key = content_hash("simple", text)
+        data = _image_cache.get_or_render(key, lambda: _render_simple(text))
+
+    return key, data
+
+def get_delivery_photo(text=DEFAULT_TEXT):
+    """Returns a delivery image as an in-memory file for send_photo."""
+    try:
+        key, data = render_delivery_image(text)
+        return as_upload(data, f"delivery_{key[:16]}.jpg")
+    except Exception as e:
+        logger.error(f"Error in get_delivery_photo: {e}")
+        return None
+
 def create_delivery_image():
     """Returns path to a delivery image."""
     try:
-        # Use default delivery background if available
-        background_path = os.path.join(ASSETS_DIR, 'delivery_default.svg')
-        
-        # If SVG not found, look for JPG/PNG backgrounds
-        if not os.path.exists(background_path):
-            delivery_images = []
-            if os.path.exists(ASSETS_DIR):
-                delivery_images = [
-                    os.path.join(ASSETS_DIR, f) for f in os.listdir(ASSETS_DIR)
-                    if f.lower().endswith(('.png', '.jpg', '.jpeg')) and 'delivery' in f.lower()
-                ]
-            
-            # If we found images, pick one randomly
-            if delivery_images:
-                background_path = random.choice(delivery_images)
-            else:
-                # Create a simple image with text
-                return create_simple_image("Доставка завершена!")
-        
-        # Create a new file name with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_path = os.path.join(OUTPUT_DIR, f'delivery_{timestamp}.jpg')
-        
-        # Load and process the image
-        try:
-            img = Image.open(background_path)
-            
-            # Resize to a reasonable size
-            max_size = (800, 600)
-            img.thumbnail(max_size)
-            
-            # Add text overlay
-            draw = ImageDraw.Draw(img)
-            
-            # Try to load a font, use default if not available
-            try:
-                font = ImageFont.load_default()
-            except Exception:
-                font = None
-            
-            # Add text
-            text = "Доставка завершена!"
-            text_width = draw.textlength(text, font=font) if font else 200
-            
-            # Position text at the bottom center
-            position = ((img.width - text_width) // 2, img.height - 50)
-            
-            # Draw text with shadow for visibility
-            draw.text((position[0]+2, position[1]+2), text, font=font, fill=(0, 0, 0))
-            draw.text(position, text, font=font, fill=(255, 255, 255))
-            
-            # Save the image
-            img.save(output_path)
-            
-            return output_path
-        except Exception as e:
-            logger.error(f"Error processing image {background_path}: {e}")
-            return create_simple_image("Доставка завершена!")
-    
+        key, data = render_delivery_image()
+
+        # Content-addressed file name: written once, never collides
+        output_path = os.path.join(OUTPUT_DIR, f'delivery_{key[:16]}.jpg')
+        if not os.path.exists(output_path):
+            tmp_path = output_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, output_path)
+        else:
+            # Mark as recently used so the sweeper keeps it
+            os.utime(output_path)
+
+        _sweep_output_dir()
+        return output_path
     except Exception as e:
         logger.error(f"Error in create_delivery_image: {e}")
-        return create_simple_image("Доставка завершена!")
+        return None
 
 def create_simple_image(text):
     """Create a simple image with text when no background is available."""
     try:
-        # Create a timestamp for the filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        output_path = os.path.join(OUTPUT_DIR, f'simple_delivery_{timestamp}.jpg')
-        
-        # Create a new image with a solid background
-        width, height = 600, 400
-        img = Image.new('RGB', (width, height), color=(53, 57, 68))
-        
-        # Add text
-        draw = ImageDraw.Draw(img)
-        
-        # Try to load a font, use default if not available
-        try:
-            font = ImageFont.load_default()
-        except Exception:
-            font = None
-        
-        # Draw text
-        text_width = draw.textlength(text, font=font) if font else 200
-        position = ((width - text_width) // 2, height // 2)
-        
-        # Draw with a white color
-        draw.text(position, text, font=font, fill=(255, 255, 255))
-        
-        # Save the image
-        img.save(output_path)
-        
+        key = content_hash("simple", text)
+        data = _image_cache.get_or_render(key, lambda: _render_simple(text))
+
+        output_path = os.path.join(OUTPUT_DIR, f'simple_delivery_{key[:16]}.jpg')
+        if not os.path.exists(output_path):
+            with open(output_path, 'wb') as f:
+                f.write(data)
+
         return output_path
     except Exception as e:
         logger.error(f"Error creating simple image: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def _sweep_output_dir():
+    """Delete old generated images, at most once per sweep interval."""
+    global _last_sweep
+
+    now = time.time()
+    if now - _last_sweep < DELIVERY_IMAGES_SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+
+    deleted = sweep_directory(
+        OUTPUT_DIR,
+        DELIVERY_IMAGES_MAX_BYTES,
+        DELIVERY_IMAGES_MAX_AGE_HOURS * 3600
+    )
+    if deleted:
+        logger.info(f"Deleted {deleted} old delivery images")
@@ -5,19 +5,23 @@ import logging
 import random
 import time
 import os
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Dict, List, Tuple, Optional, Any
 import telebot
 from telebot import types
 from app import app
+from database import unit_of_work
 from models import User, Buff, ShopItem, db
+from leaderboard import leaderboard
+from shop_catalog import shop_catalog
+from cooldown import cooldown_cache
+from buff_registry import buff_registry
+from user_data import deliver
+from tracing import tracer
 
 # Set up logging
 logger = logging.getLogger(__name__)
 
-# Cache for shop item positions per user
-shop_positions = {}
-
 def register_handlers(bot):
     """
     Registers all handlers for bot commands.
@@ -83,6 +87,9 @@ def register_handlers(bot):
                     reply_markup=get_shop_nav_keyboard(item_index)
                 )
 
+    # Run every handler and Bot API call in a span (see tracing.py)
+    tracer.instrument_bot(bot)
+
 def process_name_change(message, bot):
     """Process the name change request."""
     new_name = message.text.strip()
@@ -92,7 +99,7 @@ def process_name_change(message, bot):
         return
 
     # Update user data with new name
-    with app.app_context():
+    with unit_of_work():
         user = get_or_create_user(message.from_user.id)
         user.username = new_name
         db.session.commit()
@@ -106,7 +113,7 @@ def start_command(message, bot):
     """Handle the /start command."""
     user_id = message.from_user.id
 
-    with app.app_context():
+    with unit_of_work():
         # Get or create user
         user = get_or_create_user(user_id)
 
@@ -127,13 +134,6 @@ def start_command(message, bot):
             types.KeyboardButton("Разносить посылки"),
             types.KeyboardButton("Мой профиль")
         )
-        markup.add(
-            types.KeyboardButton("Лучшие курьеры"),
-            types.KeyboardButton("Магазин")
-        )
-            types.KeyboardButton("Разносить посылки"),
-            types.KeyboardButton("Мой профиль")
-        )
         markup.add(
             types.KeyboardButton("Лучшие курьеры"),
             types.KeyboardButton("Магазин")
@@ -172,7 +172,7 @@ def raznos_command(message, bot):
     """Handle the /raznos command."""
     user_id = message.from_user.id
 
-    # Check if user can make a delivery (2-minute cooldown)
+    # Reject cooldowns and blocked users early from the cache
     can_do, time_remaining = can_deliver(user_id)
 
     if not can_do:
@@ -194,58 +194,76 @@ def raznos_command(message, bot):
     earnings = random.randint(100, 300)
     deliveries = 1
 
-    # Update user data (+1 delivery, +earnings money)
-    original_earnings, buffed_earnings = update_user_data(user_id, deliveries, earnings)
+    # Deliver under the user row lock (the cache above only rejects early)
+    result = deliver(user_id, deliveries, earnings)
 
-    with app.app_context():
-        user = get_or_create_user(user_id)
+    if not result["delivered"]:
+        if result["time_remaining"]:
+            minutes, seconds = divmod(result["time_remaining"].seconds, 60)
+            bot.reply_to(
+                message,
+                f"⏱ Вы недавно доставляли посылку! Следующая доставка будет доступна через "
+                f"{minutes} мин. {seconds} сек."
+            )
+        else:
+            bot.reply_to(
+                message,
+                f"⛔ Вы заблокированы и не можете делать доставки."
+            )
+        return
 
-        # Prepare caption for the delivery image
-        caption = (
-            f"🚚 Доставка завершена!\n\n"
-            f"💰 Заработано: {buffed_earnings} руб.\n"
-            f"📦 Всего доставлено: {user.deliveries} шт.\n\n"
-        )
+    original_earnings = result["original_earnings"]
+    buffed_earnings = result["buffed_earnings"]
 
-        # Add buff message if there was a bonus
-        if buffed_earnings > original_earnings:
-            caption += f"🔮 Бонус от баффов: +{buffed_earnings - original_earnings} руб.\n\n"
+    # Prepare caption for the delivery image
+    caption = (
+        f"🚚 Доставка завершена!\n\n"
+        f"💰 Заработано: {buffed_earnings} руб.\n"
+        f"📦 Всего доставлено: {result['deliveries']} шт.\n\n"
+    )
 
-        caption += f"💵 Баланс: {user.money} руб.\n"
+    # Add buff message if there was a bonus
+    if buffed_earnings > original_earnings:
+        caption += f"🔮 Бонус от баффов: +{buffed_earnings - original_earnings} руб.\n\n"
 
-        # Send delivery message
-        bot.send_message(
-            message.chat.id,
-            caption,
-            parse_mode='HTML'
-        )
+    caption += f"💵 Баланс: {result['money']} руб.\n"
+
+    # Send delivery message
+    bot.send_message(
+        message.chat.id,
+        caption,
+        parse_mode='HTML'
+    )
 
 def top_command(message, bot):
     """Handle the /top command."""
-    with app.app_context():
+    with unit_of_work():
+        leaderboard.ensure_loaded()
+        leaderboard.start_reconciler(app)
+        
         # Get top 5 users
-        top_users = User.query.order_by(User.deliveries.desc()).limit(5).all()
+        top_users = leaderboard.top(5)
 
         # Build leaderboard message
-        leaderboard = "🏆 Лучшие курьеры 📦\n\n"
+        leaderboard_text = "🏆 Лучшие курьеры 📦\n\n"
 
         medals = ["🥇", "🥈", "🥉"]
 
         for i, user in enumerate(top_users):
             if i < 3:
                 # Top 3 get medal emojis
-                leaderboard += f"{medals[i]} {user.username} - {user.deliveries} доставок\n"
+                leaderboard_text += f"{medals[i]} {user['username']} - {user['deliveries']} доставок\n"
             else:
                 # Rest get numerical position
-                leaderboard += f"{i + 1}. {user.username} - {user.deliveries} доставок\n"
+                leaderboard_text += f"{i + 1}. {user['username']} - {user['deliveries']} доставок\n"
 
         # If there are fewer than 5 users, the message will be shorter
         if not top_users:
-            leaderboard += "🤷‍♂️ Пока нет данных о курьерах! 🤷‍♀️"
+            leaderboard_text += "🤷‍♂️ Пока нет данных о курьерах! 🤷‍♀️"
 
         bot.send_message(
             message.chat.id,
-            leaderboard,
+            leaderboard_text,
             parse_mode='HTML'
         )
 
@@ -257,7 +275,7 @@ def profile_command_internal(message, bot):
     """Internal implementation of profile command to be reused."""
     user_id = message.from_user.id
 
-    with app.app_context():
+    with unit_of_work():
         user = get_or_create_user(user_id)
 
         # Get active buffs
@@ -302,7 +320,7 @@ def shop_command(message, bot):
 
 def show_shop_item(chat_id, user_id, item_index, message_id, bot):
     """Display a shop item with navigation buttons."""
-    with app.app_context():
+    with unit_of_work():
         # Get all active shop items
         items = ShopItem.query.filter_by(is_active=True).all()
 
@@ -379,7 +397,7 @@ def admin_command(message, bot):
     """Handle the /adm command for admin panel."""
     user_id = message.from_user.id
 
-    with app.app_context():
+    with unit_of_work():
         # Check if user is admin
         user = get_or_create_user(user_id)
 
@@ -460,102 +478,25 @@ def get_or_create_user(telegram_id):
     return user
 
 def can_deliver(telegram_id):
-    """Check if a user can make a delivery (2-minute cooldown)."""
-    with app.app_context():
-        try:
-            # Convert to string for database lookup
-            str_telegram_id = str(telegram_id)
-
-            # Get user from database
-            user = User.query.filter_by(telegram_id=str_telegram_id).first()
-
-            if not user or not user.last_delivery:
-                return True, None
-
-            # Check if user is blocked
-            if user.blocked:
-                return False, None
-
-            # Check cooldown
-            cooldown = timedelta(minutes=2)
-            last_delivery_time = datetime.fromtimestamp(user.last_delivery)
-            now = datetime.now()
-            time_passed = now - last_delivery_time
-
-            if time_passed < cooldown:
-                time_remaining = cooldown - time_passed
-                return False, time_remaining
-
-            return True, None
-
-        except Exception as e:
-            logger.error(f"Error checking delivery cooldown: {e}")
-            return True, None
-
-def update_user_data(telegram_id, deliveries, earnings):
-    """
-    Update user data after a delivery.
-
-    Returns:
-        Tuple of (original_earnings, buffed_earnings)
-    """
-    with app.app_context():
-        try:
-            # Get user data
-            user = get_or_create_user(telegram_id)
-
-            # Calculate earnings with active buffs
-            multiplier = get_active_earnings_multiplier(telegram_id)
-            original_earnings = earnings
-            buffed_earnings = int(earnings * (1 + multiplier))
-
-            # Update user data
-            user.deliveries += deliveries
-            user.money += buffed_earnings
-            user.experience += random.randint(1, 3)  # Random experience
-            user.last_delivery = time.time()
-
-            # Save to database
-            db.session.commit()
-
-            return original_earnings, buffed_earnings
-
-        except Exception as e:
-            logger.error(f"Error updating user data: {e}")
-            db.session.rollback()
-            return earnings, earnings
-
-def get_active_earnings_multiplier(telegram_id):
-    """
-    Calculate the total earnings multiplier from all active buffs.
-
-    Returns:
-        Float multiplier (e.g., 0.25 for 25% increase)
-    """
-    with app.app_context():
-        try:
-            # Get user
-            user = get_or_create_user(telegram_id)
-
-            # Get active buffs
-            now = time.time()
-            active_buffs = Buff.query.filter(
-                Buff.user_id == user.id,
-                Buff.expires_at > now
-            ).all()
-
-            # Calculate total multiplier
-            total_multiplier = sum(buff.bonus for buff in active_buffs)
-
-            return total_multiplier
-
-        except Exception as e:
-            logger.error(f"Error calculating active earnings multiplier: {e}")
-            return 0.0
+    """Check if a user can make a delivery (answered from the cooldown cache)."""
+    try:
+        if cooldown_cache.is_stale():
+            with unit_of_work():
+                cooldown_cache.reload()
+    except Exception as e:
+        logger.error(f"Error checking delivery cooldown: {e}")
+        return True, None
+
+    blocked, remaining = cooldown_cache.check(str(telegram_id))
+    if blocked:
+        return False, None
+    if remaining:
+        return False, timedelta(seconds=remaining)
+    return True, None
 
 def get_active_buffs(telegram_id):
     """Get active buffs for a user."""
-    with app.app_context():
+    with unit_of_work():
         user = get_or_create_user(telegram_id)
         now = time.time()
 
@@ -571,7 +512,7 @@ def purchase_buff(telegram_id, item_index):
     Returns:
         Tuple of (success, message)
     """
-    with app.app_context():
+    with unit_of_work():
         try:
             # Get user
             user = get_or_create_user(telegram_id)
@@ -613,6 +554,10 @@ def purchase_buff(telegram_id, item_index):
             db.session.add(buff)
             db.session.commit()
 
+            # deliver() takes the multiplier from the buff registry
+            if buff_registry.loaded:
+                buff_registry.add(user.telegram_id, buff)
+
             return True, f"✅ Вы приобрели {item.name} на {item.duration} минут!"
 
         except Exception as e:
@@ -622,7 +567,7 @@ def purchase_buff(telegram_id, item_index):
 
 def init_default_shop_items():
     """Initialize default shop items if none exist."""
-    with app.app_context():
+    with unit_of_work():
         # Check if items already exist
         if ShopItem.query.count() > 0:
             return
@@ -661,4 +606,5 @@ def init_default_shop_items():
             db.session.add(item)
 
         db.session.commit()
+        shop_catalog.invalidate()
         logger.info("Default shop items initialized")
\ No newline at end of file
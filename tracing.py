@@ -0,0 +1,431 @@
+"""
+Tracing Module
+
+This module shows where the time of a bot update or a web request goes.
+Every update runs in a root span (see dispatcher.create_dispatcher), and
+so does every request of the Flask app. The handlers registered on the bot,
+its Bot API calls and the delivery image run in child spans. SQL statements
+are counted and timed through SQLAlchemy cursor events and charged to the
+current span and its root. A root that ran the same statement
+N_PLUS_ONE_THRESHOLD times or more is logged as a possible N+1 query.
+
+Span durations, queries and SQL time per update or request are kept in
+histograms and served as Prometheus text on /metrics (to the admin session,
+or with the webhook secret token header). With
+TRACE_EXPORT_FILE set, every finished trace is also appended to that file
+as OpenTelemetry-style JSON spans, one per line.
+"""
+import os
+import hmac
+import json
+import time
+import logging
+import functools
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+from flask import Response, abort, current_app, g, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from dispatcher import Histogram
+from database import pool_metrics
+from config import TRACING_ENABLED, TRACE_EXPORT_FILE, N_PLUS_ONE_THRESHOLD, WEBHOOK_SECRET
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Bot methods whose calls are timed
+BOT_API_METHODS = (
+    "send_message", "send_photo", "edit_message_media",
+    "edit_message_caption", "edit_message_text", "answer_callback_query"
+)
+
+
+class Span:
+    """One timed operation of a trace."""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Dict[str, Any] = None):
+        self.name = name
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        self.duration = None
+
+        # Statements run while this span was the current one (the root counts the whole trace)
+        self.queries = 0
+        self.query_time = 0.0
+
+        # Kept on the root: all statements of the trace and its finished spans
+        if parent is None:
+            self.statements = Counter()
+            self.finished = []
+
+
+class Tracer:
+    """Spans of updates and requests, SQL statement counters and their metrics."""
+
+    def __init__(self, enabled: bool = True, export_file: str = "", n_plus_one_threshold: int = 10):
+        self.enabled = enabled
+        self.export_file = export_file
+        self.n_plus_one_threshold = n_plus_one_threshold
+
+        self._current = contextvars.ContextVar("tracing_span", default=None)
+        self._lock = threading.Lock()
+        self._export_lock = threading.Lock()
+        self._export = None
+        self._engine_hooked = False
+
+        self._durations = {}  # span name -> Histogram
+        self._trace_queries = {}  # trace name -> Histogram
+        self._trace_query_time = {}  # trace name -> Histogram
+        self._query_time = Histogram(DURATION_BUCKETS)
+        self._n_plus_one = Counter()  # trace name -> possible N+1 patterns seen
+        self._reported = set()  # (trace name, statement) pairs already logged
+
+    def current(self) -> Optional[Span]:
+        """Get the span the caller runs in."""
+        return self._current.get()
+
+    def start_span(self, name: str, **attributes) -> Tuple[Span, contextvars.Token]:
+        """Start a span as a child of the current one (use span() where possible)."""
+        span = Span(name, self._current.get(), attributes)
+        return span, self._current.set(span)
+
+    def end_span(self, span: Span, token: contextvars.Token) -> None:
+        """Finish a span started with start_span."""
+        span.duration = time.perf_counter() - span.started
+        try:
+            self._current.reset(token)
+        except ValueError:
+            # Ended in another context than it was started in
+            self._current.set(span.parent)
+
+        with self._lock:
+            histogram = self._durations.get(span.name)
+            if histogram is None:
+                histogram = self._durations[span.name] = Histogram(DURATION_BUCKETS)
+            histogram.observe(span.duration)
+
+        span.root.finished.append(span)
+        if span.parent is None:
+            self._finish_trace(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Run a block in a span; yields None when tracing is disabled."""
+        if not self.enabled:
+            yield None
+            return
+
+        span, token = self.start_span(name, **attributes)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.end_span(span, token)
+
+    def traced(self, name: str) -> Callable:
+        """Decorator running a function in a span."""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _finish_trace(self, root: Span) -> None:
+        name = trace_name(root)
+
+        with self._lock:
+            for histograms, value, buckets in (
+                (self._trace_queries, root.queries, QUERY_COUNT_BUCKETS),
+                (self._trace_query_time, root.query_time, DURATION_BUCKETS)
+            ):
+                histogram = histograms.get(name)
+                if histogram is None:
+                    histogram = histograms[name] = Histogram(buckets)
+                histogram.observe(value)
+
+            # The same statement over and over in one update or request
+            repeated = [(statement, count) for statement, count in root.statements.items()
+                        if count >= self.n_plus_one_threshold]
+            new_patterns = []
+            for statement, count in repeated:
+                self._n_plus_one[name] += 1
+                if (name, statement) not in self._reported:
+                    self._reported.add((name, statement))
+                    new_patterns.append((statement, count))
+
+        for statement, count in new_patterns:
+            logger.warning(f"Possible N+1 query in {name}: the same statement ran {count} times: "
+                           f"{' '.join(statement.split())[:300]}")
+
+        if self.export_file:
+            try:
+                self._export_trace(root)
+            except Exception as e:
+                logger.error(f"Error exporting trace: {e}")
+
+    # SQL statements
+
+    def hook_sqlalchemy(self) -> None:
+        """Count and time the statements of every engine."""
+        with self._lock:
+            if self._engine_hooked:
+                return
+            self._engine_hooked = True
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Kept on the execution context, which is dropped with a failed statement
+        if context is not None:
+            context._tracing_started = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_tracing_started", None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._query_time.observe(elapsed)
+
+        span = self._current.get()
+        if span is None:
+            return
+        span.queries += 1
+        span.query_time += elapsed
+        root = span.root
+        if root is not span:
+            root.queries += 1
+            root.query_time += elapsed
+        root.statements[statement] += 1
+
+    # Bot handlers and Bot API calls
+
+    def instrument_bot(self, bot) -> None:
+        """Run every handler registered on the bot, and its Bot API calls, in spans."""
+        if not self.enabled:
+            return
+        self.hook_sqlalchemy()
+
+        for attribute, handlers in list(vars(bot).items()):
+            if not attribute.endswith("_handlers") or not isinstance(handlers, list):
+                continue
+            for handler in handlers:
+                if isinstance(handler, dict) and callable(handler.get("function")):
+                    if not getattr(handler["function"], "_traced", False):
+                        handler["function"] = self._trace_handler(
+                            handler["function"], handler_name(attribute, handler)
+                        )
+
+        for method in BOT_API_METHODS:
+            function = getattr(bot, method, None)
+            if function is not None and not getattr(function, "_traced", False):
+                wrapper = self.traced(f"telegram {method}")(function)
+                wrapper._traced = True
+                setattr(bot, method, wrapper)
+
+    def _trace_handler(self, function: Callable, name: str) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with self.span(f"handler {name}") as span:
+                if span is not None:
+                    span.root.attributes.setdefault("handler", name)
+                return function(*args, **kwargs)
+
+        wrapper._traced = True
+        return wrapper
+
+    # Export
+
+    def _export_trace(self, root: Span) -> None:
+        lines = "".join(
+            json.dumps(otel_span(span), ensure_ascii=False, separators=(",", ":")) + "\n"
+            for span in root.finished
+        )
+        with self._export_lock:
+            if self._export is None:
+                os.makedirs(os.path.dirname(self.export_file) or ".", exist_ok=True)
+                self._export = open(self.export_file, "a", encoding="utf-8")
+            self._export.write(lines)
+            self._export.flush()
+
+    def prometheus(self) -> str:
+        """Get the metrics in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            _histograms(lines, "bot_span_duration_seconds",
+                        "Duration of updates, handlers, Bot API calls and web requests", "span", self._durations)
+            _histograms(lines, "bot_trace_db_queries",
+                        "SQL statements per update (by handler) or web request", "trace", self._trace_queries)
+            _histograms(lines, "bot_trace_db_seconds",
+                        "SQL time per update (by handler) or web request", "trace", self._trace_query_time)
+            _histograms(lines, "bot_db_query_duration_seconds",
+                        "Duration of SQL statements", None, {None: self._query_time})
+
+            lines.append("# HELP bot_n_plus_one_total Updates and requests that repeated one statement "
+                         "N_PLUS_ONE_THRESHOLD times or more")
+            lines.append("# TYPE bot_n_plus_one_total counter")
+            for name, count in sorted(self._n_plus_one.items()):
+                lines.append(f'bot_n_plus_one_total{{trace="{_label(name)}"}} {count}')
+
+        pool = pool_metrics.metrics()
+        for name, kind, key, help_text in (
+            ("bot_db_pool_size", "gauge", "size", "Connections kept in the pool"),
+            ("bot_db_pool_checked_out", "gauge", "checked_out", "Connections in use"),
+            ("bot_db_pool_checkouts_total", "counter", "checkouts", "Connection checkouts"),
+            ("bot_db_pool_exhausted_total", "counter", "exhausted", "Checkouts that had to wait"),
+            ("bot_db_pool_timeouts_total", "counter", "timeouts", "Checkouts that timed out")
+        ):
+            if pool.get(key) is not None:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                lines.append(f"{name} {pool[key]}")
+
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        with self._export_lock:
+            if self._export is not None:
+                self._export.close()
+                self._export = None
+
+
+def trace_name(root: Span) -> str:
+    """Name a trace by the handler it ran, or by its root span."""
+    return root.attributes.get("handler", root.name)
+
+
+def handler_name(attribute: str, handler: Dict[str, Any]) -> str:
+    """Name a registered handler by its command, its function or its update type."""
+    commands = handler.get("filters", {}).get("commands")
+    if commands:
+        return "/" + commands[0]
+    name = getattr(handler["function"], "__name__", "")
+    if name and name != "<lambda>":
+        return name
+    return attribute[:-len("_handlers")]
+
+
+def otel_span(span: Span) -> Dict[str, Any]:
+    """Convert a finished span to an OpenTelemetry (OTLP JSON) style dict."""
+    attributes = dict(span.attributes)
+    attributes["db.queries"] = span.queries
+    attributes["db.time_ms"] = round(span.query_time * 1000, 3)
+    if span.parent is None:
+        kind = "SPAN_KIND_SERVER"
+    elif span.name.startswith("telegram "):
+        kind = "SPAN_KIND_CLIENT"
+    else:
+        kind = "SPAN_KIND_INTERNAL"
+
+    return {
+        "traceId": span.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent.span_id if span.parent else "",
+        "name": span.name,
+        "kind": kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+        "attributes": [{"key": key, "value": _otel_value(value)} for key, value in attributes.items()],
+        "status": {"code": "STATUS_CODE_ERROR", "message": span.error} if span.error
+                  else {"code": "STATUS_CODE_UNSET"}
+    }
+
+
+def _otel_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histograms(lines, metric: str, help_text: str, label: Optional[str], histograms) -> None:
+    """Append Prometheus histogram lines (called with the tracer lock held)."""
+    lines.append(f"# HELP {metric} {help_text}")
+    lines.append(f"# TYPE {metric} histogram")
+    for key, histogram in sorted(histograms.items(), key=lambda item: str(item[0])):
+        prefix = f'{label}="{_label(key)}",' if label else ""
+        cumulative = 0
+        for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        suffix = f"{{{prefix[:-1]}}}" if prefix else ""
+        lines.append(f"{metric}_sum{suffix} {histogram.sum}")
+        lines.append(f"{metric}_count{suffix} {histogram.count}")
+
+
+def can_read_metrics() -> bool:
+    """Check that the request comes from an admin or carries the webhook secret token."""
+    if 'admin_id' in session:
+        return True
+
+    # setup_webhook() keeps the secret it registered (possibly generated) in the config
+    from webhook import SECRET_HEADER
+    secret = current_app.config.get("WEBHOOK_SECRET") or WEBHOOK_SECRET
+    token = request.headers.get(SECRET_HEADER, "")
+    return bool(secret) and hmac.compare_digest(token, secret)
+
+
+def init_app(app) -> None:
+    """Trace the requests of a Flask app and serve the metrics on /metrics."""
+    if tracer.enabled:
+        tracer.hook_sqlalchemy()
+
+        @app.before_request
+        def start_request_span():
+            g.tracing_span = tracer.start_span(f"http {request.endpoint}", **{
+                "http.method": request.method,
+                "http.target": request.path
+            })
+
+        @app.after_request
+        def record_status(response):
+            started = g.get("tracing_span")
+            if started is not None:
+                started[0].attributes["http.status_code"] = response.status_code
+            return response
+
+        @app.teardown_request
+        def end_request_span(error=None):
+            started = g.pop("tracing_span", None)
+            if started is not None:
+                span, token = started
+                if error is not None:
+                    span.error = f"{type(error).__name__}: {error}"
+                tracer.end_span(span, token)
+
+    def metrics():
+        """Tracing and connection pool metrics in the Prometheus text format."""
+        if not can_read_metrics():
+            abort(403)
+        return Response(tracer.prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    app.add_url_rule("/metrics", "metrics", metrics)
+
+
+# Shared tracer for the process
+tracer = Tracer(TRACING_ENABLED, TRACE_EXPORT_FILE, N_PLUS_ONE_THRESHOLD)
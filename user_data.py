@@ -3,127 +3,70 @@ User Data Module
 
 This module manages user data using SQLAlchemy models.
 It provides functions for retrieving, updating, and manipulating user data.
+Every function runs in a unit of work on the engine shared with the web
+app, so functions calling each other use the same session.
 """
 import json
 import os
 import time
 import random
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Dict, List, Tuple, Optional, Any
-from flask import Flask
+from sqlalchemy import select, update, insert, func
+from sqlalchemy.exc import IntegrityError
+from app import app
+from database import unit_of_work
 from models import db, User, Buff, ShopItem, Stats
 from config import (
-    DATABASE_URL,
     DATA_DIR,
     USER_DATA_FILE,
-    SHOP_DATA_FILE,
     STATS_DATA_FILE,
-    SQLALCHEMY_TRACK_MODIFICATIONS,
-    SQLALCHEMY_ENGINE_OPTIONS
+    USER_DATA_LOG_FILE,
+    SNAPSHOT_COMPACT_INTERVAL,
+    LEADERBOARD_TOP_SIZE,
+    DELIVERY_COOLDOWN_MINUTES
 )
-
-# Create Flask app for database context
-app = Flask(__name__)
-app.config["SQLALCHEMY_DATABASE_URI"] = DATABASE_URL
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = SQLALCHEMY_ENGINE_OPTIONS
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = SQLALCHEMY_TRACK_MODIFICATIONS
-
-# Initialize database
-db.init_app(app)
+from snapshot_writer import SnapshotWriter
+from stats_buffer import stats_buffer
+from buff_registry import buff_registry, format_buff
+from migrations import run_migrations
+from leaderboard import leaderboard
+from media_registry import media_registry
+from shop_catalog import shop_catalog, load_shop_items
+from event_bus import publish
+from cooldown import cooldown_cache
 
 # Create data directory if it doesn't exist
 os.makedirs(DATA_DIR, exist_ok=True)
 
-def _load_shop_items():
-    """Load shop items from JSON file or use defaults."""
-    default_items = [
-        {
-            "item_id": "hyper_buff",
-            "name": "Гипер Бафф",
-            "description": "Повышает доход на 50%",
-            "price": 2750,
-            "bonus": 0.5,
-            "duration": 40,
-            "image": "assets/shop/IMG_1914.jpeg"
-        },
-        {
-            "item_id": "super_buff",
-            "name": "Супер Бафф",
-            "description": "Повышает доход на 15%",
-            "price": 850,
-            "bonus": 0.15,
-            "duration": 30,
-            "image": "assets/shop/IMG_2282.jpeg"
-        },
-        {
-            "item_id": "mega_buff",
-            "name": "Мега Бафф",
-            "description": "Повышает доход на 25%",
-            "price": 1800,
-            "bonus": 0.25,
-            "duration": 30,
-            "image": "assets/shop/IMG_2283.jpeg"
-        },
-        {
-            "item_id": "ultra_buff",
-            "name": "Ультра Бафф",
-            "description": "Повышает доход на 35%",
-            "price": 2200,
-            "bonus": 0.35,
-            "duration": 35,
-            "image": "assets/shop/IMG_2284.jpeg"
-        }
-    ]
-    
-    # Try to load from JSON file
-    if os.path.exists(SHOP_DATA_FILE):
-        try:
-            with open(SHOP_DATA_FILE, 'r', encoding='utf-8') as f:
-                items = json.load(f)
-                if items and len(items) > 0:
-                    return items
-        except Exception as e:
-            print(f"Error loading shop items from file: {e}")
-    
-    # Save default items to file
-    try:
-        with open(SHOP_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(default_items, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Error saving default shop items to file: {e}")
-    
-    return default_items
+# Cooldown between deliveries
+DELIVERY_COOLDOWN = timedelta(minutes=DELIVERY_COOLDOWN_MINUTES)
+
+# Incremental writer for the user data file
+user_snapshot = SnapshotWriter(
+    USER_DATA_FILE,
+    USER_DATA_LOG_FILE,
+    compact_interval=SNAPSHOT_COMPACT_INTERVAL
+)
 
-def _save_user_data_to_file():
-    """Save all user data to file for Beget hosting."""
+def _record_user_snapshot(user, active_buffs=None):
+    """Append the changed fields of one user to the snapshot change log."""
     try:
-        with app.app_context():
-            users = User.query.all()
-            
-            # Convert users to dictionary
-            user_data = {}
-            for user in users:
-                # Get active buffs
-                active_buffs = []
-                for buff in user.buffs:
-                    if buff.expires_at > time.time():
-                        active_buffs.append(buff.to_dict())
-                
-                # Create user dictionary
-                user_data[str(user.telegram_id)] = {
-                    "username": user.username,
-                    "deliveries": user.deliveries,
-                    "money": user.money,
-                    "experience": user.experience,
-                    "last_delivery": user.last_delivery,
-                    "blocked": user.blocked,
-                    "created_at": user.created_at,
-                    "buffs": active_buffs
-                }
-            
-            # Save to file
-            with open(USER_DATA_FILE, 'w', encoding='utf-8') as f:
-                json.dump(user_data, f, ensure_ascii=False, indent=2)
+        delta = {
+            "username": user.username,
+            "deliveries": user.deliveries,
+            "money": user.money,
+            "experience": user.experience,
+            "last_delivery": user.last_delivery,
+            "blocked": user.blocked,
+            "created_at": user.created_at
+        }
+        
+        # Buffs only change on purchase, so they are logged only when given
+        if active_buffs is not None:
+            delta["buffs"] = active_buffs
+        
+        user_snapshot.record(user.telegram_id, delta)
                 
     except Exception as e:
         print(f"Error saving user data to file: {e}")
@@ -131,7 +74,7 @@ def _save_user_data_to_file():
 def _save_stats_to_file():
     """Save stats to file for Beget hosting."""
     try:
-        with app.app_context():
+        with unit_of_work():
             stats = Stats.query.first()
             
             if not stats:
@@ -154,13 +97,13 @@ def _save_stats_to_file():
 
 def init_shop_items():
     """Initialize shop items in the database if they don't exist."""
-    with app.app_context():
+    with unit_of_work():
         # Check if shop items already exist
         if ShopItem.query.count() > 0:
             return
         
         # Load shop items
-        items = _load_shop_items()
+        items = load_shop_items()
         
         # Add items to database
         for item_data in items:
@@ -176,10 +119,11 @@ def init_shop_items():
             db.session.add(item)
         
         db.session.commit()
+        shop_catalog.invalidate()
 
 def init_stats():
     """Initialize stats in the database if they don't exist."""
-    with app.app_context():
+    with unit_of_work():
         # Check if stats already exist
         if Stats.query.count() > 0:
             return
@@ -196,56 +140,80 @@ def init_stats():
 
 def initialize_database():
     """Initialize the database with required data."""
-    with app.app_context():
+    with unit_of_work():
         # Import models to make sure tables are created
         import models
         
+        # Apply pending schema migrations (indexes etc.)
+        run_migrations(db.engine)
+        
         # Initialize shop items
         init_shop_items()
         
         # Initialize stats
         init_stats()
+        
+        # Start flushing buffered stats
+        stats_buffer.start(_flush_stats)
+        
+        # Load active buffs and start pruning expired ones
+        buff_registry.ensure_loaded()
+        buff_registry.start_sweeper(app)
+        
+        # Build the leaderboard and keep it in sync with the database
+        leaderboard.ensure_loaded()
+        leaderboard.start_reconciler(app)
+        
+        # Load file_ids of images already uploaded to Telegram
+        media_registry.init_app(app)
 
 def get_user_data(telegram_id: int) -> Dict[str, Any]:
     """Get user data or initialize if it doesn't exist."""
-    with app.app_context():
+    with unit_of_work():
         # Convert to string for database lookup
         str_telegram_id = str(telegram_id)
         
         try:
-        # Get user from database
-        user = User.query.filter_by(telegram_id=str_telegram_id).first()
-        
-        # Create new user if not found
-        if not user:
-            user = User(
-                telegram_id=str_telegram_id,
-                username=f"Курьер {str_telegram_id[-4:]}",
-                deliveries=0,
-                money=0,
-                experience=0,
-                last_delivery=0,
+            # Get user from database
+            user = User.query.filter_by(telegram_id=str_telegram_id).first()
+            
+            # Create new user if not found
+            if not user:
+                user = User(
+                    telegram_id=str_telegram_id,
+                    username=f"Курьер {str_telegram_id[-4:]}",
+                    deliveries=0,
+                    money=0,
+                    experience=0,
+                    last_delivery=0,
                     blocked=False,
                     created_at=time.time()
-            )
-            db.session.add(user)
-            db.session.commit()
+                )
+                db.session.add(user)
+                db.session.commit()
+                
+                # Update stats
+                update_stats(new_user=True)
+                top_changed = leaderboard.add_user(user.id, user.telegram_id, user.username)
+                
+                # Notify live dashboards
+                publish("new_user", {"telegram_id": user.telegram_id, "username": user.username})
+                if top_changed:
+                    publish("leaderboard", {"top": leaderboard.top(LEADERBOARD_TOP_SIZE)})
+                
+                # Save to file for Beget hosting
+                _record_user_snapshot(user, active_buffs=[])
             
-            # Update stats
-            update_stats(new_user=True)
-        
-        # Get active buffs
-        active_buffs = []
-        now = time.time()
-        for buff in user.buffs:
-            if buff.expires_at > now:
-                active_buffs.append(buff.to_dict())
-        
-        # Convert to dictionary
-        user_data = user.to_dict()
-        user_data["active_buffs"] = active_buffs
-        
-        return user_data
+            # Get active buffs
+            active_buffs = [
+                format_buff(buff) for buff in _get_buff_registry().active_buffs(str_telegram_id)
+            ]
+            
+            # Convert to dictionary
+            user_data = user.to_dict()
+            user_data["active_buffs"] = active_buffs
+            
+            return user_data
             
         except Exception as e:
             print(f"Error in get_user_data: {e}")
@@ -260,48 +228,50 @@ def update_user_data(telegram_id: int, deliveries: int, earnings: int) -> Tuple[
     Returns:
         Tuple of (original_earnings, buffed_earnings)
     """
-    with app.app_context():
+    with unit_of_work():
         try:
-        # Get user data
-        str_telegram_id = str(telegram_id)
-        user = User.query.filter_by(telegram_id=str_telegram_id).first()
-        
-        if not user:
-            # Create new user if not found
-            user = User(
-                telegram_id=str_telegram_id,
-                username=f"Курьер {str_telegram_id[-4:]}",
-                deliveries=0,
-                money=0,
-                experience=0,
-                last_delivery=0,
+            # Get user data
+            str_telegram_id = str(telegram_id)
+            user = User.query.filter_by(telegram_id=str_telegram_id).first()
+            
+            new_user = user is None
+            if new_user:
+                # Create new user if not found
+                user = User(
+                    telegram_id=str_telegram_id,
+                    username=f"Курьер {str_telegram_id[-4:]}",
+                    deliveries=0,
+                    money=0,
+                    experience=0,
+                    last_delivery=0,
                     blocked=False,
                     created_at=time.time()
-            )
-            db.session.add(user)
+                )
+                db.session.add(user)
+                db.session.commit()
+            
+            # Calculate earnings with active buffs
+            multiplier = get_active_earnings_multiplier(telegram_id)
+            original_earnings = earnings
+            buffed_earnings = int(earnings * (1 + multiplier))
+            
+            # Update user data
+            user.deliveries += deliveries
+            user.money += buffed_earnings
+            user.experience += random.randint(1, 3)  # Random experience gain
+            user.last_delivery = last_delivery = time.time()
+            
+            # Save to database
             db.session.commit()
-        
-        # Calculate earnings with active buffs
-        multiplier = get_active_earnings_multiplier(telegram_id)
-        original_earnings = earnings
-        buffed_earnings = int(earnings * (1 + multiplier))
-        
-        # Update user data
-        user.deliveries += deliveries
-        user.money += buffed_earnings
-        user.experience += random.randint(1, 3)  # Random experience gain
-        user.last_delivery = time.time()
-        
-        # Save to database
-        db.session.commit()
-        
-        # Update stats
-        update_stats(deliveries=deliveries, earnings=buffed_earnings)
-        
-        # Save to file for Beget hosting
-        _save_user_data_to_file()
-        
-        return original_earnings, buffed_earnings
+            cooldown_cache.record(str_telegram_id, last_delivery)
+            
+            # Update stats and the leaderboard, notify live dashboards
+            _record_delivery(user.id, user, new_user, deliveries, buffed_earnings)
+            
+            # Save to file for Beget hosting
+            _record_user_snapshot(user)
+            
+            return original_earnings, buffed_earnings
             
         except Exception as e:
             print(f"Error in update_user_data: {e}")
@@ -310,118 +280,253 @@ def update_user_data(telegram_id: int, deliveries: int, earnings: int) -> Tuple[
             raise
 
 def can_deliver(telegram_id: int) -> Tuple[bool, Optional[timedelta]]:
-    """Check if a user can make a delivery (2-minute cooldown)."""
-    with app.app_context():
-        # Convert to string for database lookup
+    """Check if a user can make a delivery (answered from the cooldown cache)."""
+    blocked, remaining = _get_cooldown_cache().check(str(telegram_id))
+    if blocked:
+        return False, None
+    if remaining:
+        return False, timedelta(seconds=remaining)
+    return True, None
+
+def deliver(telegram_id: int, deliveries: int, earnings: int) -> Dict[str, Any]:
+    """
+    Perform a delivery in a single transaction.
+    
+    Checks the cooldown, applies the active buff multiplier and updates the
+    user's balance and experience, then commits once. Global stats are
+    buffered and flushed separately.
+    
+    Returns:
+        Dict with "delivered" (bool), "blocked" (bool), "time_remaining"
+        (timedelta or None), "original_earnings", "buffed_earnings",
+        "experience_gained" and the user's updated "username", "deliveries",
+        "money" and "experience"
+    """
+    with unit_of_work():
         str_telegram_id = str(telegram_id)
+        now = time.time()
         
-        # Get user from database
-        user = User.query.filter_by(telegram_id=str_telegram_id).first()
-        
-        if not user or not user.last_delivery:
-            return True, None
+        result = {
+            "delivered": False,
+            "blocked": False,
+            "time_remaining": None,
+            "original_earnings": earnings,
+            "buffed_earnings": 0,
+            "experience_gained": 0
+        }
         
-        # Check if user is blocked
-        if user.blocked:
-            return False, None
+        # Reject blocked users and running cooldowns without touching the database
+        blocked, remaining = _get_cooldown_cache().check(str_telegram_id, now)
+        if blocked or remaining:
+            result["blocked"] = blocked
+            result["time_remaining"] = timedelta(seconds=remaining) if remaining else None
+            return result
         
-        # Check cooldown
-        cooldown = timedelta(minutes=2)
-        last_delivery_time = datetime.fromtimestamp(user.last_delivery)
-        now = datetime.now()
-        time_passed = now - last_delivery_time
+        try:
+            # Lock the user row
+            lock_user = (
+                select(User.id, User.last_delivery, User.blocked)
+                .where(User.telegram_id == str_telegram_id)
+                .with_for_update(of=User)
+            )
+            row = db.session.execute(lock_user).first()
+            
+            new_user = row is None
+            if new_user:
+                # Create new user if not found
+                user = User(
+                    telegram_id=str_telegram_id,
+                    username=f"Курьер {str_telegram_id[-4:]}",
+                    deliveries=0,
+                    money=0,
+                    experience=0,
+                    last_delivery=0,
+                    blocked=False,
+                    created_at=now
+                )
+                try:
+                    with db.session.begin_nested():
+                        db.session.add(user)
+                        db.session.flush()
+                    user_id, last_delivery, blocked = user.id, 0, False
+                except IntegrityError:
+                    # A concurrent update created the user first, lock its row instead
+                    new_user = False
+                    row = db.session.execute(lock_user).first()
+            
+            if not new_user:
+                user_id, last_delivery, blocked = row
+            
+            # Check if user is blocked
+            if blocked:
+                db.session.rollback()
+                cooldown_cache.record(str_telegram_id, last_delivery, blocked)
+                result["blocked"] = True
+                return result
+            
+            # Check cooldown (the cache may not have seen a delivery made by another process)
+            if last_delivery:
+                time_passed = timedelta(seconds=now - last_delivery)
+                if time_passed < DELIVERY_COOLDOWN:
+                    db.session.rollback()
+                    cooldown_cache.record(str_telegram_id, last_delivery)
+                    result["time_remaining"] = DELIVERY_COOLDOWN - time_passed
+                    return result
+            
+            # Calculate earnings with active buffs
+            total_bonus = _get_buff_registry().multiplier(str_telegram_id)
+            buffed_earnings = int(earnings * (1 + total_bonus))
+            experience_gained = random.randint(1, 3)  # Random experience gain
+            
+            # Update the user and read back the new values. The update only
+            # applies if no other delivery or block changed the row since it was
+            # read (SELECT ... FOR UPDATE doesn't lock anything on SQLite)
+            user_row = db.session.execute(
+                update(User)
+                .where(User.id == user_id, User.last_delivery == last_delivery, User.blocked == False)  # noqa: E712
+                .values(
+                    deliveries=User.deliveries + deliveries,
+                    money=User.money + buffed_earnings,
+                    experience=User.experience + experience_gained,
+                    last_delivery=now
+                )
+                .returning(
+                    User.telegram_id, User.username, User.deliveries, User.money,
+                    User.experience, User.last_delivery, User.blocked, User.created_at
+                )
+                .execution_options(synchronize_session=False)
+            ).first()
+            
+            if user_row is None:
+                # Lost the race: report the state the other update left behind
+                db.session.rollback()
+                last_delivery, blocked = db.session.execute(
+                    select(User.last_delivery, User.blocked).where(User.id == user_id)
+                ).one()
+                cooldown_cache.record(str_telegram_id, last_delivery, blocked)
+                result["blocked"] = blocked
+                if not blocked:
+                    result["time_remaining"] = max(DELIVERY_COOLDOWN - timedelta(seconds=now - last_delivery),
+                                                   timedelta(0))
+                return result
+            
+            db.session.commit()
+            cooldown_cache.record(str_telegram_id, now)
+            
+        except Exception as e:
+            print(f"Error in deliver: {e}")
+            # If there was an error, rollback the session
+            db.session.rollback()
+            raise
         
-        if time_passed < cooldown:
-            time_remaining = cooldown - time_passed
-            return False, time_remaining
+        # Update stats and the leaderboard, notify live dashboards
+        _record_delivery(user_id, user_row, new_user, deliveries, buffed_earnings)
         
-        return True, None
+        # Save to file for Beget hosting
+        _record_user_snapshot(user_row, active_buffs=[] if new_user else None)
+        
+        result.update({
+            "delivered": True,
+            "buffed_earnings": buffed_earnings,
+            "experience_gained": experience_gained,
+            "username": user_row.username,
+            "deliveries": user_row.deliveries,
+            "money": user_row.money,
+            "experience": user_row.experience
+        })
+        return result
+
+def _record_delivery(user_id: int, user, new_user: bool, deliveries: int, earnings: int) -> None:
+    """
+    Count a committed delivery in the global stats and the leaderboard and
+    publish it to live dashboards.
+    
+    Args:
+        user: User (or row) with the updated telegram_id, username, deliveries and money
+    """
+    update_stats(new_user=new_user, deliveries=deliveries, earnings=earnings)
+    top_changed = leaderboard.record_delivery(
+        user_id,
+        user.telegram_id,
+        user.username,
+        None if new_user else user.deliveries - deliveries,
+        user.deliveries
+    )
+    
+    if new_user:
+        publish("new_user", {"telegram_id": user.telegram_id, "username": user.username})
+    publish("delivery", {
+        "telegram_id": user.telegram_id,
+        "username": user.username,
+        "deliveries": deliveries,
+        "earnings": earnings,
+        "total_deliveries": user.deliveries,
+        "money": user.money
+    })
+    if top_changed:
+        publish("leaderboard", {"top": leaderboard.top(LEADERBOARD_TOP_SIZE)})
+
+def _get_leaderboard():
+    """Get the leaderboard, building it from the database on first use."""
+    if not leaderboard.loaded:
+        with unit_of_work():
+            leaderboard.ensure_loaded()
+    return leaderboard
 
 def get_top_users(limit: int = 5) -> List[Tuple[int, str, int]]:
     """Get the top users by number of deliveries."""
-    with app.app_context():
-        # Get top users from database
-        top_users = User.query.order_by(User.deliveries.desc()).limit(limit).all()
-        
-        # Convert to list of tuples
-        results = []
-        for i, user in enumerate(top_users):
-            results.append((i+1, user.username, user.deliveries))
-        
-        return results
+    top_users = _get_leaderboard().top(limit)
+    
+    # Convert to list of tuples
+    results = []
+    for i, user in enumerate(top_users):
+        results.append((i+1, user["username"], user["deliveries"]))
+    
+    return results
+
+def get_user_rank(telegram_id: int) -> Optional[Dict[str, int]]:
+    """
+    Get the user's position on the leaderboard.
+    
+    Returns:
+        Dict with "rank", "total" and "deliveries", or None if the user doesn't exist
+    """
+    with unit_of_work():
+        deliveries = db.session.execute(
+            select(User.deliveries).where(User.telegram_id == str(telegram_id))
+        ).scalar()
+    
+    if deliveries is None:
+        return None
+    
+    rank, total = _get_leaderboard().rank(deliveries)
+    return {"rank": rank, "total": total, "deliveries": deliveries}
+
+def _get_shop_catalog():
+    """Get the shop catalog, reloading it if the shop changed."""
+    if shop_catalog.is_stale():
+        with unit_of_work():
+            # If no items, initialize shop items
+            if ShopItem.query.filter_by(is_active=True).count() == 0:
+                init_shop_items()
+            
+            # Attach image paths from the shop file
+            images = {item["item_id"]: item.get("image", "") for item in load_shop_items()}
+            shop_catalog.reload(images)
+    return shop_catalog
 
 def get_shop_item(index: int) -> Dict[str, Any]:
     """Get shop item by index."""
-    with app.app_context():
-        # Get all active shop items
-        items = ShopItem.query.filter_by(is_active=True).all()
-        
-        # If no items, initialize shop items
-        if not items:
-            init_shop_items()
-            items = ShopItem.query.filter_by(is_active=True).all()
-        
-        # Make sure index is within bounds
-        item_count = len(items)
-        if item_count == 0:
-            return None
-        
-        # Ensure index is within bounds using modulo
-        item_index = index % item_count
-        item = items[item_index]
-        
-        # Convert to dictionary
-        item_data = item.to_dict()
-        
-        # Add image path if available
-        shop_items = _load_shop_items()
-        for shop_item in shop_items:
-            if shop_item["item_id"] == item.item_id:
-                item_data["image"] = shop_item.get("image", "")
-                break
-        
-        return item_data
+    # Index wraps around the number of items
+    return _get_shop_catalog().get(index)
 
 def get_all_shop_items() -> List[Dict[str, Any]]:
     """Get all shop items."""
-    with app.app_context():
-        # Get all active shop items
-        items = ShopItem.query.filter_by(is_active=True).all()
-        
-        # If no items, initialize shop items
-        if not items:
-            init_shop_items()
-            items = ShopItem.query.filter_by(is_active=True).all()
-        
-        # Convert to list of dictionaries
-        results = []
-        shop_items = _load_shop_items()
-        
-        for item in items:
-            item_data = item.to_dict()
-            
-            # Add image path if available
-            for shop_item in shop_items:
-                if shop_item["item_id"] == item.item_id:
-                    item_data["image"] = shop_item.get("image", "")
-                    break
-            
-            results.append(item_data)
-        
-        return results
+    return _get_shop_catalog().items()
 
 def get_shop_items_count() -> int:
     """Get the number of shop items."""
-    with app.app_context():
-        # Get count of active shop items
-        count = ShopItem.query.filter_by(is_active=True).count()
-        
-        # If no items, initialize shop items
-        if count == 0:
-            init_shop_items()
-            count = ShopItem.query.filter_by(is_active=True).count()
-        
-        return count
+    return _get_shop_catalog().count()
 
 def purchase_buff(telegram_id: int, item_index: int) -> Tuple[bool, str]:
     """
@@ -430,7 +535,7 @@ def purchase_buff(telegram_id: int, item_index: int) -> Tuple[bool, str]:
     Returns:
         Tuple of (success, message)
     """
-    with app.app_context():
+    with unit_of_work():
         # Get user
         str_telegram_id = str(telegram_id)
         user = User.query.filter_by(telegram_id=str_telegram_id).first()
@@ -448,36 +553,66 @@ def purchase_buff(telegram_id: int, item_index: int) -> Tuple[bool, str]:
         if user.money < item_data["price"]:
             return False, f"❌ Недостаточно денег! Нужно: {item_data['price']} руб."
         
-        # Get the actual shop item
-        item = ShopItem.query.filter_by(item_id=item_data["item_id"]).first()
-        
-        if not item:
-            return False, "❌ Предмет не найден в базе данных."
-        
         # Subtract cost
-        user.money -= item.price
+        user.money -= item_data["price"]
         
         # Add buff
-        expires_at = time.time() + (item.duration * 60)
+        expires_at = time.time() + (item_data["duration"] * 60)
         
         buff = Buff(
             user_id=user.id,
-            buff_type=item.item_id,
-            name=item.name,
-            bonus=item.bonus,
+            buff_type=item_data["item_id"],
+            name=item_data["name"],
+            bonus=item_data["bonus"],
             expires_at=expires_at
         )
         
         db.session.add(buff)
         db.session.commit()
         
+        # Register the buff in memory
+        registry = _get_buff_registry()
+        registry.add(str_telegram_id, buff)
+        
         # Update stats
         update_stats(buffs_purchased=1)
         
+        # Notify live dashboards
+        publish("purchase", {
+            "telegram_id": str_telegram_id,
+            "username": user.username,
+            "item_id": item_data["item_id"],
+            "name": item_data["name"],
+            "price": item_data["price"],
+            "expires_at": expires_at
+        })
+        
         # Save to file for Beget hosting
-        _save_user_data_to_file()
+        active_buffs = [format_buff(b) for b in registry.active_buffs(str_telegram_id)]
+        _record_user_snapshot(user, active_buffs=active_buffs)
         
-        return True, f"✅ Вы приобрели {item.name} на {item.duration} минут!"
+        return True, f"✅ Вы приобрели {item_data['name']} на {item_data['duration']} минут!"
+
+def _get_cooldown_cache():
+    """Get the cooldown cache, reloading it if a user was (un)blocked."""
+    if cooldown_cache.is_stale():
+        with unit_of_work():
+            cooldown_cache.reload()
+    return cooldown_cache
+
+def _get_buff_registry():
+    """Get the buff registry, loading it from the database on first use."""
+    if not buff_registry.loaded:
+        with unit_of_work():
+            buff_registry.ensure_loaded()
+    return buff_registry
+
+def load_registries():
+    """Load (or reload, if stale) the in-memory registries the bot answers from."""
+    _get_buff_registry()
+    _get_leaderboard()
+    _get_shop_catalog()
+    _get_cooldown_cache()
 
 def get_active_earnings_multiplier(telegram_id: int) -> float:
     """
@@ -486,25 +621,7 @@ def get_active_earnings_multiplier(telegram_id: int) -> float:
     Returns:
         Float multiplier (e.g., 0.25 for 25% increase)
     """
-    with app.app_context():
-        # Get user
-        str_telegram_id = str(telegram_id)
-        user = User.query.filter_by(telegram_id=str_telegram_id).first()
-        
-        if not user:
-            return 0.0
-        
-        # Get active buffs
-        now = time.time()
-        active_buffs = Buff.query.filter(
-            Buff.user_id == user.id,
-            Buff.expires_at > now
-        ).all()
-        
-        # Calculate total multiplier
-        total_multiplier = sum(buff.bonus for buff in active_buffs)
-        
-        return total_multiplier
+    return _get_buff_registry().multiplier(telegram_id)
 
 def get_active_buffs_info(telegram_id: int) -> List[Dict[str, Any]]:
     """
@@ -513,67 +630,76 @@ def get_active_buffs_info(telegram_id: int) -> List[Dict[str, Any]]:
     Returns:
         List of active buffs with name and remaining time
     """
-    with app.app_context():
-        # Get user
-        str_telegram_id = str(telegram_id)
-        user = User.query.filter_by(telegram_id=str_telegram_id).first()
-        
-        if not user:
-            return []
-        
-        # Get active buffs
-        now = time.time()
-        active_buffs = Buff.query.filter(
-            Buff.user_id == user.id,
-            Buff.expires_at > now
-        ).all()
-        
-        # Format buff information
-        buff_info = []
-        for buff in active_buffs:
-            remaining_seconds = int(buff.expires_at - now)
-            minutes, seconds = divmod(remaining_seconds, 60)
-            
-            buff_info.append({
-                "name": buff.name,
-                "bonus": int(buff.bonus * 100),
-                "remaining_time": f"{minutes}м {seconds}с"
-            })
-        
-        return buff_info
+    now = time.time()
+    
+    # Format buff information
+    buff_info = []
+    for buff in _get_buff_registry().active_buffs(telegram_id):
+        remaining_seconds = max(0, int(buff["expires_at"] - now))
+        minutes, seconds = divmod(remaining_seconds, 60)
+        
+        buff_info.append({
+            "name": buff["name"],
+            "bonus": int(buff["bonus"] * 100),
+            "remaining_time": f"{minutes}м {seconds}с"
+        })
+    
+    return buff_info
+
+def _increment_stats(new_users=0, deliveries=0, earnings=0):
+    """Atomically increment the global stats row without committing."""
+    values = {
+        "total_users": Stats.total_users + new_users,
+        "total_deliveries": Stats.total_deliveries + deliveries,
+        "total_money": Stats.total_money + earnings,
+        "updated_at": time.time()
+    }
+    updated = db.session.execute(
+        update(Stats)
+        .where(Stats.id == select(func.min(Stats.id)).scalar_subquery())
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    
+    # Create the stats record if it doesn't exist yet
+    if updated.rowcount == 0:
+        db.session.execute(insert(Stats).values(
+            total_users=new_users,
+            total_deliveries=deliveries,
+            total_money=earnings,
+            updated_at=time.time()
+        ))
 
 def update_stats(new_user=False, deliveries=0, earnings=0, buffs_purchased=0):
-    """Update global statistics."""
-    with app.app_context():
-        # Get stats
-        stats = Stats.query.first()
-        
-        if not stats:
-            # Create new stats record
-            stats = Stats(
-                total_users=0,
-                total_deliveries=0,
-                total_money=0,
-                updated_at=time.time()
+    """Buffer an update of global statistics; it is flushed in the background."""
+    stats_buffer.start(_flush_stats)
+    stats_buffer.add(
+        new_users=1 if new_user else 0,
+        deliveries=deliveries,
+        earnings=earnings,
+        buffs_purchased=buffs_purchased
+    )
+
+def _flush_stats(delta: Dict[str, int]):
+    """Apply a buffered stats delta with one atomic UPDATE."""
+    with unit_of_work():
+        try:
+            _increment_stats(
+                new_users=delta["new_users"],
+                deliveries=delta["deliveries"],
+                earnings=delta["earnings"]
             )
-            db.session.add(stats)
-        
-        # Update stats
-        if new_user:
-            stats.total_users += 1
-        
-        stats.total_deliveries += deliveries
-        stats.total_money += earnings
-        stats.updated_at = time.time()
-        
-        db.session.commit()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
         
         # Save to file for Beget hosting
         _save_stats_to_file()
 
 def is_bot_active() -> bool:
     """Проверяет, активен ли бот."""
-    with app.app_context():
+    with unit_of_work():
         stats = Stats.query.first()
         if not stats:
             return True  # По умолчанию бот активен
@@ -586,7 +712,7 @@ def set_bot_state(active: bool) -> bool:
     Returns:
         bool: True если состояние успешно изменено, False в случае ошибки
     """
-    with app.app_context():
+    with unit_of_work():
         try:
             stats = Stats.query.first()
             if not stats:
@@ -0,0 +1,120 @@
+"""
+Webhook Module
+
+This module receives Telegram updates through a webhook instead of long
+polling. The Flask endpoint checks the secret token Telegram sends with
+every request and hands the update to the dispatcher (see dispatcher.py),
+which processes the updates of each user in order on a bounded pool of
+worker threads.
+
+When the queue is full the endpoint answers 503 and Telegram delivers the
+update again later. On shutdown the dispatcher stops accepting updates and
+finishes the queued ones before exiting.
+"""
+import sys
+import hmac
+import atexit
+import signal
+import secrets
+import logging
+import threading
+from typing import Optional
+from flask import Blueprint, Flask, Response, abort, jsonify, request
+from telebot import types
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    UPDATE_WORKERS,
+    UPDATE_QUEUE_SIZE,
+    UPDATE_DRAIN_TIMEOUT
+)
+from dispatcher import UpdateDispatcher, create_dispatcher
+from database import pool_metrics
+import tracing
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Header Telegram uses to send the secret token
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Seconds Telegram is asked to wait before redelivering a rejected update
+RETRY_AFTER = 1
+
+
+def create_webhook_blueprint(dispatcher: UpdateDispatcher, secret: str,
+                             path: str = WEBHOOK_PATH) -> Blueprint:
+    """Create the blueprint with the webhook endpoint and its metrics."""
+    bp = Blueprint('telegram_webhook', __name__)
+
+    def check_secret():
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            abort(403)
+
+    @bp.route(path, methods=['POST'])
+    def receive_update():
+        """Queue an update sent by Telegram."""
+        check_secret()
+
+        try:
+            update = types.Update.de_json(request.get_data(as_text=True))
+        except Exception as e:
+            logger.error(f"Invalid update received: {e}")
+            abort(400)
+
+        if not dispatcher.submit(update):
+            # Telegram retries updates that are not answered with 2xx
+            return Response("busy", status=503, headers={"Retry-After": str(RETRY_AFTER)})
+        return ""
+
+    @bp.route(path + '/metrics')
+    def webhook_metrics():
+        """Dispatcher and connection pool metrics (requires the secret token header)."""
+        check_secret()
+        metrics = dispatcher.metrics()
+        metrics["db_pool"] = pool_metrics.metrics()
+        return jsonify(metrics)
+
+    return bp
+
+
+def setup_webhook(bot, app: Flask, url: str = WEBHOOK_URL,
+                  secret: Optional[str] = None) -> UpdateDispatcher:
+    """
+    Serve bot updates from a webhook on the given Flask app.
+
+    The bot should be created with threaded=False, so that each update is
+    handled on the dispatcher worker its lane is scheduled on.
+    """
+    if not url:
+        raise ValueError("WEBHOOK_URL is not set")
+    secret = secret or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app.config["WEBHOOK_SECRET"] = secret
+
+    dispatcher = create_dispatcher(bot, UPDATE_WORKERS, UPDATE_QUEUE_SIZE, name="webhook")
+    app.register_blueprint(create_webhook_blueprint(dispatcher, secret))
+
+    # Finish queued updates on shutdown
+    atexit.register(dispatcher.drain, UPDATE_DRAIN_TIMEOUT)
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    bot.remove_webhook()
+    bot.set_webhook(
+        url=url.rstrip('/') + WEBHOOK_PATH,
+        secret_token=secret,
+        max_connections=min(100, max(1, UPDATE_WORKERS * 5))
+    )
+    logger.info(f"Webhook set with {dispatcher.workers} workers")
+    return dispatcher
+
+
+def run_webhook_server(bot) -> None:
+    """Run a standalone web server receiving updates for the bot."""
+    app = Flask(__name__)
+    tracing.init_app(app)
+    setup_webhook(bot, app)
+    app.run(host=WEBHOOK_HOST, port=WEBHOOK_PORT, threaded=True)